@@ -20,6 +20,27 @@ db = SQLAlchemy()
 socketio = SocketIO()
 
 
+def _add_missing_columns():
+    """
+    db.create_all() never alters existing tables: add columns introduced after the
+    database was created (new columns are nullable, so a plain ADD COLUMN is enough).
+    """
+    from sqlalchemy import inspect, text
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            have = {c['name'] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                col_type = col.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+                logging.getLogger(__name__).info("Added column %s.%s", table.name, col.name)
+
+
 def create_app(config_override=None):
     app = Flask(__name__)
     app.config.from_object('app.config.Config')
@@ -40,6 +61,7 @@ def create_app(config_override=None):
     with app.app_context():
         try:
             db.create_all()
+            _add_missing_columns()
             logging.getLogger(__name__).info("Database initialized successfully")
         except Exception as e:
             logging.getLogger(__name__).warning(
@@ -19,6 +19,9 @@ else:
     os.makedirs(os.path.dirname(_db_path), exist_ok=True)
     _DEFAULT_DB = 'sqlite:///' + _db_path
 
+# Blacklist of CIDRs / IPs / ranges the scanner never probes (hot-reloaded during scans)
+EXCLUSIONS_FILE = os.environ.get('EXCLUSIONS_FILE') or os.path.join(BASE_DIR, 'data', 'exclusions.txt')
+
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'sh-scanner-v2-secret-key-change-me')
@@ -35,6 +38,7 @@ class Config:
         }
 
     BASE_DIR = BASE_DIR
+    EXCLUSIONS_FILE = EXCLUSIONS_FILE
     APP_NAME = 'CDN IP Scanner'
     VERSION = '2.0'
     AUTHOR = 'shahinst'
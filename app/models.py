@@ -13,8 +13,11 @@ class ScanResult(db.Model):
     ip = db.Column(db.String(45), nullable=False, index=True)
     ping = db.Column(db.Float, nullable=True)
     open_ports = db.Column(db.Text, nullable=True)  # JSON list
+    inferred_ports = db.Column(db.Text, nullable=True)  # JSON list: subset of open_ports taken from the /24 profile
+    latency = db.Column(db.Text, nullable=True)  # JSON: connect/TLS/TTFB breakdown (SHProbeTimings.summary)
     score = db.Column(db.Float, default=0.0)
     operator = db.Column(db.String(100), nullable=True)
+    colo = db.Column(db.String(8), nullable=True)  # PoP from the trace body (e.g. FRA)
     scan_session_id = db.Column(db.Integer, db.ForeignKey('scan_sessions.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -25,8 +28,11 @@ class ScanResult(db.Model):
             'ip': self.ip,
             'ping': self.ping,
             'open_ports': json.loads(self.open_ports) if self.open_ports else [],
+            'inferred_ports': json.loads(self.inferred_ports) if self.inferred_ports else [],
+            'latency': json.loads(self.latency) if self.latency else None,
             'score': self.score,
             'operator': self.operator or '',
+            'colo': self.colo or '',
             'created_at': self.created_at.isoformat() if self.created_at else None,
         }
 
@@ -91,6 +97,37 @@ class OperatorMatrix(db.Model):
     )
 
 
+class BlockStat(db.Model):
+    """Per-/24, per-operator summary of ScanResult history (kept up to date by AIOptimizer)."""
+    __tablename__ = 'block_stats'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    operator = db.Column(db.String(100), nullable=False, default='')
+    block = db.Column(db.Integer, nullable=False)  # ip >> 8
+    hits = db.Column(db.Integer, default=0)
+    probes = db.Column(db.Integer, default=0)  # known probe count (0 = not recorded)
+    ping_sum = db.Column(db.Float, default=0.0)
+    ping_sq_sum = db.Column(db.Float, default=0.0)
+    ping_min = db.Column(db.Float, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('operator', 'block', name='uix_operator_block'),
+    )
+
+
+class LivenessMap(db.Model):
+    """Census result per vantage (operator + port): which /24s answered TCP, and when."""
+    __tablename__ = 'liveness_maps'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    vantage = db.Column(db.String(120), nullable=False, unique=True, index=True)
+    probed_blocks = db.Column(db.Text, nullable=True)  # base64 uint32 /24 numbers (see scanner/census.py)
+    live_blocks = db.Column(db.Text, nullable=True)
+    probed_at = db.Column(db.Text, nullable=True)      # base64 uint32 sweep time of each probed block, same order
+    n_probed = db.Column(db.Integer, default=0)
+    n_live = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class AppSetting(db.Model):
     __tablename__ = 'app_settings'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -5,17 +5,27 @@ Author: shahinst
 
 import json
 import time
+import calendar
+import itertools
 import threading
 import traceback
 from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
 from app import db, socketio
+from app.config import EXCLUSIONS_FILE
 from app.models import (
     ScanResult, ScanSession, ClosedIP, OperatorRange,
-    OperatorMatrix, AppSetting, ScanLog
+    OperatorMatrix, AppSetting, ScanLog, LivenessMap
 )
-from app.scanner.core import SHScanner, SHNetUtils, SPEED_MODES
+from app.scanner.core import SHScanner, SHNetUtils, SPEED_MODES, ip_to_int
+from app.scanner.census import SHLivenessMap, range_blocks, census_targets
+from app.scanner.probes import TLS_SESSION_CACHE
+from app.scanner.bandit import SHBlockBandit
+from app.scanner.ai_optimizer import AIOptimizer
 from app.scanner.range_fetcher import RangeFetcher
+from app.scanner.ranges import SHRangeIndex, RANGE_WEIGHTINGS
+from app.scanner.exclusions import SHExclusions
+from app.scanner.strategy import parse_strategy
 from app.scanner.operators import (
     OPERATORS_BY_COUNTRY, fetch_all_operator_prefixes
 )
@@ -26,6 +36,9 @@ api_bp = Blueprint('api', __name__)
 # Global scanner instances
 _scanner = SHScanner()
 _v2ray_scanner = V2RayScanner()
+_block_bandit = None  # adaptive /24 sampler of the current/last scan (see /scan/blocks)
+_optimizer = AIOptimizer()  # learned range ranking from ScanResult history
+_exclusions = SHExclusions(EXCLUSIONS_FILE)  # blacklist file + ClosedIP + known IPs, checked per candidate
 _active_session_id = None
 _user_stop_requested = False  # set by stop_scan(), checked by run_scan() to exit batch loop
 _log_enabled = False
@@ -206,6 +219,72 @@ def build_v2ray_config():
 
 # ========== Scanning ==========
 
+class _CountingStream:
+    """Iterator wrapper that counts the IPs actually handed to a scanner (.pulled)."""
+
+    def __init__(self, source):
+        self._source = iter(source)
+        self.pulled = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        ip = next(self._source)
+        self.pulled += 1
+        return ip
+
+
+def _census_live_ranges(scan_ranges, ports, vantage, ttl_sec, sess_id, on_progress, start_time):
+    """
+    Census phase 1: TCP-probe a couple of hosts per /24 the stored liveness map for this
+    vantage lacks or swept over ttl_sec ago, store the merged map, and return the live /24s
+    (collapsed to CIDRs) plus any single IPs of the input. None if the scan was stopped.
+    """
+    blocks = range_blocks(scan_ranges)
+    row = LivenessMap.query.filter_by(vantage=vantage).first()
+    lmap = SHLivenessMap()
+    if row and row.updated_at:
+        lmap = SHLivenessMap.unpack(row.probed_blocks, row.live_blocks, row.probed_at,
+                                    calendar.timegm(row.updated_at.timetuple()))
+        lmap.expire(ttl_sec)  # blocks swept more than ttl_sec ago are re-swept
+
+    unknown = lmap.unknown_blocks(blocks)
+    if unknown:
+        targets = _exclusions.drop(census_targets(unknown))
+        live = set()
+        _emit_log('INFO', f'Census: TCP sweep of {len(unknown)} /24 blocks ({len(targets)} probes) '
+                          f'— {len(blocks) - len(unknown)} known from the stored map', sess_id)
+        _scanner.batch_scan(
+            targets, ports[:1],
+            progress_callback=on_progress,
+            result_callback=lambda r: live.add(ip_to_int(r['ip']) >> 8),
+            start_time=start_time,
+            probe='tcp',
+        )
+        if _scanner._stop_flag:
+            return None
+        lmap.merge(unknown, live)
+        if row is None:
+            row = LivenessMap(vantage=vantage)
+            db.session.add(row)
+        row.probed_blocks, row.live_blocks, row.probed_at = lmap.pack()
+        row.n_probed, row.n_live = len(lmap.probed), len(lmap.live)
+        row.updated_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+    else:
+        _emit_log('INFO', f'Census: all {len(blocks)} /24 blocks covered by the stored map for {vantage}, skipping sweep', sess_id)
+
+    live_ranges = lmap.live_cidrs(blocks)
+    singles = [r for r in scan_ranges if r and '/' not in str(r)]
+    n_live = sum(1 for b in blocks if b in lmap.live)
+    _emit_log('INFO', f'Census: {n_live}/{len(blocks)} /24 blocks live → {len(live_ranges)} ranges for verification', sess_id)
+    return live_ranges + singles
+
+
 @api_bp.route('/scan/start', methods=['POST'])
 def start_scan():
     global _active_session_id, _log_enabled, _debug_enabled
@@ -214,6 +293,42 @@ def start_scan():
     ranges_input = data.get('ranges', [])
     scan_method = data.get('scan_method', 'cloud')
     mode = data.get('mode', 'hyper')
+    engine = (data.get('engine') or 'thread').strip().lower()
+    verifier = (data.get('verifier') or 'raw').strip().lower()
+    verify_policy = (data.get('verify_policy') or 'sprt').strip().lower()
+    defer_ports = str(data.get('defer_ports', False)).lower() in ('true', '1', 'yes')
+    infer_ports = str(data.get('infer_ports', True)).lower() in ('true', '1', 'yes')
+    sampler = (data.get('sampler') or 'bandit').strip().lower()
+    scan_order = (data.get('order') or 'default').strip().lower()  # 'history' = historically best first
+    range_weighting = (data.get('range_weighting') or 'source').strip().lower()
+    if range_weighting not in RANGE_WEIGHTINGS:
+        range_weighting = 'source'
+    census = str(data.get('census', False)).lower() in ('true', '1', 'yes')
+    skip_known = str(data.get('skip_known', False)).lower() in ('true', '1', 'yes')
+    colos = data.get('colos') or ''  # only these colos, e.g. "FRA,AMS"
+    exclude_colos = data.get('exclude_colos') or ''
+    strategy = data.get('strategy') or 'check'  # probe tiers: 'tcp', 'tls', 'tcp,tls,trace', 'funnel', ...
+    try:
+        parse_strategy(strategy)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid strategy: {e}'}), 400
+    pipeline = str(data.get('pipeline', True)).lower() in ('true', '1', 'yes')  # pre-filter pool → verify pool
+    try:
+        verify_workers = max(0, int(data.get('verify_workers') or 0))
+        verify_queue = max(0, int(data.get('verify_queue') or 0))
+    except (TypeError, ValueError):
+        verify_workers = verify_queue = 0
+    cdn = (data.get('cdn') or 'auto').strip().lower()  # probe profile: auto (by range source) / cloudflare / fastly
+    try:
+        census_ttl_sec = max(0.0, float(data.get('census_ttl_hours', 6))) * 3600
+    except (ValueError, TypeError):
+        census_ttl_sec = 6 * 3600
+    adaptive = str(data.get('adaptive', True)).lower() in ('true', '1', 'yes')
+    try:
+        rate_limit = max(0.0, float(data.get('rate_limit') or 0))
+        rate_limit_per_24 = max(0.0, float(data.get('rate_limit_per_24') or 0))
+    except (ValueError, TypeError):
+        rate_limit = rate_limit_per_24 = 0.0
     target_count = data.get('target_count', 100)
     ping_min = int(data.get('ping_min', 0))
     ping_max = int(data.get('ping_max', 9999))
@@ -270,11 +385,30 @@ def start_scan():
                     return
 
                 # Configure scanner
+                _scanner.set_adaptive(adaptive)
                 _scanner.set_mode(mode)
+                _scanner.set_engine(engine)
+                _scanner.set_rate_limit(rate_limit, rate_limit_per_24)
+                _scanner.set_verifier(verifier)
+                _scanner.set_verify_policy(verify_policy)
+                _scanner.set_defer_ports(defer_ports)
+                _scanner.set_port_inference(infer_ports)
+                _scanner.set_colo_filter(colos, exclude_colos)
+                _scanner.set_strategy(strategy)
+                _scanner.set_pipeline(pipeline, verify_workers or None, verify_queue or None)
+                if _scanner.strategy.tiers != ('tcp', 'trace'):
+                    _emit_log('INFO', f'Probe strategy: {_scanner.strategy.name}', sess_id)
+                if _scanner.colo_filter.enabled and not _scanner.strategy.verifies:
+                    _emit_log('WARN', 'Colo filter needs the trace tier; it has no effect with this strategy.', sess_id)
+                if _scanner.colo_filter.enabled:
+                    colo_stats = _scanner.colo_filter.stats()
+                    _emit_log('INFO', f'Colo filter: only {",".join(colo_stats["include"]) or "any"}, '
+                                      f'never {",".join(colo_stats["exclude"]) or "—"}', sess_id)
                 _scanner.max_latency_ms = ping_max
                 _scanner.timeout = min(10, max(2, ping_max / 1000.0 * 1.5))
 
-                _emit_log('INFO', f'Scan started: method={scan_method}, mode={mode}', sess_id)
+                TLS_SESSION_CACHE.reset_stats()
+                _emit_log('INFO', f'Scan started: method={scan_method}, mode={mode}, engine={_scanner.engine}', sess_id)
 
                 # Handle V2Ray scan method
                 v2ray_parsed = None
@@ -289,20 +423,28 @@ def start_scan():
                     _v2ray_scanner.reset()
                     _v2ray_scanner.log_callback = _scanner_log
                     mode_cfg = SPEED_MODES.get(mode, SPEED_MODES['hyper'])
-                    _v2ray_scanner.max_workers = max(20, int(50 * mode_cfg['resource_pct']))
+                    v2ray_start = max(20, int(50 * mode_cfg['resource_pct']))
+                    _v2ray_scanner.set_concurrency(
+                        start=v2ray_start,
+                        cap=max(v2ray_start, int(100 * mode_cfg['cap_pct'])),
+                        adaptive=adaptive,
+                    )
+                    _v2ray_scanner.set_rate_limit(rate_limit, rate_limit_per_24)
                     _emit_log('INFO', f'V2Ray config parsed: {v2ray_parsed["protocol"]}', sess_id)
 
                 # Build IPs from ranges using /24-splitting mechanism
                 mode_cfg = SPEED_MODES.get(mode, SPEED_MODES['hyper'])
                 ips_per_24 = mode_cfg.get('ips_per_24', 30)
                 scan_ranges = list(ranges_input) if ranges_input else []
+                range_sources = {'input': scan_ranges}
 
                 if scan_method == 'operators':
                     if not scan_ranges:
                         _emit_log('INFO', 'Operator mode: fetching CDN IP ranges...', sess_id)
                         try:
                             # فقط از منابع رسمی
-                            scan_ranges = RangeFetcher.fetch_by_source('all')
+                            range_sources = RangeFetcher.fetch_sources('all')
+                            scan_ranges = [r for rs in range_sources.values() for r in rs]
                             _emit_log('INFO', f'Fetched {len(scan_ranges)} CDN ranges (official)', sess_id)
                         except Exception as e:
                             _emit_log('ERROR', f'Failed to fetch CDN ranges: {e}', sess_id)
@@ -311,6 +453,22 @@ def start_scan():
                     if not scan_ranges:
                         _emit_log('WARN', 'No CDN ranges. Paste CDN ranges or click Fetch Ranges.', sess_id)
 
+                # Normalize: overlapping / duplicate ranges collapse into one disjoint space
+                range_index = SHRangeIndex.build(range_sources)
+                scan_ranges = [cidr for cidr, _ in range_index.to_cidrs()]
+                idx_stats = range_index.stats()
+                if idx_stats['duplicate_blocks']:
+                    _emit_log('INFO', f'Ranges normalized: {idx_stats["blocks"]} unique /24 blocks in {len(scan_ranges)} CIDRs '
+                                      f'({idx_stats["duplicate_blocks"]} overlapping /24s merged)', sess_id)
+
+                # Per-CDN probe profiles: each IP is verified with its CDN's request; ranges
+                # whose CDN answers on none of the selected ports are not scanned at all
+                _scanner.set_probe_profiles(range_index, force=cdn)
+                if not (scan_method == 'v2ray' and v2ray_parsed):
+                    scan_ranges, n_dropped = _scanner.probe_profiles.prune(scan_ranges, ports)
+                    if n_dropped:
+                        _emit_log('INFO', f'Skipping {n_dropped} ranges: their CDN serves none of ports {ports}', sess_id)
+
                 # Batch size per round
                 batch_size = max(target_count * 100, 5000) if target_count else 100000
                 max_total_scanned = 500000  # safety: stop after 500k IPs tried
@@ -324,10 +482,13 @@ def start_scan():
                         pct = min(100.0, (found / target_count) * 100.0)
                     else:
                         pct = (done / total_ips * 100) if total_ips > 0 else 0
+                    active = _v2ray_scanner if scan_method == 'v2ray' and v2ray_parsed else _scanner
                     socketio.emit('scan_progress', {
                         'done': total_scanned + done, 'total': total_scanned + total_ips,
                         'percent': round(pct, 1), 'speed': round(speed, 1),
                         'elapsed': round(elapsed, 1), 'session_id': sess_id,
+                        'concurrency': active.concurrency_target(),
+                        'stages': _scanner.pipeline.snapshot() if active is _scanner else [],
                     }, namespace='/')
 
                 _session_operator_name = ''
@@ -350,6 +511,30 @@ def start_scan():
 
                 _emit_log('INFO', f'Target: {target_count or "unlimited"} — scan will run until target reached or max IPs tried', sess_id)
 
+                pending_rows = {}  # ip → ScanResult still waiting for deferred port probes
+
+                def on_enriched(update):
+                    sr = pending_rows.pop(update['ip'], None)
+                    if sr is None:
+                        return
+                    sr.open_ports = json.dumps(update['open_ports'])
+                    sr.score = SHScanner.calc_score({
+                        'ping': sr.ping, 'open_ports': update['open_ports'],
+                        'latency': json.loads(sr.latency) if sr.latency else None,
+                    })
+                    try:
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                    socketio.emit('scan_result_update', {
+                        'ip': update['ip'],
+                        'open_ports': update['open_ports'],
+                        'score': round(sr.score, 1),
+                        'session_id': sess_id,
+                    }, namespace='/')
+
+                _scanner.enrich_callback = on_enriched
+
                 def on_result(result):
                     nonlocal found
                     if target_count and found >= target_count:
@@ -370,11 +555,16 @@ def start_scan():
                         ip=result['ip'],
                         ping=result.get('ping'),
                         open_ports=json.dumps(result.get('open_ports', [])),
+                        inferred_ports=json.dumps(result['inferred_ports']) if result.get('inferred_ports') else None,
+                        latency=json.dumps(result['latency']) if result.get('latency') else None,
                         score=score,
                         operator=operator_name,
+                        colo=result.get('colo'),
                         scan_session_id=sess_id,
                     )
                     db.session.add(sr)
+                    if result.get('ports_pending'):
+                        pending_rows[result['ip']] = sr
                     found += 1
                     socketio.emit('scan_result', {
                         'ip': result['ip'],
@@ -382,15 +572,88 @@ def start_scan():
                         'open_ports': result.get('open_ports', []),
                         'score': round(score, 1),
                         'operator': operator_name,
+                        'colo': result.get('colo') or '',
+                        'cdn': result.get('cdn') or '',
+                        'loc': (result.get('trace') or {}).get('loc', ''),
                         'session_id': sess_id,
                         'is_v2ray': scan_method == 'v2ray',
+                        'ports_pending': bool(result.get('ports_pending')),
+                        'inferred_ports': result.get('inferred_ports', []),
+                        'latency': result.get('latency'),
                     }, namespace='/')
-                    _emit_log('INFO', f'Found: {result["ip"]} ping={round(result.get("ping",0),1)}ms ports={result.get("open_ports",[])} op={operator_name}', sess_id)
+                    _emit_log('INFO', f'Found: {result["ip"]} ping={round(result.get("ping",0),1)}ms ports={result.get("open_ports",[])} op={operator_name} colo={result.get("colo") or "—"}', sess_id)
                     try:
                         db.session.commit()
                     except Exception:
                         db.session.rollback()
 
+                # Exclusions: blacklist file, closed IPs and (optionally) IPs found before
+                _exclusions.skipped = 0
+                _exclusions.reload_if_changed()
+                _exclusions.reload_callback = lambda st: _emit_log(
+                    'INFO', f'Exclusion list reloaded: {st["intervals"]} intervals', sess_id)
+                _exclusions.set_source('closed', [ip for (ip,) in ClosedIP.query.with_entities(ClosedIP.ip)])
+                if skip_known:
+                    _exclusions.set_source('known', [ip for (ip,) in ScanResult.query.with_entities(ScanResult.ip)
+                                                     .filter(ScanResult.scan_session_id != sess_id).distinct()])
+                else:
+                    _exclusions.clear_source('known')
+                ex_stats = _exclusions.stats()
+                if ex_stats['intervals']:
+                    _emit_log('INFO', f'Excluding {ex_stats["addresses"]} addresses in {ex_stats["intervals"]} intervals '
+                                      f'({", ".join(f"{k}: {v}" for k, v in ex_stats["sources"].items() if v)})', sess_id)
+
+                # Census mode: TCP liveness sweep first, then verify inside live /24s only
+                if census and not (scan_method == 'v2ray' and v2ray_parsed):
+                    scan_ranges = _census_live_ranges(
+                        scan_ranges, ports, f'{operator_key or "local"}:{ports[0]}', census_ttl_sec,
+                        sess_id, on_progress, start_time,
+                    )
+                    if scan_ranges is None:
+                        scan_ranges = []  # stopped during phase 1
+
+                # One lazy, non-repeating IP stream per session; batches are slices of it.
+                # Every address is probed at most once, so failed_cache is not re-filled per batch.
+                session_budget = max_total_scanned if target_count else batch_size
+                history_operator = _session_operator_name if scan_method in ('operators', 'v2ray') else ''
+                priority_blocks = None
+                if scan_order == 'history' and scan_ranges:
+                    try:
+                        _optimizer.sync_summary()
+                        priority_blocks, scan_ranges = _optimizer.history_first(scan_ranges, history_operator)
+                        _emit_log('INFO', f'History-first order: {len(priority_blocks)} historically good /24 blocks first', sess_id)
+                    except Exception as e:
+                        _emit_log('WARN', f'History ranking unavailable: {e}', sess_id)
+                score_fn = None
+                if range_weighting == 'learned':
+                    try:
+                        if scan_order != 'history':
+                            _optimizer.sync_summary()
+                        score_fn = lambda cidr: _optimizer.range_score(cidr, history_operator)
+                    except Exception as e:
+                        _emit_log('WARN', f'Learned range weighting unavailable: {e}', sess_id)
+                # The budget caps IPs after the exclusion filter: excluded addresses cost nothing
+                session_ips = itertools.islice(_exclusions.filter(SHNetUtils.iter_scan_ips(
+                    scan_ranges, per_block=ips_per_24,
+                    priority_blocks=priority_blocks,
+                    weights=range_index.weights_for(scan_ranges, range_weighting, score_fn),
+                )), session_budget)
+                session_total = SHNetUtils.count_scan_ips(
+                    scan_ranges, per_block=ips_per_24, max_total=session_budget,
+                )
+                # Adaptive /24 sampling: probes move toward blocks that verify (V2Ray tests
+                # report no per-IP outcomes, so they keep the plain stream)
+                global _block_bandit
+                _block_bandit = None
+                _scanner.block_bandit = None
+                if sampler == 'bandit' and not (scan_method == 'v2ray' and v2ray_parsed):
+                    _block_bandit = SHBlockBandit(session_ips, per_block=ips_per_24, budget=session_total,
+                                                  exclude=_exclusions, scope=scan_ranges)
+                    _scanner.block_bandit = _block_bandit
+                    session_ips = _block_bandit
+                # session_total is an upper bound (exclusions and the bandit drop IPs): count what is pulled
+                session_ips = _CountingStream(session_ips)
+
                 batch_num = 0
                 global _user_stop_requested
                 _user_stop_requested = False
@@ -405,29 +668,30 @@ def start_scan():
                         break
 
                     batch_num += 1
-                    all_ips = SHNetUtils.generate_scan_ips(
-                        scan_ranges,
-                        per_block=ips_per_24,
-                        max_total=batch_size,
-                        shuffle=True,
-                    )
-                    if not all_ips:
+                    batch_total = min(batch_size, session_total - total_scanned)
+                    if batch_total <= 0:
                         _emit_log('WARN', 'No more IPs to generate from ranges.', sess_id)
                         break
+                    # Next slice of the session stream — never overlaps earlier batches
+                    pulled_before = session_ips.pulled
+                    first_ip = next(session_ips, None)
+                    if first_ip is None:
+                        _emit_log('INFO', 'IP stream exhausted: no more IPs to scan in these ranges.', sess_id)
+                        break
+                    all_ips = itertools.chain((first_ip,), itertools.islice(session_ips, batch_total - 1))
 
-                    _emit_log('INFO', f'Batch {batch_num}: scanning {len(all_ips)} IPs (target {target_count or "—"}, found {found} so far)', sess_id)
+                    _emit_log('INFO', f'Batch {batch_num}: scanning up to {batch_total} IPs (target {target_count or "—"}, found {found} so far)', sess_id)
                     socketio.emit('scan_status', {
-                        'status': 'scanning', 'total': total_scanned + len(all_ips), 'session_id': sess_id
+                        'status': 'scanning', 'total': total_scanned + batch_total, 'session_id': sess_id
                     }, namespace='/')
 
-                    _scanner.reset()
-
                     if scan_method == 'v2ray' and v2ray_parsed:
                         _v2ray_scanner.scan_ips(
-                            v2ray_parsed, [str(ip) for ip in all_ips],
+                            v2ray_parsed, all_ips,
                             timeout=min(8, ping_max / 1000.0 * 1.5),
                             progress_callback=on_progress,
                             result_callback=on_result,
+                            total=batch_total,
                         )
                     else:
                         _scanner.batch_scan(
@@ -435,9 +699,11 @@ def start_scan():
                             progress_callback=on_progress,
                             result_callback=on_result,
                             start_time=start_time,
+                            carry_over=bool(target_count),
+                            total=batch_total,
                         )
 
-                    total_scanned += len(all_ips)
+                    total_scanned += session_ips.pulled - pulled_before
                     if target_count and found >= target_count:
                         _emit_log('INFO', f'Target reached: {found} IPs found.', sess_id)
                         break
@@ -447,6 +713,19 @@ def start_scan():
                         _emit_log('INFO', 'Scan stopped by user.', sess_id)
                         break
 
+                # Checks still running from the last batch (pool is never drained between batches)
+                if not _user_stop_requested and not (target_count and found >= target_count):
+                    _scanner.finish_batches(
+                        ports,
+                        progress_callback=on_progress,
+                        result_callback=on_result,
+                        start_time=start_time,
+                    )
+
+                # Deferred extra-port probes of IPs already reported (bounded by the port timeout)
+                if pending_rows and not _user_stop_requested:
+                    _scanner.finish_enrichment(timeout=_scanner._port_timeout() + 5)
+
                 try:
                     db.session.commit()
                 except Exception:
@@ -463,12 +742,69 @@ def start_scan():
                     sess.completed_at = datetime.utcnow()
                     db.session.commit()
 
+                # Fold this session into the per-/24 history summary used by order=history
+                try:
+                    _optimizer.sync_summary(
+                        block_probes=_block_bandit.probe_counts() if _block_bandit is not None else None,
+                        session_id=sess_id, operator=history_operator,
+                    )
+                except Exception as e:
+                    db.session.rollback()
+                    _emit_log('WARN', f'History summary update failed: {e}', sess_id)
+
                 _emit_log('INFO', f'Scan complete: {found}/{total_scanned} IPs found in {elapsed:.1f}s', sess_id)
+                if _scanner.rate_limiter is not None:
+                    _emit_log('INFO', f'Rate limiter: {_scanner.rate_limiter.stats()}', sess_id)
+                verify_stats = _scanner.verify_policy.stats()
+                if verify_stats['ips']:
+                    _emit_log('INFO', f'Verification ({verify_stats["policy"]}): {verify_stats["attempts_per_ip"]} attempts/IP, '
+                                      f'{verify_stats["early_accepts"]} early accepts, {verify_stats["early_rejects"]} early rejects, '
+                                      f'~{verify_stats["probe_time_saved_sec"]}s probe time saved', sess_id)
+                if _block_bandit is not None:
+                    _emit_log('INFO', f'Block sampler: {_block_bandit.stats()}', sess_id)
+                if _exclusions.skipped:
+                    _emit_log('INFO', f'Exclusions: {_exclusions.skipped} candidate IPs skipped before probing', sess_id)
+                port_stats = _scanner.port_profiles.stats()
+                if port_stats['inferred']:
+                    _emit_log('INFO', f'Port profiles: {port_stats["inferred"]} IPs inferred, {port_stats["probed"]} probed '
+                                      f'({port_stats["profiled"]} /24 profiles, {port_stats["mismatches"]} spot-check mismatches)', sess_id)
+                strategy_stats = _scanner.strategy.stats()
+                _emit_log('INFO', 'Probe tiers: ' + ', '.join(
+                    f'{t["tier"]} {t["entered"]} in / {t["passed"]} passed '
+                    f'({t["throughput"]}/s, reject {t["rejection_rate"] if t["rejection_rate"] is not None else "—"})'
+                    for t in strategy_stats['tiers']), sess_id)
+                stage_stats = _scanner.pipeline.snapshot()
+                if stage_stats:
+                    _emit_log('INFO', 'Pipeline: ' + ' → '.join(
+                        f'{st["stage"]} ({"+".join(st["tiers"])}, {st["workers"]} workers) '
+                        f'{st["done"]} done / {st["passed"]} passed, {st["avg_throughput"]}/s'
+                        + (f', queue peak {st["queue_peak"]}/{st["queue_max"]}' if st['stage'] == 'verify' else '')
+                        for st in stage_stats), sess_id)
+                profile_stats = _scanner.probe_profiles.stats()
+                if len(profile_stats['verified']) > 1 or profile_stats['no_ports']:
+                    _emit_log('INFO', f'Probe profiles: {profile_stats["verified"]} IPs per CDN, '
+                                      f'{profile_stats["no_ports"]} skipped for lack of a usable port', sess_id)
+                colo_stats = _scanner.colo_filter.stats()
+                if colo_stats['colos']:
+                    _emit_log('INFO', f'Colos: {colo_stats["colos"]} — {colo_stats["rejected"]} filtered out, '
+                                      f'{colo_stats["unwanted_blocks"]} /24s written off, {colo_stats["skipped"]} probes skipped', sess_id)
+                tls_stats = TLS_SESSION_CACHE.stats()
+                if tls_stats['hits'] or tls_stats['misses']:
+                    saved = tls_stats['cpu_saved_ms']
+                    _emit_log('INFO', f'TLS sessions: {tls_stats["resumed"]} resumed / {tls_stats["full"]} full handshakes, '
+                                      + (f'~{saved:.0f} ms handshake CPU saved' if saved is not None
+                                         else 'handshake CPU not measured on this engine'), sess_id)
                 socketio.emit('scan_complete', {
                     'session_id': sess_id,
                     'total_scanned': total_scanned,
                     'total_found': found,
                     'duration': round(elapsed, 1),
+                    'tls_sessions': tls_stats,
+                    'verification': verify_stats,
+                    'port_profiles': port_stats,
+                    'colos': colo_stats,
+                    'strategy': strategy_stats,
+                    'stages': stage_stats,
                 }, namespace='/')
 
             except Exception as e:
@@ -482,6 +818,8 @@ def start_scan():
                 except Exception:
                     db.session.rollback()
                 socketio.emit('scan_error', {'error': str(e), 'session_id': sess_id}, namespace='/')
+            finally:
+                _scanner.close_pool()
 
     thread = threading.Thread(target=run_scan, daemon=True)
     thread.start()
@@ -508,13 +846,72 @@ def stop_scan():
 def get_results():
     session_id = request.args.get('session_id', type=int)
     limit = request.args.get('limit', 200, type=int)
+    colo = (request.args.get('colo') or '').strip().upper()
     q = ScanResult.query
     if session_id:
         q = q.filter_by(scan_session_id=session_id)
+    if colo:
+        q = q.filter_by(colo=colo)
     results = q.order_by(ScanResult.score.desc()).limit(limit).all()
     return jsonify([r.to_dict() for r in results])
 
 
+@api_bp.route('/scan/blocks', methods=['GET'])
+def get_block_stats():
+    """Per-/24 sampler statistics of the current (or last) scan."""
+    limit = request.args.get('limit', 200, type=int)
+    if _block_bandit is None:
+        return jsonify({'summary': None, 'blocks': []})
+    return jsonify({'summary': _block_bandit.stats(), 'blocks': _block_bandit.block_stats(limit)})
+
+
+@api_bp.route('/ranges/rank', methods=['POST'])
+def rank_ranges():
+    """Rank ranges by scan history: {ranges, operator, limit} → ranked ranges + best /24s."""
+    data = request.json or {}
+    ranges = [str(r).strip() for r in data.get('ranges', []) if str(r).strip()]
+    operator = (data.get('operator') or '').strip()
+    try:
+        limit = int(data.get('limit') or len(ranges) or 100)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    _optimizer.sync_summary()
+    return jsonify({
+        'ranges': _optimizer.predict_best_ranges(ranges, limit=limit, operator=operator),
+        'blocks': _optimizer.block_table(operator),
+    })
+
+
+@api_bp.route('/exclusions', methods=['GET'])
+def get_exclusions():
+    """Exclusion index summary (intervals per source, candidates skipped by the current scan)."""
+    _exclusions.reload_if_changed()
+    return jsonify(_exclusions.stats())
+
+
+@api_bp.route('/exclusions', methods=['POST'])
+def set_exclusions():
+    """Write the blacklist file: {entries: [...] or text, append: bool}. Running scans pick it up."""
+    data = request.json or {}
+    entries = data.get('entries', [])
+    if isinstance(entries, str):
+        entries = entries.replace(',', '\n').splitlines()
+    append = str(data.get('append', False)).lower() in ('true', '1', 'yes')
+    try:
+        _exclusions.write_file(entries, append=append)
+    except OSError as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(_exclusions.stats())
+
+
+@api_bp.route('/exclusions/reload', methods=['POST'])
+def reload_exclusions():
+    _exclusions.reload()
+    return jsonify(_exclusions.stats())
+
+
 @api_bp.route('/scan/sessions', methods=['GET'])
 def get_sessions():
     sessions = ScanSession.query.order_by(ScanSession.id.desc()).limit(20).all()
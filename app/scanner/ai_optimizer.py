@@ -1,50 +1,272 @@
 """
 CDN IP Scanner V2.0 - AI Optimizer
 Author: shahinst
+
+Learned range ranking from scan history:
+  - ScanResult rows are folded into a per-/24, per-operator summary (BlockStat)
+    incrementally after every session — hits, probes, ping sum/min, last seen
+  - Block score = smoothed hit rate × latency factor × recency decay
+  - Per-CIDR scores come from prefix sums over the sorted block scores, so ranking
+    thousands of ranges is a bisect per range, not a table scan
 """
 
 import math
+import time
 import random
+import bisect
+import calendar
+import heapq
 import ipaddress
+import threading
+
+from app.scanner.core import ip_to_int, int_to_ip
+
+_SYNC_SETTING = 'ai_block_stats_session'  # last session folded into BlockStat
 
 
 class AIOptimizer:
-    def __init__(self):
+    def __init__(self, half_life_days=7.0, latency_ref_ms=500.0):
         self.successful_patterns = {
             'cloudflare': ['104.16.0.0/13', '104.24.0.0/14', '162.159.0.0/19', '172.64.0.0/13'],
             'fastly': ['151.101.0.0/16', '199.232.0.0/16']
         }
         self.priority_ports = [443, 80, 8443, 2053, 2083, 2087, 2096]
+        self.half_life_days = half_life_days
+        self.latency_ref_ms = latency_ref_ms
+        self._lock = threading.Lock()
+        self._index = {}  # operator → (sorted blocks, block scores, prefix sums)
+
+    # ---------- summary maintenance ----------
+
+    def sync_summary(self, block_probes=None, session_id=None, operator=''):
+        """
+        Fold every finished session not yet summarized into BlockStat (incremental:
+        only those sessions' ScanResult rows are read). block_probes {block: probes}
+        is the probe count per /24 of session_id (scanned for `operator`), when the
+        scan tracked it. Returns the number of sessions folded in.
+        """
+        from app import db
+        from app.models import ScanResult, ScanSession, BlockStat, AppSetting
+
+        operator = (operator or '').strip()
+        last = int(AppSetting.get(_SYNC_SETTING, 0) or 0)
+        sessions = (ScanSession.query.filter(ScanSession.id > last)
+                    .filter(ScanSession.status.in_(('completed', 'stopped')))
+                    .order_by(ScanSession.id).all())
+        if not sessions:
+            return 0
+
+        for sess in sessions:
+            agg = {}  # (operator, block) → [hits, ping_sum, ping_sq_sum, ping_min, last_seen]
+            for ip, ping, op_name, created_at in (
+                    ScanResult.query.with_entities(ScanResult.ip, ScanResult.ping,
+                                                   ScanResult.operator, ScanResult.created_at)
+                    .filter_by(scan_session_id=sess.id)):
+                try:
+                    block = ip_to_int(ip) >> 8
+                except OSError:
+                    continue
+                a = agg.setdefault(((op_name or '').strip(), block), [0, 0.0, 0.0, None, None])
+                a[0] += 1
+                if ping is not None:
+                    a[1] += ping
+                    a[2] += ping * ping
+                    a[3] = ping if a[3] is None else min(a[3], ping)
+                if created_at and (a[4] is None or created_at > a[4]):
+                    a[4] = created_at
+
+            probes = block_probes if (block_probes and sess.id == session_id) else {}
+            for block in probes:
+                agg.setdefault((operator, block), [0, 0.0, 0.0, None, None])
+
+            existing = {}
+            for key_op in {op for op, _ in agg}:
+                blocks = [b for op, b in agg if op == key_op]
+                for start in range(0, len(blocks), 500):
+                    for row in BlockStat.query.filter(BlockStat.operator == key_op,
+                                                      BlockStat.block.in_(blocks[start:start + 500])):
+                        existing[(row.operator, row.block)] = row
+
+            for (op, block), (hits, ping_sum, ping_sq, ping_min, seen) in agg.items():
+                row = existing.get((op, block))
+                if row is None:
+                    row = BlockStat(operator=op, block=block, hits=0, probes=0,
+                                    ping_sum=0.0, ping_sq_sum=0.0)
+                    db.session.add(row)
+                row.hits = (row.hits or 0) + hits
+                if op == operator:
+                    row.probes = (row.probes or 0) + probes.get(block, 0)
+                row.ping_sum = (row.ping_sum or 0.0) + ping_sum
+                row.ping_sq_sum = (row.ping_sq_sum or 0.0) + ping_sq
+                if ping_min is not None:
+                    row.ping_min = ping_min if row.ping_min is None else min(row.ping_min, ping_min)
+                if seen and (row.last_seen is None or seen > row.last_seen):
+                    row.last_seen = seen
+            last = sess.id
+
+        db.session.commit()
+        AppSetting.set(_SYNC_SETTING, last)
+        with self._lock:
+            self._index.clear()
+        return len(sessions)
+
+    # ---------- scoring ----------
 
-    def predict_best_ranges(self, all_ranges, limit=100):
-        scored = [(r, self._score(r)) for r in all_ranges]
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return [r[0] for r in scored[:limit]]
+    def block_score(self, hits, probes, ping_sum, last_seen_ts, now=None):
+        """
+        Smoothed hit rate × latency factor × recency decay (0 for never-hit blocks).
+        Rows whose probes were not recorded (probes < hits: imported or older rows) get
+        the prior rate 0.5 — not ~1.0, which would rank them above measured blocks.
+        """
+        if not hits:
+            return 0.0
+        now = now or time.time()
+        rate = (hits + 1.0) / (probes + 2.0) if probes >= hits else 0.5
+        latency = 1.0 / (1.0 + (ping_sum / hits) / self.latency_ref_ms)
+        age_days = max(0.0, (now - last_seen_ts) / 86400.0) if last_seen_ts else self.half_life_days
+        return rate * latency * 0.5 ** (age_days / self.half_life_days)
 
-    def _score(self, cidr):
-        score = random.uniform(5, 15)
+    def _operator_index(self, operator):
+        """Sorted block numbers, their scores and prefix sums for one operator (cached)."""
+        operator = (operator or '').strip()
+        with self._lock:
+            idx = self._index.get(operator)
+        if idx is not None:
+            return idx
+
+        from app.models import BlockStat
+        now = time.time()
+        rows = (BlockStat.query.with_entities(BlockStat.block, BlockStat.hits, BlockStat.probes,
+                                              BlockStat.ping_sum, BlockStat.last_seen)
+                .filter(BlockStat.operator == operator).order_by(BlockStat.block).all())
+        blocks, scores, prefix = [], [], [0.0]
+        for block, hits, probes, ping_sum, last_seen in rows:
+            seen_ts = calendar.timegm(last_seen.timetuple()) if last_seen else None
+            score = self.block_score(hits or 0, probes or 0, ping_sum or 0.0, seen_ts, now)
+            blocks.append(block)
+            scores.append(score)
+            prefix.append(prefix[-1] + score)
+        idx = (blocks, scores, prefix)
+        with self._lock:
+            self._index[operator] = idx
+        return idx
+
+    @staticmethod
+    def _block_span(cidr):
+        """(first /24 number, number of /24s) of a CIDR, without building an IPv4Network."""
+        addr, _, plen = str(cidr).strip().partition('/')
+        plen = int(plen) if plen else 32
+        if not 0 <= plen <= 32:
+            raise ValueError(f'bad prefix length: {cidr}')
+        first = (ip_to_int(addr) & (0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF) >> 8
+        return first, 1 << max(0, 24 - plen)
+
+    def _density(self, index, first, n):
+        blocks, _, prefix = index
+        lo = bisect.bisect_left(blocks, first)
+        hi = bisect.bisect_left(blocks, first + n)
+        return (prefix[hi] - prefix[lo]) / n
+
+    def range_score(self, cidr, operator=''):
+        """Expected good-hit density of a CIDR: sum of its block scores / its /24 count."""
         try:
-            net = ipaddress.IPv4Network(cidr, strict=False)
-            score += 5.0 / math.log10(max(net.num_addresses, 10))
-        except Exception:
-            pass
-        return score
+            first, n = self._block_span(cidr)
+        except (ValueError, OSError):
+            return 0.0
+        return self._density(self._operator_index(operator), first, n)
+
+    def predict_best_ranges(self, all_ranges, limit=100, operator=''):
+        """Top `limit` ranges by learned score; ranges without history keep their input order."""
+        index = self._operator_index(operator)
+        scored = [(self._score(r, index), i, r) for i, r in enumerate(all_ranges)]
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [r for _, _, r in scored[:limit]]
 
-    def smart_sample(self, cidr, max_ips=50):
+    def _score(self, cidr, index):
         try:
-            net = ipaddress.IPv4Network(cidr, strict=False)
-            hosts = list(net.hosts())
-            if len(hosts) <= max_ips:
-                return hosts
-            selected = [hosts[0], hosts[-1], hosts[len(hosts) // 2]]
-            step = len(hosts) // (max_ips - 10)
-            for i in range(0, len(hosts), max(step, 1)):
-                if len(selected) >= max_ips - 7:
+            first, n = self._block_span(cidr)
+        except (ValueError, OSError):
+            return 0.0
+        # Tie-break without history: smaller ranges first (same term as before, scaled down)
+        return self._density(index, first, n) + 1e-6 / math.log10(max(n * 256, 10))
+
+    def history_first(self, cidr_list, operator='', top=256):
+        """
+        Scan order for 'history first': returns (priority_blocks, ranked_ranges).
+        priority_blocks are the best-scoring /24 numbers inside the input ranges (best
+        first); ranked_ranges is cidr_list sorted by range_score.
+        """
+        blocks, scores, _ = self._operator_index(operator)
+        candidates = []
+        for cidr in cidr_list:
+            if '/' not in str(cidr):
+                continue
+            try:
+                first, n = self._block_span(cidr)
+            except (ValueError, OSError):
+                continue
+            lo = bisect.bisect_left(blocks, first)
+            hi = bisect.bisect_left(blocks, first + n)
+            candidates.extend((scores[i], blocks[i]) for i in range(lo, hi) if scores[i] > 0)
+        best = heapq.nlargest(top, set(candidates))
+        priority = [b for _, b in best]
+        ranked = self.predict_best_ranges(cidr_list, limit=len(cidr_list), operator=operator)
+        return priority, ranked
+
+    def block_table(self, operator='', limit=100):
+        """Best historical /24s for an operator (for display)."""
+        blocks, scores, _ = self._operator_index(operator)
+        best = heapq.nlargest(limit, zip(scores, blocks))
+        return [{'block': int_to_ip(b << 8) + '/24', 'score': round(s, 4)} for s, b in best if s > 0]
+
+    @staticmethod
+    def _host_bounds(cidr):
+        """(first, last) usable host as uint32 — same set as IPv4Network.hosts()."""
+        addr, _, plen = str(cidr).strip().partition('/')
+        plen = int(plen) if plen else 32
+        if not 0 <= plen <= 32:
+            raise ValueError(f'bad prefix length: {cidr}')
+        mask = (0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF
+        network = ip_to_int(addr) & mask
+        broadcast = network | (~mask & 0xFFFFFFFF)
+        if plen >= 31:
+            return network, broadcast
+        return network + 1, broadcast - 1
+
+    def _sample_ints(self, cidr, max_ips):
+        """Edge / middle / stride / random sample of a CIDR's hosts in O(max_ips), as uint32."""
+        lo, hi = self._host_bounds(cidr)
+        n = hi - lo + 1
+        if n <= max_ips:
+            return list(range(lo, hi + 1))
+        picked = dict.fromkeys((lo, hi, lo + n // 2))  # ordered set
+        step = max(1, n // max(1, max_ips - 10))
+        stride_budget = max(len(picked), max_ips - 7)
+        for i in range(0, n, step):
+            if len(picked) >= stride_budget:
+                break
+            picked[lo + i] = None
+        remaining = max_ips - len(picked)
+        if remaining > 0:
+            # range() sampling is O(k) for any prefix; draw a few spare in case of overlap
+            for ip in random.sample(range(lo, hi + 1), min(n, remaining + len(picked))):
+                if len(picked) >= max_ips:
                     break
-                selected.append(hosts[i])
-            remaining = max_ips - len(selected)
-            if remaining > 0:
-                selected.extend(random.sample(hosts, min(remaining, len(hosts))))
-            return list(set(selected))[:max_ips]
-        except Exception:
+                picked.setdefault(ip, None)
+        return list(picked)[:max_ips]
+
+    def smart_sample(self, cidr, max_ips=50, as_int=False):
+        """
+        Sample up to max_ips distinct hosts of a CIDR: first/last/middle host, an even
+        stride across the range, then random fill. Integer arithmetic only, so a /8 costs
+        the same as a /24. Returns IPv4Address objects (uint32 with as_int=True).
+        """
+        try:
+            ips = self._sample_ints(cidr, max_ips)
+        except (ValueError, OSError):
             return []
+        return ips if as_int else [ipaddress.IPv4Address(ip) for ip in ips]
+
+    def smart_sample_batch(self, cidrs, max_ips=50, as_int=True):
+        """smart_sample() for many CIDRs in one call: {cidr: [hosts]} (invalid CIDRs map to [])."""
+        return {cidr: self.smart_sample(cidr, max_ips, as_int=as_int) for cidr in cidrs}
@@ -0,0 +1,600 @@
+"""
+CDN IP Scanner V2.0 - Async Scan Engine
+Author: shahinst
+
+Event-loop alternative to the ThreadPoolExecutor in SHScanner.batch_scan:
+  - TCP pre-filter, 5-attempt /cdn-cgi/trace check and extra-port checks run as coroutines
+    (extra ports gathered concurrently)
+  - One OS thread drives thousands of probes at once (no per-IP thread, no GIL contention)
+  - One event loop per scan session: with carry_over the probes still running at the
+    end of a batch stay on the loop and finish in the next one (no drain to zero)
+  - Staged like the thread engine when the pipeline is active: pre-filter tasks feed a
+    bounded handoff drained by a smaller number of verify tasks
+  - Same progress_callback / result_callback contract as the thread engine
+  - Same verification rules as SHScanner.check (>= 3/5 successes + request RTT <= max,
+    same verify_policy for stopping early)
+"""
+
+import time
+import asyncio
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from app.scanner.core import (
+    HTTPS_PORTS, SH_TRACE_PATH, SH_TRACE_ATTEMPTS,
+    SH_HOST_HEADER, SH_USER_AGENT, int_to_ip, ip_to_int, to_ip_int,
+)
+from app.scanner.probes import build_trace_request, TLS_SESSION_CACHE, SHProbeTimings
+from app.scanner.colo import parse_trace
+
+# Pre-encoded keep-alive request, identical for every IP
+_TRACE_REQUEST = build_trace_request(SH_HOST_HEADER, SH_TRACE_PATH, SH_USER_AGENT)
+
+_MAX_HEADER_BYTES = 16384
+_MAX_BODY_KEEP = 4096
+_FD_RESERVE = 128  # sockets kept free for DB, socket.io and range fetching
+
+
+def fd_limited_concurrency(wanted):
+    """
+    Cap concurrency to the process file-descriptor limit.
+    Raises the soft RLIMIT_NOFILE up to the hard limit first when possible.
+    """
+    if resource is None:
+        return wanted
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            target = wanted + _FD_RESERVE
+            if hard != resource.RLIM_INFINITY:
+                target = min(target, hard)
+            if target > soft:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                soft = target
+        return max(1, min(wanted, soft - _FD_RESERVE))
+    except (ValueError, OSError):
+        return wanted
+
+
+async def _read_response(reader):
+    """
+    Read one HTTP/1.1 response. Returns (status_code, keep_alive, head_at, body) —
+    head_at is the perf_counter() time the header block had arrived; body is kept
+    for non-chunked responses up to _MAX_BODY_KEEP bytes (else b'').
+    Handles Content-Length and chunked bodies.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    head_at = time.perf_counter()
+    if len(head) > _MAX_HEADER_BYTES:
+        raise ValueError('response header too large')
+    lines = head.decode('latin-1').split("\r\n")
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise ValueError('bad status line')
+    status = int(parts[1])
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    body = b''
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif status not in (204, 304) and status >= 200:
+        # No framing → body ends at connection close
+        body = await reader.read()
+        keep_alive = False
+    if len(body) > _MAX_BODY_KEEP:
+        body = b''
+    return status, keep_alive, head_at, body
+
+
+class SHAsyncEngine:
+    """
+    Runs SHScanner batches on one asyncio event loop for a whole scan session
+    (SHScanner owns it like its thread pool; close() ends it).
+    Reads timeouts, latency limit, failed_cache and _stop_flag from the owning scanner.
+    """
+
+    def __init__(self, scanner, concurrency=None):
+        self.scanner = scanner
+        self.requested = concurrency or scanner.async_concurrency
+        self.concurrency = fd_limited_concurrency(self.requested)
+        self._tls_cache = TLS_SESSION_CACHE
+        self._loop = None
+        self._done_q = None     # finished tasks, fed by done-callbacks (outlives a batch)
+        self._inflight = {}
+        self._verifying = {}
+        self._handoff = deque()
+        self._slots = None      # Semaphore(queue_max) for the staged pipeline
+        self._slots_max = 0
+
+    # ---------- probes ----------
+
+    async def _throttle(self, ip_str):
+        limiter = self.scanner.rate_limiter
+        if limiter is not None:
+            await limiter.acquire_async(ip_to_int(ip_str))
+
+    async def _open(self, ip_str, port, timeout_sec, timings=None, profile=None):
+        use_tls = port in (profile.https_ports if profile is not None else HTTPS_PORTS)
+        host = profile.host if profile is not None else SH_HOST_HEADER
+        await self._throttle(ip_str)
+        t0 = time.perf_counter()
+        if use_tls and hasattr(asyncio.StreamWriter, 'start_tls'):
+            # Python 3.11+: TCP connect and TLS handshake as separate, separately timed steps
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_str, port), timeout=timeout_sec)
+            t1 = time.perf_counter()
+            await asyncio.wait_for(
+                writer.start_tls(self._tls_cache.context, server_hostname=host),
+                timeout=timeout_sec,
+            )
+            if timings is not None:
+                timings.connect_ms.append((t1 - t0) * 1000)
+                timings.tls_ms.append((time.perf_counter() - t1) * 1000)
+        else:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    ip_str, port,
+                    ssl=self._tls_cache.context if use_tls else None,
+                    server_hostname=host if use_tls else None,
+                ),
+                timeout=timeout_sec,
+            )
+            if timings is not None and not use_tls:
+                timings.connect_ms.append((time.perf_counter() - t0) * 1000)
+        if use_tls:
+            ssl_object = writer.get_extra_info('ssl_object')
+            if ssl_object is not None:
+                # Not timed: the handshake ran on the loop interleaved with other tasks
+                self._tls_cache.record_handshake(ssl_object.session_reused)
+        return reader, writer
+
+    @staticmethod
+    async def _close(writer):
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
+        except Exception:
+            pass
+
+    async def _tcp_connect(self, ip_str, port, timeout_sec):
+        """Plain TCP connect (no TLS) — async twin of SHScanner._tcp_connect."""
+        await self._throttle(ip_str)
+        writer = None
+        t0 = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip_str, port), timeout=timeout_sec
+            )
+            self.scanner._observe_connect(False, (time.perf_counter() - t0) * 1000)
+            return True
+        except ConnectionRefusedError:
+            self.scanner._observe_connect(False)
+            return False
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.scanner._observe_connect(True)
+            return False
+        finally:
+            await self._close(writer)
+
+    async def _trace_attempt(self, ip_str, port, conn, timings=None, trace=None, profile=None):
+        """
+        One GET over the kept-alive connection; reconnects once if the server closed it.
+        Returns False when the status is not one profile.statuses accepts.
+        """
+        if conn[1] is not None:
+            try:
+                return await self._trace_request(conn, True, timings, trace, profile)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Idle keep-alive dropped between attempts: retry this one on a new connection
+                await self._close(conn[1])
+                conn[0] = conn[1] = None
+        conn[0], conn[1] = await self._open(ip_str, port, None, timings, profile)
+        return await self._trace_request(conn, False, timings, trace, profile)
+
+    async def _trace_request(self, conn, warm, timings, trace, profile):
+        reader, writer = conn
+        t_send = time.perf_counter()
+        writer.write(profile.request if profile is not None else _TRACE_REQUEST)
+        await writer.drain()
+        status, keep_alive, head_at, body = await _read_response(reader)
+        if trace is not None and not trace:
+            trace.update(parse_trace(body))
+        if timings is not None:
+            # Header block received ≈ first byte (the status line and headers share a segment)
+            timings.add_request((head_at - t_send) * 1000, warm)
+        if not warm:
+            ssl_object = writer.get_extra_info('ssl_object')
+            if ssl_object is not None:
+                self._tls_cache.put(profile.host if profile is not None else SH_HOST_HEADER, ssl_object.session)
+        if not keep_alive:
+            await self._close(writer)
+            conn[0] = conn[1] = None
+        return profile is None or profile.statuses is None or status in profile.statuses
+
+    async def _sequential_trace_check(self, ip_str, port, max_latency_ms, profile=None):
+        """
+        Async version of SHScanner._sequential_trace_check: up to 5 GETs on one keep-alive
+        connection, ended early by the scanner's verify_policy. Timeout/connection errors
+        abort, any parsed response counts as success.
+        Returns (is_valid, latency_ms, breakdown, trace) like the threaded version.
+        """
+        scanner = self.scanner
+        policy = scanner.verify_policy
+        timeouts, max_total_sec = scanner._trace_timeouts(max_latency_ms)
+        timings = SHProbeTimings()
+        trace = {}
+
+        total_start = time.time()
+        successes = 0
+        attempts_done = 0
+        verdict = None
+        conn = [None, None]
+        try:
+            for i in range(SH_TRACE_ATTEMPTS):
+                if scanner._stop_flag:
+                    break
+                if time.time() - total_start > max_total_sec:
+                    break
+                attempts_done += 1
+                try:
+                    if await asyncio.wait_for(
+                        self._trace_attempt(ip_str, port, conn, timings, trace, profile), timeout=timeouts[i]
+                    ):
+                        successes += 1
+                except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+                    break  # Connection failed → no point retrying same IP
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    if profile is None or profile.statuses is None:
+                        successes += 1
+                verdict = policy.decide(
+                    successes, attempts_done, (time.time() - total_start) * 1000, max_latency_ms, timings,
+                )
+                if verdict is not None:
+                    break
+        finally:
+            await self._close(conn[1])
+
+        total_time_ms = (time.time() - total_start) * 1000
+        policy.record(attempts_done, total_time_ms, verdict)
+
+        breakdown = timings.summary()
+        latency = policy.latency(timings, total_time_ms, attempts_done)
+        is_valid = policy.is_valid(successes, latency, max_latency_ms)
+        return is_valid, latency, breakdown, trace
+
+    async def tcp_probe(self, ip, ports):
+        """Coroutine twin of SHScanner.tcp_probe (census phase: TCP connect only)."""
+        scanner = self.scanner
+        if scanner._stop_flag:
+            return None
+        ip_str = int_to_ip(to_ip_int(ip))
+        port = ports[0] if ports else 443
+        t0 = time.perf_counter()
+        if not await self._tcp_connect(ip_str, port, scanner._prefilter_timeout()):
+            return None
+        return {'ip': ip_str, 'open_ports': [port], 'ping': (time.perf_counter() - t0) * 1000}
+
+    # ---------- probe tiers (twins of SHScanner._tier_*) ----------
+
+    async def _tier_tcp(self, ip_int, ip_str, port, profile, result):
+        t0 = time.perf_counter()
+        if not await self._tcp_connect(ip_str, port, self.scanner._prefilter_timeout()):
+            return False
+        result['ping'] = (time.perf_counter() - t0) * 1000
+        return True
+
+    async def _tier_tls(self, ip_int, ip_str, port, profile, result):
+        if port not in profile.https_ports:
+            # No handshake on plain HTTP: the tcp tier's connect is the check (or one is made here)
+            return 'tcp' in self.scanner.strategy.tiers or await self._tier_tcp(ip_int, ip_str, port, profile, result)
+        timings = SHProbeTimings()
+        writer = None
+        t0 = time.perf_counter()
+        try:
+            _, writer = await self._open(ip_str, port, self.scanner._port_timeout(), timings, profile)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return False
+        finally:
+            await self._close(writer)
+        tls_ms = timings.tls_ms[0] if timings.tls_ms else (time.perf_counter() - t0) * 1000
+        result['ping'] = tls_ms
+        result['latency'] = {'tls_ms': round(tls_ms, 1)}
+        return True
+
+    async def _tier_trace(self, ip_int, ip_str, port, profile, result):
+        scanner = self.scanner
+        is_valid, latency, breakdown, trace = await self._sequential_trace_check(
+            ip_str, port, scanner.max_latency_ms, profile
+        )
+        if not is_valid:
+            return False
+        if not scanner.colo_filter.observe(ip_int, trace.get('colo')):
+            scanner._log('DEBUG', f'{ip_str}: colo {trace.get("colo")} filtered out')
+            return False
+        result.update(ping=latency, latency=breakdown, colo=trace.get('colo'), trace=trace)
+        return True
+
+    async def check(self, ip, ports):
+        """Coroutine twin of SHScanner.check — same tier chain and result dict."""
+        ctx = self.scanner._check_start(ip, ports)
+        if ctx is None or not await self._run_tiers(ctx, self.scanner.strategy.tiers):
+            return None
+        return await self._check_finish(ctx)
+
+    async def _run_tiers(self, ctx, tiers):
+        scanner = self.scanner
+        ip_int, ip_str, profile, ports, result = ctx
+        strategy = scanner.strategy
+        for tier in tiers:
+            if scanner._stop_flag:
+                return False
+            t0 = time.perf_counter()
+            passed = await getattr(self, '_tier_' + tier)(ip_int, ip_str, ports[0], profile, result)
+            strategy.record(tier, passed, time.perf_counter() - t0)
+            if not passed:
+                scanner.failed_cache.add(ip_int)
+                return False
+        return True
+
+    async def _check_finish(self, ctx):
+        scanner = self.scanner
+        ip_int, ip_str, profile, ports, result = ctx
+        result['open_ports'].append(ports[0])
+
+        extra_ports = ports[1:]
+        inferred = scanner.port_profiles.plan(ip_int, extra_ports)
+        if inferred is not None:
+            result['open_ports'] += inferred
+            result['inferred_ports'] = inferred
+        elif scanner.defer_ports and extra_ports:
+            # Background enrichment on the scanner's pool; outlives this batch's event loop
+            scanner._defer_enrichment(ip_str, result['open_ports'], extra_ports)
+            result['ports_pending'] = True
+        elif extra_ports:
+            tcp_timeout = scanner._port_timeout()
+            answers = await asyncio.gather(
+                *(self._tcp_connect(ip_str, port, tcp_timeout) for port in extra_ports)
+            )
+            opened = [port for port, ok in zip(extra_ports, answers) if ok]
+            if not scanner._stop_flag:
+                scanner.port_profiles.observe(ip_int, extra_ports, opened)
+            result['open_ports'] += opened
+
+        breakdown = result.get('latency') or {}
+        scanner._log('DEBUG', f'{ip_str}: open={result["open_ports"]} ping={result["ping"] or 0:.0f}ms '
+                              f'[{scanner.strategy.name}] connect={breakdown.get("connect_ms")} '
+                              f'tls={breakdown.get("tls_ms")} jitter={breakdown.get("jitter_ms")}')
+        return result
+
+    async def _stage_prefilter(self, ip, ports):
+        """Coroutine twin of SHScanner._stage_prefilter."""
+        ctx = self.scanner._check_start(ip, ports)
+        if ctx is None:
+            return None
+        pipeline = self.scanner.pipeline
+        pipeline.started('prefilter')
+        t0 = time.perf_counter()
+        passed = False
+        try:
+            passed = await self._run_tiers(ctx, pipeline.prefilter_tiers)
+        finally:
+            pipeline.finished('prefilter', passed, time.perf_counter() - t0)
+        return ctx if passed else None
+
+    async def _stage_verify(self, ctx):
+        """Coroutine twin of SHScanner._stage_verify."""
+        pipeline = self.scanner.pipeline
+        pipeline.started('verify')
+        t0 = time.perf_counter()
+        result = None
+        try:
+            if await self._run_tiers(ctx, pipeline.verify_tiers):
+                result = await self._check_finish(ctx)
+        finally:
+            pipeline.finished('verify', result is not None, time.perf_counter() - t0)
+        return result
+
+    # ---------- batch driver ----------
+
+    @property
+    def pending(self):
+        """Probes carried over from the last batch (running, or queued for verification)."""
+        return len(self._inflight) + len(self._handoff) + len(self._verifying)
+
+    def run(self, ips, ports, progress_callback=None, result_callback=None, start_time=None, total=None,
+            probe='check', carry_over=False):
+        """
+        Blocking entry point, called from the scan thread. Returns list of result dicts.
+        ips may be any iterable; total is the expected count reported to progress_callback.
+        probe='tcp' runs tcp_probe (census phase) instead of the full check.
+
+        The event loop lives as long as the engine (one per scan session). With
+        carry_over=True the batch returns once its tail drops below a quarter of the
+        concurrency; the remaining probe tasks stay on the loop and are collected by the
+        next run() (or finish_batches), exactly like the thread engine's session pool.
+        """
+        if total is None:
+            total = len(ips) if hasattr(ips, '__len__') else 0
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(
+            self._run(ips, ports, progress_callback, result_callback, start_time, total, probe, carry_over)
+        )
+
+    def close(self):
+        """Cancel carried-over probes and close the session loop. Called from SHScanner.close_pool."""
+        loop = self._loop
+        if loop is None:
+            return
+        tasks = list(self._inflight) + list(self._verifying)
+        for task in tasks:
+            task.cancel()
+        try:
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+            self._loop = None
+            self._inflight = {}
+            self._verifying = {}
+            self._handoff = deque()
+            self._done_q = None
+            self._slots = None
+            self._slots_max = 0
+
+    async def _run(self, ips, ports, progress_callback, result_callback, start_time, n, probe='check',
+                   carry_over=False):
+        scanner = self.scanner
+        pipeline = scanner.pipeline
+        staged = probe != 'tcp' and pipeline.plan(scanner.strategy.tiers, self.concurrency)
+        probe_fn = self.tcp_probe if probe == 'tcp' else self.check
+        results = []
+        n_completed = 0
+        source = iter(ips)
+        exhausted = False
+        if self._done_q is None:
+            self._done_q = asyncio.Queue()
+        done_q = self._done_q
+        inflight = self._inflight      # task → ip: probes (or pre-filters when staged)
+        handoff = self._handoff        # (ip, check context, slot) waiting for a verify worker
+        verifying = self._verifying    # task → ip: verify stage
+
+        cap = self.concurrency
+        n_verifiers = queue_max = 0
+        if staged:
+            # Pre-filter and verify share the fd budget
+            n_verifiers = min(pipeline.verify_pool, max(1, cap // 2))
+            cap = max(1, cap - n_verifiers)
+            queue_max = pipeline.queue_max
+            pipeline.set_workers(cap, n_verifiers)
+            if self._slots is None or self._slots_max != queue_max:
+                # Candidates holding a slot give it back to the semaphore they took it from
+                self._slots = asyncio.Semaphore(queue_max)
+                self._slots_max = queue_max
+            scanner._log('INFO', f'Async pipelined batch scan started: {n or "?"} IPs, {len(ports)} ports, '
+                                 f'pre-filter {"+".join(pipeline.prefilter_tiers)} '
+                                 f'{min(cap, scanner.concurrency_target())} concurrent (cap {cap}) '
+                                 f'→ queue {queue_max} → verify {"+".join(pipeline.verify_tiers)} '
+                                 f'{n_verifiers} concurrent')
+        else:
+            scanner._log('INFO', f'Async batch scan started: {n or "?"} IPs, {len(ports)} ports, '
+                                 f'{min(cap, scanner.concurrency_target())} concurrent probes (cap {cap})')
+        low_water = cap // 4 if carry_over else 0
+
+        async def prefilter(ip):
+            # A live candidate holds a queue slot until a verifier takes it: (ctx, slot semaphore)
+            ctx = await self._stage_prefilter(ip, ports)
+            if ctx is None:
+                return None
+            slots = self._slots
+            await slots.acquire()
+            return ctx, slots
+
+        def spawn(coro, ip, table):
+            task = asyncio.ensure_future(coro)
+            table[task] = ip
+            task.add_done_callback(done_q.put_nowait)
+
+        while True:
+            # Verify stage: start queued candidates on free verify slots
+            while handoff and len(verifying) < n_verifiers and not scanner._stop_flag:
+                ip, ctx, slots = handoff.popleft()
+                slots.release()
+                spawn(self._stage_verify(ctx), ip, verifying)
+            # Probes / pre-filter: top the window up (controller target; paused while the verify queue is full)
+            window = min(cap, scanner.concurrency_target())
+            while (not exhausted and len(inflight) < window and not scanner._stop_flag
+                   and not (staged and len(handoff) >= queue_max)):
+                ip = next(source, None)
+                if ip is None:
+                    exhausted = True
+                    break
+                spawn(prefilter(ip) if staged else probe_fn(ip, ports), ip, inflight)
+            if staged:
+                pipeline.queued(len(handoff))
+
+            if scanner._stop_flag:
+                cancelled = list(inflight) + list(verifying)
+                for task in cancelled:
+                    task.cancel()
+                prefilters = list(inflight) if staged else []
+                inflight.clear()
+                verifying.clear()
+                for _, _, slots in handoff:
+                    slots.release()
+                handoff.clear()
+                await asyncio.gather(*cancelled, return_exceptions=True)
+                for task in prefilters:
+                    # Finished live before the cancel reached it: its slot is still held
+                    if not task.cancelled() and task.exception() is None and task.result() is not None:
+                        task.result()[1].release()
+                break
+            if exhausted and len(inflight) + len(handoff) + len(verifying) <= low_water:
+                break
+
+            scanner.drain_enrichment()
+            try:
+                task = await asyncio.wait_for(done_q.get(), timeout=0.25)
+            except asyncio.TimeoutError:
+                continue
+            if task in inflight:
+                ip = inflight.pop(task)
+                result = None if task.cancelled() or task.exception() else task.result()
+                if staged and result is not None:
+                    handoff.append((ip,) + result)  # live: on to the verify stage
+                    continue
+                if staged:
+                    result = None  # rejected by the pre-filter
+            elif task in verifying:
+                ip = verifying.pop(task)
+                result = None if task.cancelled() or task.exception() else task.result()
+            else:
+                continue  # cancelled in an earlier stop
+
+            n_completed += 1
+            if progress_callback:
+                try:
+                    elapsed = (time.time() - start_time) if start_time else 0
+                    speed = n_completed / elapsed if elapsed > 0 else 0
+                    progress_callback(n_completed, n, speed, elapsed)
+                except Exception:
+                    pass
+            if probe != 'tcp':
+                scanner._record_outcome(ip, result)
+            if result:
+                results.append(result)
+                if result_callback:
+                    try:
+                        result_callback(result)
+                    except Exception:
+                        pass
+
+        if staged:
+            pipeline.queued(len(handoff))
+        scanner._log('INFO', f'Async batch scan completed: {len(results)}/{n_completed} IPs found')
+        return results
@@ -0,0 +1,236 @@
+"""
+CDN IP Scanner V2.0 - Adaptive /24 Sampling
+Author: shahinst
+
+Multi-armed bandit over /24 blocks, wrapped around the session IP stream:
+  - Exploration: IPs come from the normal round-robin stream (every range, every /24)
+  - Exploitation: Thompson sampling on each productive block's hit rate (Beta posterior),
+    weighted by its latency, picks blocks that get extra hosts — only blocks of CIDR
+    input, and only hosts inside those CIDRs (a pasted single IP never widens to its /24)
+  - Blocks with enough probes and no hit are dead: the stream skips their remaining IPs
+  - A minimum exploration share always goes to the stream, so new blocks keep being tried
+"""
+
+import bisect
+import heapq
+import random
+import ipaddress
+import threading
+from collections import deque
+
+from app.scanner.core import SHIPBitmap, int_to_ip
+
+_ISSUED, _DONE, _HITS, _LAT = range(4)
+
+
+def _cidr_intervals(ranges):
+    """Sorted, merged (first, last) uint32 intervals of the CIDR entries in ranges (single IPs skipped)."""
+    intervals = []
+    for entry in ranges:
+        entry = str(entry).strip()
+        if '/' not in entry:
+            continue
+        try:
+            net = ipaddress.IPv4Network(entry, strict=False)
+        except ValueError:
+            continue
+        intervals.append((int(net.network_address), int(net.broadcast_address)))
+    intervals.sort()
+    merged = []
+    for lo, hi in intervals:
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class SHBlockBandit:
+    """
+    Iterator of uint32 IPs for one scan session. Pull with next(); report every
+    finished check with record(ip_int, hit, latency_ms). Thread-safe.
+
+    source:        the session stream (e.g. SHNetUtils.iter_scan_ips)
+    per_block:     the configured ips_per_24; productive blocks may get up to boost × this
+    budget:        total IPs to hand out (None = until the stream runs dry)
+    explore:       minimum share of pulls taken from the stream
+    dead_after:    completed probes without a hit before a block is written off
+    exclude:       optional container of uint32 IPs never to hand out (e.g. SHExclusions)
+    scope:         the scan's ranges; extra hosts are only drawn inside its CIDR entries
+                   (single IPs in it are never exploited). None = any host of a hit /24
+    """
+
+    def __init__(self, source, per_block=30, budget=None, explore=0.25, dead_after=8,
+                 boost=4, refill_arms=64, seed=None, exclude=None, scope=None):
+        self.source = iter(source)
+        self.max_per_block = max(1, min(254, per_block * boost))
+        self.budget = budget
+        self.explore = explore
+        self.dead_after = dead_after
+        self.refill_arms = refill_arms
+        self.exclude = exclude
+        self._scope = _cidr_intervals(scope) if scope is not None else None
+        self._scope_starts = [lo for lo, _ in self._scope] if self._scope is not None else None
+        self._hosts = {}           # block → host octets inside scope (exploited blocks only)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._blocks = {}          # block → [issued, done, hits, latency_sum]
+        self._productive = set()   # blocks with >= 1 hit and host budget left
+        self._dead = set()
+        self._exploit = deque()
+        self._seen = SHIPBitmap()
+        self._stream_done = False
+        self.issued = 0
+        self.exploit_pulls = 0
+        self.skipped_dead = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self.budget is not None and self.issued >= self.budget:
+                raise StopIteration
+            ip = None
+            if self._stream_done or self._rng.random() >= self.explore:
+                ip = self._exploit_pick()
+            if ip is None:
+                ip = self._stream_pick()
+            if ip is None:
+                ip = self._exploit_pick()
+            if ip is None:
+                raise StopIteration
+            self._seen.add(ip)
+            self.issued += 1
+            stats = self._blocks.get(ip >> 8)
+            if stats is None:
+                stats = self._blocks[ip >> 8] = [0, 0, 0, 0.0]
+            stats[_ISSUED] += 1
+            if stats[_ISSUED] >= self.max_per_block:
+                self._productive.discard(ip >> 8)
+            return ip
+
+    def _stream_pick(self):
+        while not self._stream_done:
+            ip = next(self.source, None)
+            if ip is None:
+                self._stream_done = True
+                return None
+            block = ip >> 8
+            if block in self._dead:
+                self.skipped_dead += 1
+                continue
+            stats = self._blocks.get(block)
+            if ip in self._seen or (stats is not None and stats[_ISSUED] >= self.max_per_block):
+                continue
+            return ip
+        return None
+
+    def _refill(self):
+        """One Thompson round: sample every productive block's posterior, queue the best ones."""
+        scored = []
+        for block in self._productive:
+            stats = self._blocks[block]
+            misses = max(0, stats[_DONE] - stats[_HITS])
+            theta = self._rng.betavariate(1 + stats[_HITS], 1 + misses)
+            avg_latency = stats[_LAT] / stats[_HITS]
+            scored.append((theta / (1.0 + avg_latency / 1000.0), block))
+        self._exploit.extend(block for _, block in heapq.nlargest(self.refill_arms, scored))
+
+    def _exploit_pick(self):
+        for _ in range(2):
+            while self._exploit:
+                block = self._exploit.popleft()
+                if block not in self._productive:
+                    continue
+                ip = self._free_host(block)
+                if ip is not None:
+                    self.exploit_pulls += 1
+                    return ip
+                self._productive.discard(block)
+            if not self._productive:
+                return None
+            self._refill()
+        return None
+
+    def _block_hosts(self, block):
+        """Host octets (1-254) of a /24 that lie inside the scope's CIDRs."""
+        hosts = self._hosts.get(block)
+        if hosts is None:
+            base = block << 8
+            if self._scope is None:
+                hosts = range(1, 255)
+            else:
+                hosts = []
+                i = max(0, bisect.bisect_right(self._scope_starts, base) - 1)
+                while i < len(self._scope) and self._scope[i][0] <= base | 0xFF:
+                    lo, hi = self._scope[i]
+                    hosts.extend(range(max(1, lo - base), min(254, hi - base) + 1))
+                    i += 1
+            self._hosts[block] = hosts
+        return hosts
+
+    def _free_host(self, block):
+        base = block << 8
+        hosts = self._block_hosts(block)
+        if not hosts:
+            return None
+        for _ in range(8):
+            ip = base | self._rng.choice(hosts)
+            if ip not in self._seen and (self.exclude is None or ip not in self.exclude):
+                return ip
+        for host in hosts:
+            ip = base | host
+            if ip not in self._seen and (self.exclude is None or ip not in self.exclude):
+                return ip
+        return None
+
+    def record(self, ip_int, hit, latency_ms=None):
+        """Outcome of one finished check (hit = verified IP)."""
+        block = ip_int >> 8
+        with self._lock:
+            stats = self._blocks.get(block)
+            if stats is None:
+                return
+            stats[_DONE] += 1
+            if hit:
+                stats[_HITS] += 1
+                stats[_LAT] += latency_ms or 0.0
+                self._dead.discard(block)
+                if stats[_ISSUED] < self.max_per_block and self._block_hosts(block):
+                    self._productive.add(block)
+            elif not stats[_HITS] and stats[_DONE] >= self.dead_after:
+                self._dead.add(block)
+
+    def probe_counts(self):
+        """{block: finished probes} for every /24 touched (history summary input)."""
+        with self._lock:
+            return {block: stats[_DONE] for block, stats in self._blocks.items() if stats[_DONE]}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'blocks': len(self._blocks),
+                'productive': len(self._productive),
+                'dead': len(self._dead),
+                'issued': self.issued,
+                'exploit_pulls': self.exploit_pulls,
+                'skipped_dead': self.skipped_dead,
+            }
+
+    def block_stats(self, limit=200):
+        """Per-/24 table (most hits first) for the API."""
+        with self._lock:
+            rows = []
+            for block, (issued, done, hits, lat) in self._blocks.items():
+                rows.append({
+                    'block': int_to_ip(block << 8) + '/24',
+                    'issued': issued,
+                    'done': done,
+                    'hits': hits,
+                    'hit_rate': round(hits / done, 3) if done else None,
+                    'avg_latency_ms': round(lat / hits, 1) if hits else None,
+                    'state': 'dead' if block in self._dead else ('productive' if block in self._productive else 'sampling'),
+                })
+        rows.sort(key=lambda r: (r['hits'], r['done']), reverse=True)
+        return rows[:limit]
@@ -0,0 +1,151 @@
+"""
+CDN IP Scanner V2.0 - Per-CDN Probe Profiles
+Author: shahinst
+
+Which verification request makes sense depends on the CDN behind an IP:
+  - cloudflare: GET /cdn-cgi/trace, Host/SNI www.cloudflare.com, all CF ports,
+    trace body parsed for colo/loc
+  - fastly: GET / with Host/SNI www.fastly.com, only 80/443 (Fastly listens nowhere
+    else), no trace body
+The CDN comes from the range provenance (SHRangeIndex.cdn_of); IPs without a known
+source fall back to the built-in Fastly network list, then to the default profile.
+"""
+
+import bisect
+import ipaddress
+import threading
+from collections import Counter
+
+from app.scanner.probes import SHTraceProber, build_trace_request
+
+PROBE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+PROBE_ATTEMPTS = 5
+
+# Fallback classifier for ranges pasted by hand (no provenance): Fastly's public networks
+_FASTLY_NETS = (
+    '151.101.0.0/16', '199.232.0.0/16', '23.235.32.0/20', '43.249.72.0/22',
+    '103.244.50.0/24', '103.245.222.0/23', '103.245.224.0/24', '104.156.80.0/20',
+    '140.248.64.0/18', '140.248.128.0/17', '146.75.0.0/17', '157.52.64.0/18',
+    '167.82.0.0/17', '167.82.128.0/20', '167.82.160.0/20', '167.82.224.0/20',
+    '172.111.64.0/18', '185.31.16.0/22', '199.27.72.0/21',
+)
+
+
+class SHProbeProfile:
+    """
+    How to verify an IP of one CDN.
+    ports:    ports the CDN can answer on (others are skipped for its IPs)
+    statuses: HTTP statuses that count as a successful attempt (None = any response)
+    trace:    the body is a /cdn-cgi/trace key=value body (colo/loc)
+    """
+
+    def __init__(self, name, host, path, ports, https_ports, statuses=None, trace=False):
+        self.name = name
+        self.host = host
+        self.path = path
+        self.ports = frozenset(ports)
+        self.https_ports = frozenset(https_ports)
+        self.statuses = frozenset(statuses) if statuses else None
+        self.trace = trace
+        self.request = build_trace_request(host, path, PROBE_USER_AGENT)
+        self.prober = SHTraceProber(host, path, PROBE_USER_AGENT, self.https_ports, PROBE_ATTEMPTS,
+                                    statuses=self.statuses)
+
+    def url(self, ip_str, port):
+        scheme = 'https' if port in self.https_ports else 'http'
+        return f'{scheme}://{ip_str}:{port}{self.path}'
+
+    def usable_ports(self, ports):
+        """ports (in order) this CDN can answer on."""
+        return [p for p in ports if p in self.ports]
+
+
+_CF_HTTPS = (443, 8443, 2053, 2083, 2087, 2096)
+_CF_HTTP = (80, 8080, 2052, 2082, 2086, 2095)
+
+PROBE_PROFILES = {
+    'cloudflare': SHProbeProfile(
+        'cloudflare', 'www.cloudflare.com', '/cdn-cgi/trace',
+        ports=_CF_HTTPS + _CF_HTTP, https_ports=_CF_HTTPS, trace=True,
+    ),
+    'fastly': SHProbeProfile(
+        'fastly', 'www.fastly.com', '/',
+        ports=(443, 80), https_ports=(443,),
+    ),
+}
+DEFAULT_PROFILE = 'cloudflare'
+
+
+class SHProbeProfiles:
+    """
+    Picks the probe profile per IP for one scan session.
+    set_index(SHRangeIndex) supplies provenance; force='fastly' etc. pins one profile.
+    """
+
+    def __init__(self, profiles=None, default=DEFAULT_PROFILE):
+        self.profiles = profiles or PROBE_PROFILES
+        self.default = default
+        self.force = None
+        self.index = None
+        self._lock = threading.Lock()
+        self._fastly = sorted(
+            (int(n.network_address), int(n.broadcast_address))
+            for n in (ipaddress.IPv4Network(c) for c in _FASTLY_NETS)
+        )
+        self._fastly_starts = [s for s, _ in self._fastly]
+        self.verified = Counter()   # profile → IPs sent to verification
+        self.no_ports = Counter()   # profile → IPs skipped: none of the scan ports can work
+
+    def configure(self, index=None, force=None):
+        self.index = index
+        self.force = force if force in self.profiles else None
+        with self._lock:
+            self.verified.clear()
+            self.no_ports.clear()
+
+    def _is_fastly(self, ip_int):
+        i = bisect.bisect_right(self._fastly_starts, ip_int) - 1
+        return i >= 0 and ip_int <= self._fastly[i][1]
+
+    def cdn_for(self, ip_int):
+        if self.force:
+            return self.force
+        if self.index is not None:
+            for cdn in sorted(self.index.cdn_of(ip_int)):
+                if cdn in self.profiles:
+                    return cdn
+        if self._is_fastly(ip_int):
+            return 'fastly'
+        return self.default
+
+    def for_ip(self, ip_int, ports):
+        """(profile, usable ports) for an IP; usable is [] when no scan port can work on its CDN."""
+        profile = self.profiles[self.cdn_for(ip_int)]
+        usable = profile.usable_ports(ports)
+        with self._lock:
+            (self.verified if usable else self.no_ports)[profile.name] += 1
+        return profile, usable
+
+    def prune(self, cidrs, ports):
+        """Drop CIDRs whose CDN cannot answer on any scan port. Returns (kept, dropped)."""
+        kept, dropped = [], 0
+        for cidr in cidrs:
+            addr = str(cidr).split('/', 1)[0]
+            try:
+                ip_int = int(ipaddress.IPv4Address(addr))
+            except ValueError:
+                kept.append(cidr)
+                continue
+            if self.profiles[self.cdn_for(ip_int)].usable_ports(ports):
+                kept.append(cidr)
+            else:
+                dropped += 1
+        return kept, dropped
+
+    def stats(self):
+        with self._lock:
+            return {
+                'force': self.force,
+                'verified': dict(self.verified),
+                'no_ports': dict(self.no_ports),
+            }
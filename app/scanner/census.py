@@ -0,0 +1,115 @@
+"""
+CDN IP Scanner V2.0 - Block Liveness Census
+Author: shahinst
+
+Coarse-to-fine scanning for very large inputs:
+  - Phase 1: TCP-only probe of 1-2 hosts in every /24 of the input → liveness map
+  - Phase 2: the normal verified scan, restricted to the live /24s
+The map is stored per vantage (operator + port) with a sweep time per /24, so later
+scans from the same network only census blocks it does not cover or swept too long ago.
+"""
+
+import time
+import base64
+import random
+import ipaddress
+from array import array
+
+from app.scanner.core import SHNetUtils, int_to_ip
+
+try:
+    import numpy as np
+except ImportError:  # optional: targets stay an array('I')
+    np = None
+
+CENSUS_PER_BLOCK = 2
+CENSUS_TTL_SEC = 6 * 3600
+
+
+def range_blocks(cidr_list):
+    """Sorted, de-duplicated /24 block numbers (ip >> 8) covered by the CIDRs in cidr_list."""
+    _, ranges = SHNetUtils._parse_ranges(cidr_list)
+    blocks = set()
+    for first, n in ranges:
+        blocks.update(range(first, first + n))
+    return sorted(blocks)
+
+
+def census_targets(blocks, per_block=CENSUS_PER_BLOCK):
+    """
+    per_block random hosts from each block, shuffled so consecutive probes hit different
+    /24s. Stays the uint32 array of SHNetUtils.sample_blocks (numpy or array('I')):
+    IPs become strings only at the socket, inside the probe.
+    """
+    ips = SHNetUtils.sample_blocks([b << 8 for b in blocks], per_block)
+    if np is not None and isinstance(ips, np.ndarray):
+        np.random.default_rng().shuffle(ips)
+    else:
+        random.shuffle(ips)
+    return ips
+
+
+def _pack(values):
+    return base64.b64encode(array('I', values).tobytes()).decode('ascii')
+
+
+def _unpack(text):
+    if not text:
+        return []
+    arr = array('I')
+    arr.frombytes(base64.b64decode(text))
+    return list(arr)
+
+
+class SHLivenessMap:
+    """
+    Probed and live /24 blocks seen from one vantage point.
+    Each probed block keeps the time it was last swept, so blocks age out one by one:
+    merging a new sweep never refreshes blocks it did not probe.
+    """
+
+    def __init__(self, probed=None, live=None, updated_at=None):
+        self.updated_at = updated_at or 0.0
+        if isinstance(probed, dict):
+            self.probed = dict(probed)  # block → last sweep (epoch seconds)
+        else:
+            self.probed = dict.fromkeys(probed or (), self.updated_at)
+        self.live = set(live or ())
+
+    @classmethod
+    def unpack(cls, probed_text, live_text, swept_text, updated_at):
+        """Rows stored before per-block sweep times get updated_at for every block."""
+        blocks, swept = _unpack(probed_text), _unpack(swept_text)
+        if len(swept) != len(blocks):
+            swept = [updated_at or 0.0] * len(blocks)
+        return cls(dict(zip(blocks, swept)), _unpack(live_text), updated_at)
+
+    def pack(self):
+        """(probed_text, live_text, swept_text): base64 uint32, blocks sorted, sweep times in probed order."""
+        blocks = sorted(self.probed)
+        return _pack(blocks), _pack(sorted(self.live)), _pack([int(self.probed[b]) for b in blocks])
+
+    def expire(self, ttl_sec=CENSUS_TTL_SEC):
+        """Forget blocks last swept more than ttl_sec ago (they are unknown again). Returns how many."""
+        cutoff = time.time() - ttl_sec
+        stale = [b for b, t in self.probed.items() if t < cutoff]
+        for b in stale:
+            del self.probed[b]
+            self.live.discard(b)
+        return len(stale)
+
+    def unknown_blocks(self, blocks):
+        return [b for b in blocks if b not in self.probed]
+
+    def merge(self, probed, live):
+        """Fold in a census run: re-probed blocks take their new state and sweep time."""
+        now = time.time()
+        probed = set(probed)
+        self.live = (self.live - probed) | set(live)
+        self.probed.update(dict.fromkeys(probed, now))
+        self.updated_at = now
+
+    def live_cidrs(self, blocks):
+        """Live blocks among `blocks`, collapsed into as few CIDRs as possible."""
+        nets = (ipaddress.IPv4Network(f'{int_to_ip(b << 8)}/24') for b in blocks if b in self.live)
+        return [str(n) for n in ipaddress.collapse_addresses(nets)]
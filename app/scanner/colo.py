@@ -0,0 +1,114 @@
+"""
+CDN IP Scanner V2.0 - Trace Fields and Colo Targeting
+Author: shahinst
+
+/cdn-cgi/trace answers with key=value lines (fl, ip, colo, loc, ...). colo is the
+PoP that served us, loc the country it sees us in — which PoP an edge IP lands on
+depends on the operator's routing, so it is learned per scan:
+  - parse_trace(): the few fields we keep, from the body the verifier already read
+  - SHColoFilter: "only colos X,Y" / "never colo Z"; once the first hits of a /24
+    all land on unwanted colos, the rest of that block is skipped before any socket
+"""
+
+import threading
+from collections import Counter
+
+TRACE_FIELDS = (b'fl', b'ip', b'colo', b'loc', b'http', b'tls')
+_MAX_TRACE_BODY = 4096
+
+
+def parse_trace(body):
+    """{'colo': 'FRA', 'loc': 'IR', ...} from a trace body (bytes); {} if it is not one."""
+    if not body or len(body) > _MAX_TRACE_BODY or b'colo=' not in body:
+        return {}
+    fields = {}
+    for line in body.split(b'\n'):
+        key, sep, value = line.partition(b'=')
+        if sep and key in TRACE_FIELDS:
+            fields[key.decode('ascii', 'ignore')] = value.strip().decode('ascii', 'ignore')
+    return fields
+
+
+def parse_colo_list(text):
+    """'fra, ams' / ['FRA', 'AMS'] → frozenset({'FRA', 'AMS'})."""
+    if isinstance(text, (list, tuple, set, frozenset)):
+        items = text
+    else:
+        items = str(text or '').replace(';', ',').replace(' ', ',').split(',')
+    return frozenset(str(c).strip().upper() for c in items if str(c).strip())
+
+
+class SHColoFilter:
+    """
+    Colo include/exclude rules plus a per-/24 colo map for one scan session.
+    A block is written off after `decide_after` hits that all went to unwanted colos.
+    Thread-safe.
+    """
+
+    def __init__(self, include=(), exclude=(), decide_after=2):
+        self.decide_after = decide_after
+        self._lock = threading.Lock()
+        self._blocks = {}  # block → [hits on wanted colos, hits on unwanted colos]
+        self._unwanted_blocks = set()
+        self.colos = Counter()  # colo → verified IPs seen (before filtering)
+        self.rejected = 0
+        self.skipped = 0
+        self.configure(include, exclude)
+
+    def configure(self, include=(), exclude=()):
+        with self._lock:
+            self.include = parse_colo_list(include)
+            self.exclude = parse_colo_list(exclude)
+            self._blocks.clear()
+            self._unwanted_blocks.clear()
+            self.colos.clear()
+            self.rejected = self.skipped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.include or self.exclude)
+
+    def allowed(self, colo):
+        """Unknown colo (non-Cloudflare edge, no trace body) is never rejected."""
+        if not colo:
+            return True
+        colo = colo.upper()
+        if self.include and colo not in self.include:
+            return False
+        return colo not in self.exclude
+
+    def skip_block(self, ip_int):
+        """True when ip_int's /24 is known to map to unwanted colos (checked before probing)."""
+        if not self._unwanted_blocks or (ip_int >> 8) not in self._unwanted_blocks:
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def observe(self, ip_int, colo):
+        """Record the colo of a verified IP; returns False if the IP must be dropped."""
+        ok = self.allowed(colo)
+        with self._lock:
+            if colo:
+                self.colos[colo.upper()] += 1
+            if not self.enabled or not colo:
+                return ok
+            block = ip_int >> 8
+            entry = self._blocks.setdefault(block, [0, 0])
+            entry[0 if ok else 1] += 1
+            if not entry[0] and entry[1] >= self.decide_after:
+                self._unwanted_blocks.add(block)
+            if not ok:
+                self.rejected += 1
+        return ok
+
+    def stats(self):
+        with self._lock:
+            return {
+                'include': sorted(self.include),
+                'exclude': sorted(self.exclude),
+                'colos': dict(self.colos.most_common()),
+                'rejected': self.rejected,
+                'unwanted_blocks': len(self._unwanted_blocks),
+                'skipped': self.skipped,
+            }
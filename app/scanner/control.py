@@ -0,0 +1,198 @@
+"""
+CDN IP Scanner V2.0 - Scan Flow Control
+Author: shahinst
+
+Feedback control for how hard the scanner pushes the network:
+  - SHConcurrencyController: AIMD on in-flight probes, driven by the observed
+    timeout ratio and connect-latency inflation (like TCP congestion control)
+  - SHRateLimiter: token bucket on new connections per second, globally and per /24,
+    so NAT/conntrack tables and upstream rate limits see a smooth packet rate
+"""
+
+import time
+import asyncio
+import threading
+
+
+class SHConcurrencyController:
+    """
+    Additive-increase / multiplicative-decrease controller for in-flight probes.
+
+    Workers report every TCP connect with record(). Once per interval the window is
+    compared with its baselines (moving-average timeout ratio, lowest connect latency):
+      - congested (timeout ratio jumped above baseline, or latency inflated) → target × decrease
+      - otherwise → target + increase
+    The target always stays within [floor, cap]. Dead IPs in a range are part of the
+    baseline timeout ratio, so only a *change* in loss is read as congestion.
+    """
+
+    def __init__(self, start, cap, floor=20, interval=2.0, min_samples=50,
+                 decrease=0.7, increase=None, timeout_margin=0.15, inflation_limit=2.0):
+        self.cap = max(1, int(cap))
+        self.floor = max(1, min(int(floor), self.cap))
+        self.target = max(self.floor, min(int(start), self.cap))
+        self.interval = interval
+        self.min_samples = min_samples
+        self.decrease = decrease
+        self.increase = increase or max(1, self.cap // 20)
+        self.timeout_margin = timeout_margin
+        self.inflation_limit = inflation_limit
+
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._probes = 0
+        self._timeouts = 0
+        self._lat_sum = 0.0
+        self._lat_n = 0
+        self.base_timeout_ratio = None
+        self.base_latency_ms = None
+        self.last_timeout_ratio = 0.0
+        self.last_latency_ms = None
+        self.adjustments = 0
+
+    def record(self, timed_out, latency_ms=None):
+        """
+        Report one connect attempt.
+        timed_out: True for timeouts / unreachable (congestion signal);
+                   False for success or a fast refusal (the path answered).
+        latency_ms: connect RTT of a successful attempt.
+        """
+        with self._lock:
+            self._probes += 1
+            if timed_out:
+                self._timeouts += 1
+            elif latency_ms is not None:
+                self._lat_sum += latency_ms
+                self._lat_n += 1
+            now = time.monotonic()
+            if self._probes >= self.min_samples and now - self._window_start >= self.interval:
+                self._evaluate()
+                self._window_start = now
+                self._probes = self._timeouts = self._lat_n = 0
+                self._lat_sum = 0.0
+
+    def _evaluate(self):
+        ratio = self._timeouts / self._probes
+        latency = (self._lat_sum / self._lat_n) if self._lat_n else None
+        self.last_timeout_ratio = ratio
+        self.last_latency_ms = latency
+
+        # Latency baseline: lowest window seen, drifting up 2% per window so it can recover
+        if latency is not None:
+            if self.base_latency_ms is None:
+                self.base_latency_ms = latency
+            else:
+                self.base_latency_ms = min(self.base_latency_ms * 1.02, latency)
+
+        congested = False
+        if self.base_timeout_ratio is not None:
+            congested = ratio > self.base_timeout_ratio + self.timeout_margin
+        if latency is not None and self.base_latency_ms:
+            congested = congested or latency > self.base_latency_ms * self.inflation_limit
+
+        # Timeout baseline: moving average, so a steady share of dead IPs is absorbed
+        # and only a jump in loss (after we pushed harder) counts as congestion
+        if self.base_timeout_ratio is None:
+            self.base_timeout_ratio = ratio
+        else:
+            self.base_timeout_ratio += 0.25 * (ratio - self.base_timeout_ratio)
+
+        if congested:
+            new_target = max(self.floor, int(self.target * self.decrease))
+        else:
+            new_target = min(self.cap, self.target + self.increase)
+        if new_target != self.target:
+            self.target = new_target
+            self.adjustments += 1
+
+    def stats(self):
+        return {
+            'target': self.target,
+            'cap': self.cap,
+            'timeout_ratio': round(self.last_timeout_ratio, 3),
+            'latency_ms': round(self.last_latency_ms, 1) if self.last_latency_ms else None,
+            'adjustments': self.adjustments,
+        }
+
+
+class SHRateLimiter:
+    """
+    Token-bucket limiter for new probe connections (connects/sec).
+
+    Implemented as virtual scheduling (GCRA): every acquire reserves the next free
+    send slot, so once the burst allowance is used up callers are spaced evenly.
+      - rate: global connects/sec (None/0 = unlimited)
+      - per_block_rate: connects/sec into any single destination /24 (None/0 = unlimited)
+      - burst: how many connects may go back-to-back after an idle period
+    A reservation is made for the per-/24 slot first, then the earliest global slot
+    at or after it, so a busy /24 never wastes global capacity.
+    """
+
+    _PRUNE_AT = 8192  # per-/24 entries kept before expired ones are swept
+
+    def __init__(self, rate=None, per_block_rate=None, burst=None):
+        self.rate = float(rate) if rate else None
+        self.per_block_rate = float(per_block_rate) if per_block_rate else None
+        if burst is None:
+            burst = max(1.0, (self.rate or 0) / 10.0)  # 100 ms worth of probes
+        self.burst = float(burst)
+        self._lock = threading.Lock()
+        self._next = 0.0
+        self._block_next = {}
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_total = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.per_block_rate)
+
+    def reserve(self, ip_int):
+        """Reserve a connect slot for ip_int (uint32); returns seconds to wait before connecting."""
+        now = time.monotonic()
+        with self._lock:
+            t = now
+            block = ip_int >> 8
+            if self.per_block_rate:
+                t = max(t, self._block_next.get(block, 0.0))
+            if self.rate:
+                # GCRA: _next is the theoretical arrival time (TAT); a connect may run up to
+                # (burst - 1) intervals ahead of it, and the TAT itself only moves forward
+                t = max(t, self._next - (self.burst - 1) / self.rate)
+                self._next = max(self._next, t) + 1.0 / self.rate
+            if self.per_block_rate:
+                self._block_next[block] = t + 1.0 / self.per_block_rate
+                if len(self._block_next) > self._PRUNE_AT:
+                    self._block_next = {b: v for b, v in self._block_next.items() if v > now}
+            delay = max(0.0, t - now)
+            self.acquired += 1
+            if delay > 0:
+                self.delayed += 1
+                self.wait_total += delay
+        return delay
+
+    def acquire(self, ip_int, should_stop=None):
+        """Blocking acquire for worker threads. Returns False if should_stop() fired while waiting."""
+        delay = self.reserve(ip_int)
+        deadline = time.monotonic() + delay
+        while delay > 0:
+            if should_stop and should_stop():
+                return False
+            time.sleep(min(delay, 0.25))
+            delay = deadline - time.monotonic()
+        return True
+
+    async def acquire_async(self, ip_int):
+        """Event-loop acquire for the async engine (cancellation stops the wait)."""
+        delay = self.reserve(ip_int)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'per_block_rate': self.per_block_rate,
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'wait_sec': round(self.wait_total, 1),
+        }
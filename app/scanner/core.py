@@ -7,18 +7,41 @@ Scanning mechanism based on proven multi-attempt /cdn-cgi/trace verification:
   - Round-robin across ALL ranges (ensures every range is represented)
   - Generate random IPs from each /24
   - 5 sequential HTTP requests per IP (AbortController-like behavior)
-  - >= 3 out of 5 successes + avg latency <= max → valid IP
-  - Connection reuse (requests.Session) for 3x speed boost
+  - >= 3 out of 5 successes + request RTT (median warm TTFB) <= max → valid IP
+  - Connection reuse (one keep-alive socket per IP, see probes.py) for 3x speed boost
 """
 
 import os
+import math
 import time
+import errno
+import heapq
+import queue
 import random
+import ssl
 import socket
+import struct
+import selectors
+import threading
 import ipaddress
+from array import array
+from collections import deque
 import requests
 import urllib3
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from app.scanner.control import SHConcurrencyController, SHRateLimiter
+from app.scanner.probes import SHTraceProber, SHProbeTimings, TLS_SESSION_CACHE
+from app.scanner.policy import VERIFY_POLICIES, make_verify_policy
+from app.scanner.portprofile import SHPortProfiles
+from app.scanner.colo import SHColoFilter, parse_trace
+from app.scanner.cdnprofile import SHProbeProfiles
+from app.scanner.strategy import SHProbeStrategy
+from app.scanner.pipeline import SHScanPipeline
+
+try:
+    import numpy as np
+except ImportError:  # optional: vectorized sampling falls back to pure Python
+    np = None
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -29,6 +52,7 @@ HTTP_PORTS = {80, 8080, 2052, 2082, 2086, 2095}
 SH_TRACE_ATTEMPTS = 5        # 5 sequential requests per IP
 SH_TRACE_MIN_SUCCESS = 3     # need >= 3 successes out of 5
 SH_HOST_HEADER = "www.cloudflare.com"
+SH_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 
 
 def _sh_trace_url(ip_str, port):
@@ -37,14 +61,93 @@ def _sh_trace_url(ip_str, port):
     return f"{scheme}://{ip_str}:{port}{SH_TRACE_PATH}"
 
 
+# ===== Compact IP representation =====
+# Inside the scanner IPs travel as uint32 ints; dotted strings are built only at the
+# socket and output boundary.
+
+def ip_to_int(ip_str):
+    """'104.16.0.1' → 1745879041. Raises OSError on malformed input."""
+    return struct.unpack('!I', socket.inet_aton(ip_str))[0]
+
+
+def int_to_ip(n):
+    """1745879041 → '104.16.0.1'."""
+    return f"{(n >> 24) & 0xFF}.{(n >> 16) & 0xFF}.{(n >> 8) & 0xFF}.{n & 0xFF}"
+
+
+def to_ip_str(ip):
+    """Dotted string for an int / numpy integer / str IP."""
+    return ip if isinstance(ip, str) else int_to_ip(int(ip))
+
+
+def to_ip_int(ip):
+    """uint32 for an int / numpy integer / str IP."""
+    return ip_to_int(ip) if isinstance(ip, str) else int(ip)
+
+
+class SHIPBitmap:
+    """
+    Compact set of IPv4 addresses: one 256-bit bytearray per touched /24.
+    ~32 bytes per block instead of ~70+ bytes per string in a set(), i.e. a
+    few bytes per tracked IP at the densities the scanner samples.
+    Accepts int or str IPs; safe to share between worker threads.
+    """
+
+    __slots__ = ('_blocks', '_count', '_lock')
+
+    def __init__(self):
+        self._blocks = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, ip):
+        n = to_ip_int(ip)
+        byte, bit = (n & 0xFF) >> 3, 1 << (n & 7)
+        with self._lock:
+            bits = self._blocks.get(n >> 8)
+            if bits is None:
+                bits = self._blocks[n >> 8] = bytearray(32)
+            if not bits[byte] & bit:
+                bits[byte] |= bit
+                self._count += 1
+
+    def __contains__(self, ip):
+        n = to_ip_int(ip)
+        bits = self._blocks.get(n >> 8)
+        return bits is not None and bool(bits[(n & 0xFF) >> 3] & (1 << (n & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._blocks = {}
+            self._count = 0
+
+
 # Speed mode resource allocation
+# resource_pct = starting concurrency, cap_pct = ceiling the adaptive controller may grow to
 SPEED_MODES = {
-    'hyper': {'resource_pct': 0.20, 'ips_per_24': 30,  'label': 'Hyper (20%)'},
-    'turbo': {'resource_pct': 0.40, 'ips_per_24': 50,  'label': 'Turbo (40%)'},
-    'ultra': {'resource_pct': 0.60, 'ips_per_24': 80,  'label': 'Ultra (60%)'},
-    'deep':  {'resource_pct': 0.80, 'ips_per_24': 120, 'label': 'Deep (80%)'},
+    'hyper': {'resource_pct': 0.20, 'cap_pct': 0.40, 'ips_per_24': 30,  'label': 'Hyper (20%)'},
+    'turbo': {'resource_pct': 0.40, 'cap_pct': 0.60, 'ips_per_24': 50,  'label': 'Turbo (40%)'},
+    'ultra': {'resource_pct': 0.60, 'cap_pct': 0.80, 'ips_per_24': 80,  'label': 'Ultra (60%)'},
+    'deep':  {'resource_pct': 0.80, 'cap_pct': 1.00, 'ips_per_24': 120, 'label': 'Deep (80%)'},
 }
 
+# Scan engines: 'thread' = ThreadPoolExecutor, 'async' = asyncio event loop (async_engine.py)
+SCAN_ENGINES = ('thread', 'async')
+ASYNC_PROBES_PER_WORKER = 20     # async concurrency = thread workers × this
+ASYNC_MAX_CONCURRENCY = 20000
+TRACE_VERIFIERS = ('raw', 'requests')
+ENRICH_WORKERS = 32              # background extra-port probes when defer_ports is on
+_NP_SAMPLE_CHUNK = 4096          # /24 blocks per vectorized sampling step
+# Non-blocking connect_ex() results: Windows reports WSAE* codes, not the POSIX ones
+_CONNECT_PENDING = frozenset(e for e in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                                         getattr(errno, 'WSAEWOULDBLOCK', None),
+                                         getattr(errno, 'WSAEINPROGRESS', None),
+                                         getattr(errno, 'WSAEALREADY', None)) if e is not None)
+_CONNECT_REFUSED = frozenset(e for e in (errno.ECONNREFUSED, getattr(errno, 'WSAECONNREFUSED', None)) if e is not None)
+
 
 class SHNetUtils:
     """
@@ -91,6 +194,41 @@ class SHNetUtils:
         numbers = random.sample(range(1, 255), count)
         return [f"{prefix_24}.{n}" for n in numbers]
 
+    @staticmethod
+    def sample_blocks(block_bases, per_block=30):
+        """
+        Draw per_block distinct random hosts (.1-.254) from every /24 in one batched call.
+
+        block_bases: /24 base addresses as uint32 (e.g. 104.16.5.0 → 1745880320), any
+        sequence or NumPy array. Returns a flat uint32 array of len(block_bases) × per_block
+        IPs, block by block — a numpy.ndarray when NumPy is installed, array('I') otherwise.
+        Both can be passed straight to SHScanner.batch_scan. Used where a known set of
+        blocks is sampled at once (census targets); the session stream is iter_scan_ips().
+        """
+        k = min(per_block, 254)
+        if np is None:
+            out = array('I')
+            for base in block_bases:
+                base = int(base)
+                out.extend(base + h for h in random.sample(range(1, 255), k))
+            return out
+
+        bases = np.asarray(block_bases, dtype=np.uint32)
+        if bases.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.uint32)
+        rng = np.random.default_rng()
+        chunks = []
+        # Chunked so the (blocks × 254) random-key matrix stays a few MB
+        for start in range(0, bases.size, _NP_SAMPLE_CHUNK):
+            part = bases[start:start + _NP_SAMPLE_CHUNK]
+            if k == 254:
+                hosts = np.broadcast_to(np.arange(1, 255, dtype=np.uint32), (part.size, 254))
+            else:
+                keys = rng.random((part.size, 254), dtype=np.float32)
+                hosts = np.argpartition(keys, k - 1, axis=1)[:, :k].astype(np.uint32) + 1
+            chunks.append((part[:, None] + hosts).ravel())
+        return np.concatenate(chunks)
+
     @staticmethod
     def generate_scan_ips(cidr_list, per_block=30, max_total=None, shuffle=True):
         """
@@ -103,50 +241,265 @@ class SHNetUtils:
 
         This GUARANTEES every single range contributes IPs, even tiny /22 ranges
         alongside huge /12 ranges.
+
+        Returns dotted strings. The scan itself streams uint32s from iter_scan_ips()
+        instead of building this list.
         """
-        single_ips = []
-        range_block_lists = []  # List of shuffled block lists, one per range
+        ips = list(SHNetUtils.iter_scan_ips(cidr_list, per_block, max_total))
+        if shuffle:
+            random.shuffle(ips)
+        return [int_to_ip(n) for n in ips]
 
+    @staticmethod
+    def _parse_ranges(cidr_list):
+        """Split input into (single_ips, [(first_block, n_blocks), ...]) as uint32 / /24 block numbers."""
+        single_ips = []
+        ranges = []
         for cidr in cidr_list:
             cidr = str(cidr).strip()
             if not cidr:
                 continue
             if '/' not in cidr:
-                single_ips.append(cidr)
+                try:
+                    single_ips.append(ip_to_int(cidr))
+                except OSError:
+                    pass
                 continue
-            blocks = SHNetUtils.split_to_24_blocks(cidr)
-            if blocks:
-                random.shuffle(blocks)  # Shuffle blocks within each range
-                range_block_lists.append(blocks)
+            try:
+                net = ipaddress.IPv4Network(cidr, strict=False)
+            except ValueError:
+                continue
+            first_block = int(net.network_address) >> 8
+            last_block = int(net.broadcast_address) >> 8
+            ranges.append((first_block, last_block - first_block + 1))
+        return single_ips, ranges
 
-        if not range_block_lists and not single_ips:
-            return []
+    @staticmethod
+    def count_scan_ips(cidr_list, per_block=30, max_total=None):
+        """Number of IPs iter_scan_ips() will yield, computed in O(number of ranges)."""
+        single_ips, ranges = SHNetUtils._parse_ranges(cidr_list)
+        count = len(single_ips) + sum(n for _, n in ranges) * min(per_block, 254)
+        return min(count, max_total) if max_total else count
 
-        # Round-robin: pick blocks from each range alternately
-        # This ensures ALL ranges are represented from the very first round
-        selected_blocks = []
-        if range_block_lists:
-            max_rounds = max(len(b) for b in range_block_lists)
-            for round_idx in range(max_rounds):
-                for blocks in range_block_lists:
-                    if round_idx < len(blocks):
-                        selected_blocks.append(blocks[round_idx])
-                # Stop when we have enough blocks to generate max_total IPs
-                if max_total and len(selected_blocks) * per_block >= max_total:
-                    break
+    @staticmethod
+    def iter_scan_ips(cidr_list, per_block=30, max_total=None, priority_blocks=None, weights=None):
+        """
+        Streaming form of generate_scan_ips().
 
-        # Generate random IPs from selected blocks
-        all_ips = list(single_ips)
-        for prefix in selected_blocks:
-            all_ips.extend(SHNetUtils.random_ips_from_block(prefix, per_block))
+        Yields IPs one at a time, round-robin across ALL ranges (one IP per range per
+        round), so every range is represented from the first few IPs on. Inside a range
+        a cyclic-group walk (SHCyclicPermutation) visits each /24 × host-slot pair once,
+        so each /24 contributes at most per_block hosts and no IP is yielded twice by
+        one generator. Create one per scan session and slice batches from it.
+        Memory is O(number of ranges) — nothing is expanded up front.
+        IPs are yielded as uint32 ints (see int_to_ip / SHScanner.check).
 
-        if shuffle:
-            random.shuffle(all_ips)
+        priority_blocks: /24 numbers (ip >> 8) inside the ranges to sample first, in
+        the given order (e.g. AIOptimizer.history_first); the round-robin then skips them.
+
+        weights: one share per cidr_list entry (e.g. SHRangeIndex.weights_for). Ranges
+        are then interleaved by stride scheduling — a range with twice the weight gets
+        twice the IPs per unit of progress — instead of one IP per range per round.
+        """
+        range_weights = None
+        if weights is not None:
+            single_ips, ranges, range_weights = [], [], []
+            for cidr, w in zip(cidr_list, weights):
+                singles, parsed = SHNetUtils._parse_ranges([cidr])
+                single_ips.extend(singles)
+                ranges.extend(parsed)
+                range_weights.extend([w] * len(parsed))
+        else:
+            single_ips, ranges = SHNetUtils._parse_ranges(cidr_list)
+        seed = random.getrandbits(32)
+        cursors = [_RangeCursor(first, n, per_block, seed) for first, n in ranges]
+        random.shuffle(single_ips)
+        priority = list(dict.fromkeys(priority_blocks or ()))
+        skip = set(priority)
+
+        yielded = 0
+        for ip in single_ips:
+            if max_total and yielded >= max_total:
+                return
+            yield ip
+            yielded += 1
+
+        k = min(per_block, 254)
+        for block in priority:
+            for host in random.sample(range(1, 255), k):
+                if max_total and yielded >= max_total:
+                    return
+                yield (block << 8) | host
+                yielded += 1
+
+        if range_weights is not None:
+            # Stride scheduling: always advance the range with the smallest pass value
+            strides = [1.0 / max(w, 1e-12) for w in range_weights]
+            heap = [(strides[i] / 2, i) for i in range(len(cursors))]
+            heapq.heapify(heap)
+            while heap:
+                if max_total and yielded >= max_total:
+                    return
+                pass_value, i = heapq.heappop(heap)
+                ip = cursors[i].next_ip()
+                if ip is None:
+                    continue
+                heapq.heappush(heap, (pass_value + strides[i], i))
+                if skip and ip >> 8 in skip:
+                    continue
+                yield ip
+                yielded += 1
+            return
+
+        while cursors:
+            alive = []
+            for cur in cursors:
+                if max_total and yielded >= max_total:
+                    return
+                ip = cur.next_ip()
+                if ip is None:
+                    continue
+                alive.append(cur)
+                if skip and ip >> 8 in skip:
+                    continue
+                yield ip
+                yielded += 1
+            cursors = alive
+
+
+def _is_prime(n):
+    """Deterministic Miller-Rabin for n < 3.3e24 (covers every IPv4-sized space)."""
+    if n < 2:
+        return False
+    small = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+    for q in small:
+        if n % q == 0:
+            return n == q
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for a in small:
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime_factors(n):
+    """Distinct prime factors by trial division (n <= ~2^33 → at most ~90k steps)."""
+    factors = []
+    q = 2
+    while q * q <= n:
+        if n % q == 0:
+            factors.append(q)
+            while n % q == 0:
+                n //= q
+        q += 1 if q == 2 else 2
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+class SHCyclicPermutation:
+    """
+    Full-cycle pseudo-random permutation of 0..n-1 (zmap/masscan style).
+
+    Walks the multiplicative group of integers modulo a prime p > n:
+    x → x·g mod p with g a random primitive root visits every element of
+    1..p-1 exactly once before returning to the start. Elements > n are skipped.
+    State is two integers, so any address space can be walked without repeats
+    and without memory proportional to its size.
+    """
+
+    __slots__ = ('n', 'p', 'g', 'start', 'x', 'done')
+
+    def __init__(self, n):
+        self.n = n
+        p = n + 1
+        while not _is_prime(p):
+            p += 1
+        self.p = p
+        self.g = self._random_generator(p)
+        self.start = random.randrange(1, p) if p > 2 else 1
+        self.x = self.start
+        self.done = n <= 0
+
+    @staticmethod
+    def _random_generator(p):
+        if p <= 3:
+            return p - 1
+        factors = _prime_factors(p - 1)
+        while True:
+            g = random.randrange(2, p - 1)
+            if all(pow(g, (p - 1) // q, p) != 1 for q in factors):
+                return g
 
-        if max_total:
-            all_ips = all_ips[:max_total]
+    def next(self):
+        """Next element of the permutation, or None once all n were returned."""
+        while not self.done:
+            value = self.x - 1
+            self.x = self.x * self.g % self.p
+            if self.x == self.start:
+                self.done = True
+            if value < self.n:
+                return value
+        return None
 
-        return all_ips
+    def __iter__(self):
+        while True:
+            value = self.next()
+            if value is None:
+                return
+            yield value
+
+
+# Units of Z/254: multipliers that make (a·slot + c) mod 254 a permutation of host slots
+_HOST_UNITS = [a for a in range(1, 254) if math.gcd(a, 254) == 1]
+
+
+def _host_octet(block, slot, seed):
+    """
+    Stateless per-/24 host permutation: slot 0..253 → host .1-.254.
+    The affine map is keyed by (block, seed), so each block gets its own order.
+    """
+    h = ((block * 0x9E3779B1) ^ seed) & 0xFFFFFFFF
+    h = (h ^ (h >> 15)) * 0x2C1B3C6D & 0xFFFFFFFF
+    return (_HOST_UNITS[h % len(_HOST_UNITS)] * slot + (h >> 8)) % 254 + 1
+
+
+class _RangeCursor:
+    """
+    Lazy per-range state for SHNetUtils.iter_scan_ips.
+
+    The range's sample space is (its /24 blocks) × (per_block host slots). One
+    SHCyclicPermutation walks that space, so each block gives exactly per_block
+    distinct hosts, no address repeats for the lifetime of the cursor and the
+    state is O(1) regardless of range size.
+    """
+
+    __slots__ = ('first_block', 'n_blocks', 'perm', 'seed')
+
+    def __init__(self, first_block, n_blocks, per_block, seed):
+        self.first_block = first_block
+        self.n_blocks = n_blocks
+        self.perm = SHCyclicPermutation(n_blocks * min(per_block, 254))
+        self.seed = seed
+
+    def next_ip(self):
+        """Next IP as uint32, or None when the range's sample space is used up."""
+        e = self.perm.next()
+        if e is None:
+            return None
+        slot, idx = divmod(e, self.n_blocks)
+        block = self.first_block + idx
+        return (block << 8) | _host_octet(block, slot, self.seed)
 
 
 class SHScanner:
@@ -157,21 +510,153 @@ class SHScanner:
 
     def __init__(self):
         self.max_workers = 800
+        self._start_workers = 800
+        self.engine = 'thread'
+        self.async_concurrency = 5000
+        self.adaptive = True
+        self.controller = None
+        self.rate_limiter = None
+        self.verifier = 'raw'
+        self.verify_policy = make_verify_policy('sprt', SH_TRACE_ATTEMPTS, SH_TRACE_MIN_SUCCESS)
+        self.trace_prober = SHTraceProber(
+            SH_HOST_HEADER, SH_TRACE_PATH, SH_USER_AGENT, HTTPS_PORTS, SH_TRACE_ATTEMPTS,
+        )
         self.timeout = 1.8
         self.max_latency_ms = 9999
-        self.failed_cache = set()
+        self.failed_cache = SHIPBitmap()
         self.log_callback = None
         self._stop_flag = False
+        self._pool = None
+        self._pool_size = 0
+        self._done_q = queue.SimpleQueue()  # completed futures, fed by done-callbacks
+        self._inflight = {}  # future → ip, submitted, not yet consumed (may span batches with carry_over)
+        self.block_bandit = None  # SHBlockBandit fed with every check outcome (adaptive /24 sampling)
+        self.defer_ports = False
+        self.port_profiles = SHPortProfiles()
+        self.colo_filter = SHColoFilter()
+        self.probe_profiles = SHProbeProfiles()
+        self.strategy = SHProbeStrategy()
+        self.pipeline = SHScanPipeline()
+        self._verify_pool = None
+        self._verify_pool_size = 0
+        self._handoff = deque()  # (ip, check context, slot) passed the pre-filter, waiting for a verify worker
+        self._verify_inflight = {}  # future → ip on the verify pool
+        self._handoff_slots = None  # Semaphore(queue_max): a live candidate holds one until verified
+        self._handoff_slots_max = 0
+        self._async_engine = None  # SHAsyncEngine of the session (engine='async'), its loop spans batches
+        self.enrich_callback = None  # enrich_callback({'ip', 'open_ports'}) once deferred ports are known
+        self._enrich_pool = None
+        self._enrich_pending = set()
+        self._enriched_q = queue.SimpleQueue()
+        self._build_controller()
 
     def set_mode(self, mode_key):
-        """Configure scanner based on speed mode with resource percentage."""
+        """
+        Configure scanner based on speed mode.
+        resource_pct gives the starting concurrency, cap_pct the most the adaptive
+        controller may use; the pool is sized for the cap.
+        """
         mode = SPEED_MODES.get(mode_key, SPEED_MODES['hyper'])
         cpu_count = os.cpu_count() or 4
         # Higher base for network I/O bound tasks
         base_workers = max(800, min(2000, cpu_count * 200))
         resource_pct = mode['resource_pct']
-        self.max_workers = max(150, int(base_workers * resource_pct))
-        self._log('INFO', f'Mode set to {mode_key}: {int(resource_pct*100)}% resources, {self.max_workers} workers')
+        self._start_workers = max(150, int(base_workers * resource_pct))
+        self.max_workers = max(self._start_workers, int(base_workers * mode.get('cap_pct', resource_pct)))
+        self.async_concurrency = min(ASYNC_MAX_CONCURRENCY, self.max_workers * ASYNC_PROBES_PER_WORKER)
+        self._build_controller()
+        self._log('INFO', f'Mode set to {mode_key}: {int(resource_pct*100)}% resources, '
+                          f'{self._start_workers} workers (cap {self.max_workers})')
+
+    def set_engine(self, engine):
+        """Select scan engine for the next batches: 'thread' (default) or 'async'."""
+        self.engine = engine if engine in SCAN_ENGINES else 'thread'
+        self._build_controller()
+
+    def set_verifier(self, verifier):
+        """Trace verifier: 'raw' (keep-alive socket prober, default) or 'requests' (legacy)."""
+        self.verifier = verifier if verifier in TRACE_VERIFIERS else 'raw'
+
+    def set_verify_policy(self, name):
+        """When the trace check may stop: 'sprt' (default), 'early' or 'full' (all attempts). Resets its stats."""
+        if name not in VERIFY_POLICIES:
+            name = 'sprt'
+        self.verify_policy = make_verify_policy(name, SH_TRACE_ATTEMPTS, SH_TRACE_MIN_SUCCESS)
+
+    def set_defer_ports(self, enabled):
+        """Emit results right after the primary port verifies; probe extra ports in the background."""
+        self.defer_ports = bool(enabled)
+
+    def set_port_inference(self, enabled):
+        """Reuse a /24's learned extra-port profile instead of probing every verified IP."""
+        self.port_profiles.enabled = bool(enabled)
+
+    def set_strategy(self, spec=None):
+        """Probe tier chain for check(): e.g. 'tcp', 'tls', 'tcp,tls,trace' (default 'tcp,trace').
+        Raises ValueError for an invalid chain (see parse_strategy)."""
+        self.strategy.configure(spec)
+
+    def set_pipeline(self, enabled=True, verify_workers=None, queue_size=None):
+        """
+        Run check() as two stages (pre-filter pool → bounded queue → verify pool).
+        verify_workers / queue_size default to a quarter of the pool and twice that.
+        """
+        self.pipeline.configure(enabled, verify_workers, queue_size)
+
+    def set_probe_profiles(self, range_index=None, force=None):
+        """Verify each IP with its CDN's probe profile (provenance from range_index; force pins one)."""
+        self.probe_profiles.configure(range_index, force)
+
+    def set_colo_filter(self, include=(), exclude=()):
+        """Keep only IPs served from `include` colos / never from `exclude` colos (IATA codes)."""
+        self.colo_filter.configure(include, exclude)
+
+    def set_adaptive(self, enabled):
+        """Enable/disable AIMD concurrency control (disabled = fixed mode preset)."""
+        self.adaptive = bool(enabled)
+        self._build_controller()
+
+    def _start_concurrency(self):
+        if self.engine == 'async':
+            return min(self.async_concurrency, self._start_workers * ASYNC_PROBES_PER_WORKER)
+        return self._start_workers
+
+    def _build_controller(self):
+        if not self.adaptive:
+            self.controller = None
+            return
+        cap = self.async_concurrency if self.engine == 'async' else self.max_workers
+        self.controller = SHConcurrencyController(
+            start=self._start_concurrency(), cap=cap, floor=min(50, cap),
+        )
+
+    def concurrency_target(self):
+        """In-flight probe limit right now: controller target, or the fixed mode preset."""
+        if self.controller is not None:
+            return self.controller.target
+        return self._start_concurrency()
+
+    def set_rate_limit(self, rate=None, per_block_rate=None):
+        """Limit new connections to `rate`/s overall and `per_block_rate`/s per /24 (None/0 = off)."""
+        limiter = SHRateLimiter(rate, per_block_rate)
+        self.rate_limiter = limiter if limiter.enabled else None
+        if self.rate_limiter:
+            self._log('INFO', f'Rate limit: {rate or "∞"} connects/s, {per_block_rate or "∞"}/s per /24')
+
+    def _throttle(self, ip_str):
+        """Wait for a connect slot. Returns False if the scan was stopped while waiting."""
+        if self.rate_limiter is None:
+            return True
+        return self.rate_limiter.acquire(ip_to_int(ip_str), lambda: self._stop_flag)
+
+    def _observe_connect(self, timed_out, latency_ms=None):
+        if self.controller is not None:
+            self.controller.record(timed_out, latency_ms)
+
+    def _record_outcome(self, ip, result):
+        """Feed a finished check to the /24 bandit (checks cut short by stop() are not outcomes)."""
+        if self.block_bandit is not None and not self._stop_flag:
+            self.block_bandit.record(to_ip_int(ip), result is not None, result['ping'] if result else None)
 
     def stop(self):
         self._stop_flag = True
@@ -179,6 +664,7 @@ class SHScanner:
     def reset(self):
         self._stop_flag = False
         self.failed_cache.clear()
+        self.port_profiles.clear()
 
     def _log(self, level, message):
         if self.log_callback:
@@ -187,9 +673,10 @@ class SHScanner:
             except Exception:
                 pass
 
-    def _sequential_trace_check(self, ip_str, port, max_latency_ms):
+    @staticmethod
+    def _trace_timeouts(max_latency_ms):
         """
-        5 sequential HTTP requests to /cdn-cgi/trace with connection reuse.
+        Per-attempt timeouts and total time cap for the 5-attempt trace check.
 
         FIX 1: multiply حالا برای latency بالا هم مقدار مناسب داره —
                 قبلاً وقتی ping_max=9999 بود، multiply=1.0 میشد و timeout
@@ -198,10 +685,8 @@ class SHScanner:
         FIX 2: max_total_sec حداقل 8 ثانیه — قبلاً با ping_max پایین
                 ممکن بود خیلی کوتاه بشه.
 
-        Returns (is_valid: bool, avg_latency_ms: float).
+        Returns (timeouts: list of seconds per attempt, max_total_sec: float).
         """
-        url = _sh_trace_url(ip_str, port)
-
         # FIX 1: multiply اصلاح شد — مقدار بیشتر = timeout بیشتر per request
         # قبلاً: 1.5 برای <=500، 1.2 برای <=1000، 1.0 برای بقیه (اشتباه)
         # الان: برای مقادیر بالا (مثل 9999) هم timeout کافی داره
@@ -222,16 +707,46 @@ class SHScanner:
         # FIX 2: حداقل 8 ثانیه total — قبلاً با ping_max کم خیلی کوتاه میشد
         max_total_sec = max(8.0, min(15.0, max_latency_ms * 3.0 / 1000.0))
 
-        total_start = time.time()
+        timeouts = []
+        for i in range(SH_TRACE_ATTEMPTS):
+            # FIX 3: per-request timeout — حداقل 1.5s، حداکثر 4s
+            # قبلاً حداکثر 2.5s بود که برای شبکه‌های کند کافی نبود
+            if max_latency_ms > 3000:
+                # برای ping_max خیلی بالا (9999): timeout ثابت 3 ثانیه
+                timeouts.append(3.0)
+            else:
+                raw_timeout = timeout_factors[i] * multiply * max_latency_ms / 1000.0
+                timeouts.append(min(4.0, max(1.5, raw_timeout)))
+        return timeouts, max_total_sec
+
+    def _prefilter_timeout(self):
+        """TCP pre-filter timeout on the primary port (see FIX 4 in check)."""
+        return min(2.5, max(1.5, self.max_latency_ms / 1000.0 * 0.5))
+
+    def _port_timeout(self):
+        """TCP timeout for the extra-port checks after verification."""
+        return min(3.0, max(1.5, self.max_latency_ms / 1000.0))
+
+    def _requests_trace_attempts(self, ip_str, port, timeouts, max_total_sec, total_start, decide=None,
+                                 timings=None, trace=None, profile=None):
+        """
+        Legacy verifier: requests.Session per IP (connection reuse via urllib3).
+        Same contract as SHTraceProber.run: returns (successes, attempts_done, verdict).
+        Only TTFB is timed here (Response.elapsed); connect/TLS are hidden inside urllib3.
+        """
+        url = profile.url(ip_str, port) if profile is not None else _sh_trace_url(ip_str, port)
+        statuses = profile.statuses if profile is not None else None
         successes = 0
+        attempts_done = 0
+        verdict = None
         aborted = False
 
         # Session for connection reuse (TCP+TLS only once per IP)
         session = requests.Session()
         session.verify = False
         session.headers.update({
-            "Host": SH_HOST_HEADER,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+            "Host": profile.host if profile is not None else SH_HOST_HEADER,
+            "User-Agent": SH_USER_AGENT,
         })
 
         try:
@@ -243,157 +758,718 @@ class SHScanner:
                 if time.time() - total_start > max_total_sec:
                     break
 
-                # FIX 3: per-request timeout — حداقل 1.5s، حداکثر 4s
-                # قبلاً حداکثر 2.5s بود که برای شبکه‌های کند کافی نبود
-                if max_latency_ms > 3000:
-                    # برای ping_max خیلی بالا (9999): timeout ثابت 3 ثانیه
-                    timeout_sec = 3.0
-                else:
-                    raw_timeout = timeout_factors[i] * multiply * max_latency_ms / 1000.0
-                    timeout_sec = min(4.0, max(1.5, raw_timeout))
-
+                attempts_done += 1
                 try:
-                    r = session.get(url, timeout=timeout_sec, allow_redirects=False)
-                    successes += 1
+                    r = session.get(url, timeout=timeouts[i], allow_redirects=False)
+                    if timings is not None:
+                        timings.add_request(r.elapsed.total_seconds() * 1000, successes > 0)
+                    if trace is not None and not trace:
+                        trace.update(parse_trace(r.content))
+                    if statuses is None or r.status_code in statuses:
+                        successes += 1
                 except requests.exceptions.Timeout:
                     aborted = True
                 except requests.exceptions.ConnectionError:
                     aborted = True  # Connection failed → no point retrying same IP
                 except Exception:
                     successes += 1
+                if decide is not None and not aborted:
+                    verdict = decide(successes, attempts_done, (time.time() - total_start) * 1000)
+                    if verdict is not None:
+                        break
         finally:
             try:
                 session.close()
             except Exception:
                 pass
+        return successes, attempts_done, verdict
+
+    def _sequential_trace_check(self, ip_str, port, max_latency_ms, profile=None):
+        """
+        Up to 5 sequential HTTP requests to /cdn-cgi/trace (or the request of the IP's
+        CDN probe profile) with connection reuse.
+        Timeouts come from _trace_timeouts(). The verifier is the raw keep-alive
+        SHTraceProber by default, or the requests.Session path with verifier='requests'.
+        verify_policy may end the run as soon as the outcome is settled.
+
+        Latency is the steady-state request RTT (median TTFB on the kept-alive
+        connection, see SHProbeTimings) — not wall time per attempt, which also
+        holds the handshake. Falls back to the per-attempt average if nothing was timed.
+
+        Returns (is_valid: bool, latency_ms: float, breakdown: dict, trace: dict) —
+        trace holds the fields of the first trace body (colo, loc, ...), {} if none.
+        """
+        timeouts, max_total_sec = self._trace_timeouts(max_latency_ms)
+        if not self._throttle(ip_str):
+            return False, 0.0, {}, {}
+
+        policy = self.verify_policy
+        timings = SHProbeTimings()
+        trace = {}
+
+        def decide(successes, attempts_done, elapsed_ms):
+            return policy.decide(successes, attempts_done, elapsed_ms, max_latency_ms, timings)
+
+        total_start = time.time()
+        if self.verifier == 'requests':
+            successes, attempts_done, verdict = self._requests_trace_attempts(
+                ip_str, port, timeouts, max_total_sec, total_start, decide=decide, timings=timings, trace=trace,
+                profile=profile,
+            )
+        else:
+            prober = profile.prober if profile is not None else self.trace_prober
+            successes, attempts_done, verdict = prober.run(
+                ip_str, port, timeouts, max_total_sec,
+                should_stop=lambda: self._stop_flag, decide=decide, timings=timings, trace=trace,
+            )
 
         total_time_ms = (time.time() - total_start) * 1000
-        avg_latency = total_time_ms / SH_TRACE_ATTEMPTS
+        policy.record(attempts_done, total_time_ms, verdict)
 
-        is_valid = (successes >= SH_TRACE_MIN_SUCCESS) and (avg_latency <= max_latency_ms)
-        return is_valid, avg_latency
+        breakdown = timings.summary()
+        latency = policy.latency(timings, total_time_ms, attempts_done)
+        is_valid = policy.is_valid(successes, latency, max_latency_ms)
+        return is_valid, latency, breakdown, trace
 
     def _tcp_connect(self, ip_str, port, timeout_sec):
-        """Quick TCP connect to check if port is open."""
+        """
+        Quick TCP connect to check if port is open (after a rate-limiter slot).
+        Outcome and RTT are reported to the concurrency controller: a refusal means
+        the path answered, a timeout/unreachable is read as possible congestion.
+        """
+        if not self._throttle(ip_str):
+            return False
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        t0 = time.perf_counter()
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(timeout_sec)
             sock.connect((ip_str, port))
-            sock.close()
+            self._observe_connect(False, (time.perf_counter() - t0) * 1000)
             return True
+        except ConnectionRefusedError:
+            self._observe_connect(False)
+            return False
         except Exception:
+            self._observe_connect(True)
             return False
+        finally:
+            sock.close()
 
-    def check(self, ip, ports):
+    def _tls_handshake(self, ip_str, port, host, timeout_sec):
         """
-        Check a single IP:
-        1. Quick TCP pre-filter → rejects dead IPs FAST
-        2. If TCP passes → 5-sequential /cdn-cgi/trace verification
-        3. If valid → quick TCP check on remaining ports
-        4. Returns result dict or None
+        TCP connect + bare TLS handshake with SNI `host` (after a rate-limiter slot), no
+        HTTP. The connect outcome goes to the concurrency controller like _tcp_connect.
+        Returns the handshake time in ms, or None if either step failed.
+        """
+        if not self._throttle(ip_str):
+            return None
+        t0 = time.perf_counter()
+        try:
+            sock = socket.create_connection((ip_str, port), timeout=timeout_sec)
+        except ConnectionRefusedError:
+            self._observe_connect(False)
+            return None
+        except OSError:
+            self._observe_connect(True)
+            return None
+        t1 = time.perf_counter()
+        self._observe_connect(False, (t1 - t0) * 1000)
+        try:
+            tls = TLS_SESSION_CACHE.context.wrap_socket(sock, server_hostname=host,
+                                                        do_handshake_on_connect=False)
+            sock = tls
+            cpu_start = time.thread_time()
+            tls.do_handshake()
+            TLS_SESSION_CACHE.record_handshake(tls.session_reused, time.thread_time() - cpu_start)
+            if tls.version() != 'TLSv1.3':
+                TLS_SESSION_CACHE.put(host, tls.session)  # 1.3 tickets only come with data
+            return (time.perf_counter() - t1) * 1000
+        except (OSError, ssl.SSLError, ValueError):
+            return None
+        finally:
+            sock.close()
 
-        FIX 4: TCP pre-filter timeout از 1.0s به 2.5s افزایش یافت.
-                قبلاً روی سرورهای ایران/روسیه/چین که latency بالاست،
-                IP های معتبر هم رد میشدن چون 1 ثانیه کافی نبود.
+    def _tcp_connect_many(self, ip_str, ports, timeout_sec, stoppable=True):
+        """
+        TCP-connect all `ports` of one IP at once (non-blocking sockets + selector)
+        with one shared deadline, instead of one timeout per port back to back.
+        Outcomes go to the concurrency controller like _tcp_connect. Returns open ports
+        in the order given. stoppable=False ignores stop() (background enrichment of
+        IPs that were already reported).
+        """
+        if not ports:
+            return []
+        should_stop = (lambda: self._stop_flag) if stoppable else None
+        sel = selectors.DefaultSelector()
+        pending = {}
+        opened = set()
+        try:
+            for port in ports:
+                if self.rate_limiter is not None and not self.rate_limiter.acquire(ip_to_int(ip_str), should_stop):
+                    break
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((ip_str, port))
+                if err in _CONNECT_PENDING:
+                    pending[sock] = (port, time.perf_counter())
+                    sel.register(sock, selectors.EVENT_WRITE)
+                else:
+                    self._observe_connect(err not in _CONNECT_REFUSED)
+                    sock.close()
+
+            deadline = time.monotonic() + timeout_sec
+            while pending and not (should_stop and should_stop()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in sel.select(timeout=min(remaining, 0.5)):
+                    sock = key.fileobj
+                    port, t0 = pending.pop(sock)
+                    sel.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        opened.add(port)
+                        self._observe_connect(False, (time.perf_counter() - t0) * 1000)
+                    else:
+                        self._observe_connect(err not in _CONNECT_REFUSED)
+                    sock.close()
+            for _ in pending:
+                self._observe_connect(True)  # still connecting at the deadline
+        finally:
+            for sock in pending:
+                sock.close()
+            sel.close()
+        return [p for p in ports if p in opened]
+
+    def tcp_probe(self, ip, ports):
+        """
+        Census probe: TCP connect to the primary port only, no verification.
+        Returns {'ip', 'open_ports', 'ping'} (ping = connect time) or None.
         """
         if self._stop_flag:
             return None
-        ip_str = str(ip)
-        if ip_str in self.failed_cache:
+        ip_str = int_to_ip(to_ip_int(ip))
+        port = ports[0] if ports else 443
+        t0 = time.perf_counter()
+        if not self._tcp_connect(ip_str, port, self._prefilter_timeout()):
             return None
+        return {'ip': ip_str, 'open_ports': [port], 'ping': (time.perf_counter() - t0) * 1000}
 
-        primary_port = ports[0] if ports else 443
+    def _defer_enrichment(self, ip_str, known_ports, extra_ports):
+        """Queue the extra-port probe of a verified IP on the small enrichment pool."""
+        if self._enrich_pool is None:
+            self._enrich_pool = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix='sh-enrich')
 
+        def enrich():
+            opened = self._tcp_connect_many(ip_str, extra_ports, self._port_timeout(), stoppable=False)
+            self.port_profiles.observe(ip_to_int(ip_str), extra_ports, opened)
+            self._enriched_q.put({'ip': ip_str, 'open_ports': list(known_ports) + opened})
+
+        f = self._enrich_pool.submit(enrich)
+        self._enrich_pending.add(f)
+        f.add_done_callback(self._enrich_pending.discard)
+
+    def drain_enrichment(self):
+        """Deliver finished background port probes to enrich_callback (on the caller's thread)."""
+        while True:
+            try:
+                update = self._enriched_q.get_nowait()
+            except queue.Empty:
+                return
+            if self.enrich_callback:
+                try:
+                    self.enrich_callback(update)
+                except Exception:
+                    pass
+
+    def finish_enrichment(self, timeout=None):
+        """Wait (up to timeout seconds) for deferred port probes, then deliver them."""
+        deadline = time.monotonic() + timeout if timeout else None
+        while self._enrich_pending:
+            if deadline and time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+            self.drain_enrichment()
+        self.drain_enrichment()
+
+    # ---------- probe tiers (see strategy.py) ----------
+
+    def _tier_tcp(self, ip_int, ip_str, port, profile, result):
+        """TCP pre-filter → rejects dead IPs FAST."""
         # FIX 4: TCP timeout افزایش یافت: 1.0s → 2.5s
         # دلیل: روی شبکه‌های با latency بالا (ایران، روسیه، چین)
         # IP های معتبر CDN هم ممکنه TCP connect > 1s داشته باشن
-        tcp_prefilter_timeout = min(2.5, max(1.5, self.max_latency_ms / 1000.0 * 0.5))
-        if not self._tcp_connect(ip_str, primary_port, tcp_prefilter_timeout):
-            self.failed_cache.add(ip_str)
-            return None
+        t0 = time.perf_counter()
+        if not self._tcp_connect(ip_str, port, self._prefilter_timeout()):
+            return False
+        result['ping'] = (time.perf_counter() - t0) * 1000
+        return True
 
-        # TCP passed → full 5-sequential-attempt verification
-        result = {'ip': ip_str, 'open_ports': [], 'ping': None}
-        is_valid, avg_latency = self._sequential_trace_check(
-            ip_str, primary_port, self.max_latency_ms
-        )
+    def _tier_tls(self, ip_int, ip_str, port, profile, result):
+        """
+        Bare TLS handshake with the profile's SNI. A plain-HTTP port has no handshake:
+        it passes on the tcp tier's connect, or gets one here when the chain has no tcp tier.
+        """
+        if port not in profile.https_ports:
+            return 'tcp' in self.strategy.tiers or self._tier_tcp(ip_int, ip_str, port, profile, result)
+        tls_ms = self._tls_handshake(ip_str, port, profile.host, self._port_timeout())
+        if tls_ms is None:
+            return False
+        result['ping'] = tls_ms
+        result['latency'] = {'tls_ms': round(tls_ms, 1)}
+        return True
 
+    def _tier_trace(self, ip_int, ip_str, port, profile, result):
+        """Multi-attempt trace verification; the trace body's colo must pass colo_filter."""
+        is_valid, latency, breakdown, trace = self._sequential_trace_check(
+            ip_str, port, self.max_latency_ms, profile
+        )
         if not is_valid:
-            self.failed_cache.add(ip_str)
+            return False
+        if not self.colo_filter.observe(ip_int, trace.get('colo')):
+            self._log('DEBUG', f'{ip_str}: colo {trace.get("colo")} filtered out')
+            return False
+        result['ping'] = latency
+        result['latency'] = breakdown
+        result['colo'] = trace.get('colo')
+        result['trace'] = trace
+        return True
+
+    def check(self, ip, ports):
+        """
+        Check a single IP:
+        0. Probe profile of the IP's CDN (range provenance); ports it cannot serve are dropped
+        1. The strategy's tiers, cheapest first (default tcp → trace):
+           tcp   — quick TCP pre-filter, rejects dead IPs FAST
+           tls   — bare TLS handshake with the CDN's SNI
+           trace — 5-sequential /cdn-cgi/trace verification; the trace body's colo must
+                   pass colo_filter (blocks that only hit unwanted colos are skipped)
+           The first tier that rejects ends the check; ping comes from the last tier.
+        2. If valid → remaining ports: taken from the /24's port profile when one is
+           known (listed in inferred_ports), else TCP-checked all at once (or deferred
+           to the enrichment pool with defer_ports; the result then has ports_pending=True)
+        3. Returns result dict or None
+
+        With the staged pipeline, batch_scan runs the same steps split in two:
+        _stage_prefilter (0 + tiers before trace) and _stage_verify (trace + 2).
+
+        FIX 4: TCP pre-filter timeout از 1.0s به 2.5s افزایش یافت.
+                قبلاً روی سرورهای ایران/روسیه/چین که latency بالاست،
+                IP های معتبر هم رد میشدن چون 1 ثانیه کافی نبود.
+        """
+        ctx = self._check_start(ip, ports)
+        if ctx is None or not self._run_tiers(ctx, self.strategy.tiers):
             return None
+        return self._check_finish(ctx)
 
-        result['ping'] = avg_latency
-        result['open_ports'].append(primary_port)
+    def _check_start(self, ip, ports):
+        """
+        Step 0 of check(), before any socket. Returns the check context
+        (ip_int, ip_str, profile, ports, result) or None if the IP is skipped.
+        """
+        if self._stop_flag:
+            return None
+        ip_int = to_ip_int(ip)
+        if ip_int in self.failed_cache:
+            return None
+        if self.colo_filter.skip_block(ip_int):
+            return None  # earlier hits of this /24 all landed on unwanted colos
+        # Probe profile of the IP's CDN; ports that CDN never answers on are dropped
+        profile, ports = self.probe_profiles.for_ip(ip_int, ports or [443])
+        if not ports:
+            return None
+        ip_str = int_to_ip(ip_int)
+        result = {'ip': ip_str, 'open_ports': [], 'ping': None, 'cdn': profile.name}
+        return ip_int, ip_str, profile, ports, result
 
-        # Quick TCP scan on remaining ports
-        tcp_timeout = min(3.0, max(1.5, self.max_latency_ms / 1000.0))
-        for port in ports[1:]:
+    def _run_tiers(self, ctx, tiers):
+        """Step 1 of check() for `tiers` (all or part of the strategy). False on the first rejection."""
+        ip_int, ip_str, profile, ports, result = ctx
+        strategy = self.strategy
+        for tier in tiers:
             if self._stop_flag:
-                break
-            if self._tcp_connect(ip_str, port, tcp_timeout):
-                result['open_ports'].append(port)
+                return False
+            t0 = time.perf_counter()
+            passed = getattr(self, '_tier_' + tier)(ip_int, ip_str, ports[0], profile, result)
+            strategy.record(tier, passed, time.perf_counter() - t0)
+            if not passed:
+                self.failed_cache.add(ip_int)
+                return False
+        return True
+
+    def _check_finish(self, ctx):
+        """Step 2 of check(): the primary port passed every tier; add the remaining ports."""
+        ip_int, ip_str, profile, ports, result = ctx
+        result['open_ports'].append(ports[0])
+
+        # Remaining ports: from the /24 profile, concurrently with one shared deadline,
+        # or later in the background
+        extra_ports = ports[1:]
+        inferred = self.port_profiles.plan(ip_int, extra_ports)
+        if inferred is not None:
+            result['open_ports'] += inferred
+            result['inferred_ports'] = inferred
+        elif self.defer_ports and extra_ports:
+            self._defer_enrichment(ip_str, result['open_ports'], extra_ports)
+            result['ports_pending'] = True
+        elif extra_ports:
+            opened = self._tcp_connect_many(ip_str, extra_ports, self._port_timeout())
+            if not self._stop_flag:
+                self.port_profiles.observe(ip_int, extra_ports, opened)
+            result['open_ports'] += opened
 
-        self._log('DEBUG', f'{ip_str}: open={result["open_ports"]} ping={avg_latency:.0f}ms')
+        breakdown = result.get('latency') or {}
+        self._log('DEBUG', f'{ip_str}: open={result["open_ports"]} ping={result["ping"] or 0:.0f}ms '
+                           f'[{self.strategy.name}] connect={breakdown.get("connect_ms")} '
+                           f'tls={breakdown.get("tls_ms")} jitter={breakdown.get("jitter_ms")}')
+        return result
+
+    def _stage_prefilter(self, ip, ports):
+        """Pipeline stage 1 (big pool): the tiers before trace. Returns the check context or None."""
+        ctx = self._check_start(ip, ports)
+        if ctx is None:
+            return None
+        pipeline = self.pipeline
+        pipeline.started('prefilter')
+        t0 = time.perf_counter()
+        passed = False
+        try:
+            passed = self._run_tiers(ctx, pipeline.prefilter_tiers)
+        finally:
+            pipeline.finished('prefilter', passed, time.perf_counter() - t0)
+        return ctx if passed else None
+
+    def _stage_verify(self, ctx):
+        """Pipeline stage 2 (verify pool): trace verification + remaining ports. Result dict or None."""
+        pipeline = self.pipeline
+        pipeline.started('verify')
+        t0 = time.perf_counter()
+        result = None
+        try:
+            if self._run_tiers(ctx, pipeline.verify_tiers):
+                result = self._check_finish(ctx)
+        finally:
+            pipeline.finished('verify', result is not None, time.perf_counter() - t0)
         return result
 
-    def batch_scan(self, ips, ports, progress_callback=None, result_callback=None, start_time=None):
+    def _get_pool(self):
         """
-        Scan a batch of IPs in parallel.
+        Long-lived worker pool owned by the scanner (one per scan session).
+        Threads are created once and reused by every batch; the pool is only
+        rebuilt when set_mode() changed max_workers.
+        """
+        if self._pool is None or self._pool_size != self.max_workers:
+            self.close_pool()
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sh-scan')
+            self._pool_size = self.max_workers
+            self._done_q = queue.SimpleQueue()
+        return self._pool
+
+    def _get_async_engine(self):
+        """
+        Session event loop engine for engine='async' (the async counterpart of _get_pool):
+        created once, reused by every batch, rebuilt only when set_mode() changed the
+        concurrency cap.
+        """
+        if self._async_engine is not None and self._async_engine.requested != self.async_concurrency:
+            self._async_engine.close()
+            self._async_engine = None
+        if self._async_engine is None:
+            from app.scanner.async_engine import SHAsyncEngine
+            self._async_engine = SHAsyncEngine(self)
+        return self._async_engine
+
+    def _get_verify_pool(self):
+        """Second session pool for the pipeline's verify stage (after _get_pool: shares its done queue)."""
+        size = self.pipeline.verify_pool
+        if self._verify_pool is None or self._verify_pool_size != size:
+            if self._verify_pool is not None:
+                self._verify_pool.shutdown(wait=False, cancel_futures=True)
+            self._verify_pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='sh-verify')
+            self._verify_pool_size = size
+        return self._verify_pool
+
+    def close_pool(self):
+        """Shut the session pools down. Called once when the scan session ends."""
+        for f in list(self._inflight) + list(self._verify_inflight):
+            f.cancel()
+        self._inflight = {}
+        self._verify_inflight = {}
+        self._handoff = deque()
+        self._handoff_slots = None
+        self._handoff_slots_max = 0
+        if self._async_engine is not None:
+            self._async_engine.close()
+            self._async_engine = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_size = 0
+        if self._verify_pool is not None:
+            self._verify_pool.shutdown(wait=False, cancel_futures=True)
+            self._verify_pool = None
+            self._verify_pool_size = 0
+        if self._enrich_pool is not None:
+            self._enrich_pool.shutdown(wait=False, cancel_futures=True)
+            self._enrich_pool = None
+        self._enrich_pending = set()
+        self._enriched_q = queue.SimpleQueue()
+
+    def finish_batches(self, ports, progress_callback=None, result_callback=None, start_time=None):
+        """Wait for the checks carried over by the last batch_scan(carry_over=True)."""
+        if self.engine == 'async':
+            if self._async_engine is None or not self._async_engine.pending:
+                return []
+        elif not (self._inflight or self._handoff or self._verify_inflight):
+            return []
+        return self.batch_scan([], ports, progress_callback, result_callback, start_time)
+
+    def batch_scan(self, ips, ports, progress_callback=None, result_callback=None, start_time=None,
+                   carry_over=False, total=None, probe='check'):
+        """
+        Scan a batch of IPs in parallel on the session pool.
         Calls result_callback(result) immediately when each valid IP is found.
         Stops quickly when _stop_flag is set (check every ~2s via short timeout).
+        With engine='async' the batch runs on the session's event loop (see async_engine.py).
+
+        ips may be any iterable (list or generator). At most concurrency_target()
+        checks are in flight; the next IP is pulled only when one completes, so
+        memory stays flat for any batch size.
+        total is the expected count for progress when ips has no len().
+
+        carry_over=True returns as soon as the batch tail drops below a quarter of
+        the pool; the still-running checks are handed to the next batch_scan call so
+        the pool never drains between batches. Call finish_batches() to wait for them.
+
+        probe='tcp' runs tcp_probe (census phase) instead of the full check.
+
+        When the strategy has tiers before trace and the pipeline is on, checks run
+        staged (see pipeline.py and _pipeline_scan).
         """
+        n = len(ips) if hasattr(ips, '__len__') else (total or 0)
+
+        if self.engine == 'async':
+            return self._get_async_engine().run(ips, ports, progress_callback, result_callback, start_time,
+                                                total=n, probe=probe, carry_over=carry_over)
+
+        if probe != 'tcp' and self.pipeline.plan(self.strategy.tiers, self.max_workers):
+            return self._pipeline_scan(ips, ports, progress_callback, result_callback, start_time,
+                                       carry_over, n)
+
+        probe_fn = self.tcp_probe if probe == 'tcp' else self.check
+
         results = []
-        n = len(ips)
         n_completed = 0
         wait_timeout = 2.0  # check _stop_flag every 2 seconds
+        low_water = self.max_workers // 4 if carry_over else 0
 
-        self._log('INFO', f'Batch scan started: {n} IPs, {len(ports)} ports, {self.max_workers} workers')
+        self._log('INFO', f'Batch scan started: {n or "?"} IPs, {len(ports)} ports, '
+                          f'{self.concurrency_target()} in flight (cap {self.max_workers})')
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-            futures = {ex.submit(self.check, ip, ports): ip for ip in ips}
-            iterator = as_completed(futures, timeout=wait_timeout)
-            while True:
-                if self._stop_flag:
-                    for f in futures:
+        pool = self._get_pool()
+        done_q = self._done_q
+        inflight = self._inflight
+        source = iter(ips)
+        exhausted = False
+
+        while True:
+            # Top the window up (backpressure: never more pending checks than the
+            # current concurrency target; the controller moves it with network feedback)
+            window = self.concurrency_target()
+            while not exhausted and len(inflight) < window and not self._stop_flag:
+                try:
+                    ip = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                f = pool.submit(probe_fn, ip, ports)
+                inflight[f] = ip
+                f.add_done_callback(done_q.put)
+
+            if self._stop_flag:
+                for f in inflight:
+                    f.cancel()
+                inflight.clear()
+                break
+            if exhausted and len(inflight) <= low_water:
+                break
+
+            self.drain_enrichment()
+            try:
+                future = done_q.get(timeout=wait_timeout)
+            except queue.Empty:
+                continue
+            if future not in inflight:
+                continue  # cancelled in an earlier stop
+            ip = inflight.pop(future)
+
+            n_completed += 1
+            if progress_callback:
+                try:
+                    elapsed = (time.time() - start_time) if start_time else 0
+                    speed = n_completed / elapsed if elapsed > 0 else 0
+                    progress_callback(n_completed, n, speed, elapsed)
+                except Exception:
+                    pass
+            try:
+                result = future.result()
+                if probe != 'tcp':
+                    self._record_outcome(ip, result)
+                if result:
+                    results.append(result)
+                    if result_callback:
                         try:
-                            f.cancel()
+                            result_callback(result)
                         except Exception:
                             pass
-                    break
+            except Exception:
+                pass
+
+        self._log('INFO', f'Batch scan completed: {len(results)}/{n_completed} IPs found')
+        return results
+
+    def _pipeline_scan(self, ips, ports, progress_callback, result_callback, start_time, carry_over, n):
+        """
+        batch_scan with check() in two stages: _stage_prefilter on the session pool
+        (window = concurrency_target()), survivors queued in _handoff, _stage_verify on
+        the smaller verify pool. While _handoff holds queue_max candidates no new IP is
+        pre-filtered, and a pre-filter worker holding a live candidate waits for a free
+        slot before handing it over, so the queue never exceeds queue_max. All three
+        (both in-flight maps and the queue) carry over between batches like _inflight does.
+        A candidate gives its slot back to the semaphore it took it from, so a new
+        queue_max simply starts a new semaphore.
+        """
+        pipeline = self.pipeline
+        results = []
+        n_completed = 0
+        wait_timeout = 2.0
+        low_water = self.max_workers // 4 if carry_over else 0
+        verify_workers = pipeline.verify_pool
+        queue_max = pipeline.queue_max
+
+        self._log('INFO', f'Pipelined batch scan started: {n or "?"} IPs, {len(ports)} ports, '
+                          f'pre-filter {"+".join(pipeline.prefilter_tiers)} {self.concurrency_target()} in flight '
+                          f'(cap {self.max_workers}) → queue {queue_max} → '
+                          f'verify {"+".join(pipeline.verify_tiers)} {verify_workers} workers')
+
+        pool = self._get_pool()
+        verify_pool = self._get_verify_pool()
+        if self._handoff_slots is None or self._handoff_slots_max != queue_max:
+            self._handoff_slots = threading.Semaphore(queue_max)
+            self._handoff_slots_max = queue_max
+        done_q = self._done_q
+        inflight = self._inflight
+        handoff = self._handoff
+
+        def prefilter(ip):
+            """(check context, the slot semaphore it holds) for a live IP, else None."""
+            ctx = self._stage_prefilter(ip, ports)
+            if ctx is None:
+                return None
+            slots = self._handoff_slots
+            while not slots.acquire(timeout=0.5):
+                if self._stop_flag:
+                    return None
+            return ctx, slots
+
+        def release_slot(future):
+            """Stop path: hand back the slot of a pre-filter that finished (or finishes) live."""
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                future.result()[1].release()
+        verifying = self._verify_inflight
+        source = iter(ips)
+        exhausted = False
+
+        while True:
+            # Verify stage: start queued candidates on free verify workers
+            while handoff and len(verifying) < verify_workers and not self._stop_flag:
+                ip, ctx, slots = handoff.popleft()
+                slots.release()
+                f = verify_pool.submit(self._stage_verify, ctx)
+                verifying[f] = ip
+                f.add_done_callback(done_q.put)
+            # Pre-filter stage: top the window up unless the verify queue is full (backpressure)
+            window = self.concurrency_target()
+            while (not exhausted and len(inflight) < window and len(handoff) < queue_max
+                   and not self._stop_flag):
                 try:
-                    future = next(iterator)
+                    ip = next(source)
                 except StopIteration:
+                    exhausted = True
                     break
-                except FuturesTimeoutError:
+                f = pool.submit(prefilter, ip)
+                inflight[f] = ip
+                f.add_done_callback(done_q.put)
+            pipeline.queued(len(handoff))
+
+            if self._stop_flag:
+                for f in list(inflight):
+                    f.cancel()
+                    f.add_done_callback(release_slot)  # runs now if f is already done
+                for f in list(verifying):
+                    f.cancel()
+                inflight.clear()
+                verifying.clear()
+                for _, _, slots in handoff:
+                    slots.release()
+                handoff.clear()
+                break
+            if exhausted and len(inflight) + len(handoff) + len(verifying) <= low_water:
+                break
+
+            self.drain_enrichment()
+            try:
+                future = done_q.get(timeout=wait_timeout)
+            except queue.Empty:
+                continue
+            if future in inflight:
+                ip = inflight.pop(future)
+                try:
+                    live = future.result()
+                except Exception:
+                    live = None
+                if live is not None:
+                    handoff.append((ip,) + live)  # live: on to the verify stage
                     continue
-                n_completed += 1
-                if progress_callback:
-                    try:
-                        elapsed = (time.time() - start_time) if start_time else 0
-                        speed = n_completed / elapsed if elapsed > 0 else 0
-                        progress_callback(n_completed, n, speed, elapsed)
-                    except Exception:
-                        pass
+                result = None  # rejected by the pre-filter
+            elif future in verifying:
+                ip = verifying.pop(future)
                 try:
                     result = future.result()
-                    if result:
-                        results.append(result)
-                        if result_callback:
-                            try:
-                                result_callback(result)
-                            except Exception:
-                                pass
+                except Exception:
+                    result = None
+            else:
+                continue  # cancelled in an earlier stop
+
+            n_completed += 1
+            if progress_callback:
+                try:
+                    elapsed = (time.time() - start_time) if start_time else 0
+                    speed = n_completed / elapsed if elapsed > 0 else 0
+                    progress_callback(n_completed, n, speed, elapsed)
                 except Exception:
                     pass
+            self._record_outcome(ip, result)
+            if result:
+                results.append(result)
+                if result_callback:
+                    try:
+                        result_callback(result)
+                    except Exception:
+                        pass
 
-        self._log('INFO', f'Batch scan completed: {len(results)}/{n} IPs found')
+        pipeline.queued(len(handoff))
+        self._log('INFO', f'Pipelined batch scan completed: {len(results)}/{n_completed} IPs found')
         return results
 
     @staticmethod
     def calc_score(result):
-        """Calculate score based on ping and open ports."""
+        """Calculate score based on latency (steady-state RTT when timed), jitter and open ports."""
         score = 0.0
-        ping_val = result.get('ping')
+        latency = result.get('latency') or {}
+        ping_val = latency.get('rtt_ms')
+        if ping_val is None:
+            ping_val = result.get('ping')
         if ping_val is not None:
             if ping_val < 50:
                 score += 35
@@ -415,4 +1491,6 @@ class SHScanner:
             score += 4
         if 8443 in open_ports:
             score += 4
+        if latency.get('jitter_ms'):
+            score -= min(8.0, latency['jitter_ms'] / 25.0)  # unstable edges rank lower
         return max(0.0, min(100.0, score))
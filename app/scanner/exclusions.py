@@ -0,0 +1,223 @@
+"""
+CDN IP Scanner V2.0 - Exclusion Index
+Author: shahinst
+
+Addresses the generator must never hand to a probe:
+  - Blacklist file (data/exclusions.txt) and API-posted lists: CIDRs, single IPs,
+    'a.b.c.d-e.f.g.h' ranges; '#' starts a comment
+  - Per-scan sources: ClosedIP rows, IPs already found by earlier sessions
+Each source is merged into sorted, disjoint uint32 intervals; a candidate costs one
+bisect (O(log n)). Reloads build a new index and swap one reference, so a running
+scan sees either the old or the new list, never a half-built one. filter() checks the
+file's mtime about once a second, so edits apply mid-scan, even to a single-batch scan.
+"""
+
+import os
+import time
+import bisect
+import ipaddress
+import threading
+from array import array
+
+from app.scanner.core import ip_to_int
+
+try:
+    import numpy as np
+except ImportError:  # optional: drop() falls back to one bisect per IP
+    np = None
+
+RELOAD_CHECK_SEC = 1.0
+
+
+def _parse_entry(entry):
+    """(first, last) uint32 of one exclusion entry, or None if it is blank/a comment/invalid."""
+    if isinstance(entry, int):
+        return entry, entry
+    entry = str(entry).split('#', 1)[0].strip()
+    if not entry:
+        return None
+    try:
+        if '-' in entry:
+            lo, hi = (ip_to_int(part.strip()) for part in entry.split('-', 1))
+            return (lo, hi) if lo <= hi else (hi, lo)
+        if '/' in entry:
+            net = ipaddress.IPv4Network(entry, strict=False)
+            return int(net.network_address), int(net.broadcast_address)
+        ip = ip_to_int(entry)
+        return ip, ip
+    except (ValueError, OSError):
+        return None
+
+
+class SHExclusionIndex:
+    """Immutable sorted, disjoint uint32 intervals. `ip in index` is a single bisect."""
+
+    __slots__ = ('starts', 'ends', 'invalid')
+
+    def __init__(self, intervals=(), invalid=0):
+        self.starts = array('I')
+        self.ends = array('I')
+        self.invalid = invalid
+        for lo, hi in sorted(intervals):
+            if self.ends and lo <= self.ends[-1] + 1:
+                if hi > self.ends[-1]:
+                    self.ends[-1] = hi
+            else:
+                self.starts.append(lo)
+                self.ends.append(hi)
+
+    @classmethod
+    def from_entries(cls, entries):
+        intervals = []
+        invalid = 0
+        for entry in entries:
+            parsed = _parse_entry(entry)
+            if parsed is not None:
+                intervals.append(parsed)
+            elif not isinstance(entry, int) and str(entry).split('#', 1)[0].strip():
+                invalid += 1
+        return cls(intervals, invalid)
+
+    def union(self, *others):
+        intervals = list(zip(self.starts, self.ends))
+        for other in others:
+            intervals.extend(zip(other.starts, other.ends))
+        return SHExclusionIndex(intervals, self.invalid + sum(o.invalid for o in others))
+
+    def __contains__(self, ip):
+        if isinstance(ip, str):
+            ip = ip_to_int(ip)
+        i = bisect.bisect_right(self.starts, ip) - 1
+        return i >= 0 and ip <= self.ends[i]
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def n_addresses(self):
+        return sum(e - s + 1 for s, e in zip(self.starts, self.ends))
+
+
+class SHExclusions:
+    """
+    Named exclusion sources behind one atomically swapped combined index.
+    'file' is the blacklist file (reload()/reload_if_changed()); any other name
+    (e.g. 'closed', 'known') is set per scan with set_source().
+    reload_callback(stats) is called after filter() hot-reloaded the file.
+    """
+
+    def __init__(self, path=None, check_every=RELOAD_CHECK_SEC):
+        self.path = path
+        self.check_every = check_every
+        self.reload_callback = None
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._sources = {}  # name → SHExclusionIndex
+        self._index = SHExclusionIndex()
+        self._mtime = None
+        self.skipped = 0
+
+    def __contains__(self, ip):
+        return ip in self._index  # one reference read: old or new index, never partial
+
+    def _rebuild(self):
+        indexes = list(self._sources.values())
+        combined = indexes[0].union(*indexes[1:]) if indexes else SHExclusionIndex()
+        self._index = combined
+
+    def set_source(self, name, entries):
+        """Replace one source (entries: CIDR/IP/range strings or uint32 IPs)."""
+        index = SHExclusionIndex.from_entries(entries)
+        with self._lock:
+            self._sources[name] = index
+            self._rebuild()
+        return index
+
+    def clear_source(self, name):
+        with self._lock:
+            if self._sources.pop(name, None) is not None:
+                self._rebuild()
+
+    def reload(self):
+        """Re-read the blacklist file into the 'file' source (missing file = empty)."""
+        if not self.path or not os.path.exists(self.path):
+            self._mtime = None
+            self.clear_source('file')
+            return 0
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding='utf-8', errors='ignore') as f:
+            index = self.set_source('file', f.read().splitlines())
+        self._mtime = mtime
+        return len(index)
+
+    def reload_if_changed(self):
+        """Hot reload: re-read the file only when its mtime moved. True if reloaded."""
+        try:
+            mtime = os.path.getmtime(self.path) if self.path and os.path.exists(self.path) else None
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self.reload()
+        return True
+
+    def write_file(self, entries, append=False):
+        """Store entries in the blacklist file (one per line) and reload it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a' if append else 'w', encoding='utf-8') as f:
+            for entry in entries:
+                entry = str(entry).strip()
+                if entry:
+                    f.write(entry + '\n')
+        return self.reload()
+
+    def _maybe_reload(self):
+        """Hot reload from inside a running scan, at most once per check_every seconds."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_every:
+            return
+        self._checked_at = now
+        if self.reload_if_changed() and self.reload_callback:
+            try:
+                self.reload_callback(self.stats())
+            except Exception:
+                pass
+
+    def filter(self, ips):
+        """Drop excluded IPs from an IP iterable (counted in .skipped); picks up file edits as it goes."""
+        for n, ip in enumerate(ips):
+            if not n & 0xFF:
+                self._maybe_reload()
+            if ip in self._index:
+                self.skipped += 1
+                continue
+            yield ip
+
+    def drop(self, ips):
+        """
+        Excluded IPs removed from a uint32 array (numpy.ndarray or array('I')), returned as
+        the same type; counted in .skipped. One searchsorted over the whole array with NumPy.
+        """
+        index = self._index
+        if not len(index) or not len(ips):
+            return ips
+        if np is not None and isinstance(ips, np.ndarray):
+            starts = np.asarray(index.starts, dtype=np.uint32)
+            ends = np.asarray(index.ends, dtype=np.uint32)
+            i = np.searchsorted(starts, ips, side='right') - 1
+            excluded = (i >= 0) & (ips <= ends[np.maximum(i, 0)])
+            kept = ips[~excluded]
+        else:
+            kept = array('I', (ip for ip in ips if ip not in index))
+        self.skipped += len(ips) - len(kept)
+        return kept
+
+    def stats(self):
+        index = self._index
+        return {
+            'intervals': len(index),
+            'addresses': index.n_addresses,
+            'invalid': index.invalid,
+            'skipped': self.skipped,
+            'sources': {name: len(idx) for name, idx in self._sources.items()},
+        }
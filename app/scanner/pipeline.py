@@ -0,0 +1,166 @@
+"""
+CDN IP Scanner V2.0 - Staged Check Pipeline
+Author: shahinst
+
+check() split into two stages with their own concurrency, joined by a bounded queue:
+  - prefilter: the strategy's cheap tiers before 'trace' (tcp, tls) on the big pool
+    (its window follows the adaptive controller)
+  - verify:    'trace' + extra ports on a smaller pool, fed only with live candidates
+When the verify queue is full the prefilter stops taking new IPs (backpressure), so a
+burst of slow 15 s verifications never blocks 2.5 s pre-filters and vice versa.
+Per stage: workers, in flight, queue depth, done/passed, throughput and avg time —
+snapshot() is what scan_progress carries.
+"""
+
+import time
+import threading
+
+PIPELINE_STAGES = ('prefilter', 'verify')
+VERIFY_POOL_SHARE = 4        # verify workers = prefilter cap / 4 unless set
+VERIFY_MIN_WORKERS = 16
+VERIFY_QUEUE_FACTOR = 2      # queue holds 2 × verify workers candidates unless set
+_RATE_WINDOW_SEC = 2.0
+
+
+def split_tiers(tiers):
+    """(prefilter tiers, verify tiers): everything before 'trace' is pre-filter."""
+    tiers = tuple(tiers)
+    if 'trace' not in tiers:
+        return tiers, ()
+    i = tiers.index('trace')
+    return tiers[:i], tiers[i:]
+
+
+class SHStageStats:
+    """Counters of one stage. Mutated under SHScanPipeline's lock."""
+
+    __slots__ = ('name', 'tiers', 'workers', 'in_flight', 'queue', 'queue_max', 'queue_peak',
+                 'done', 'passed', 'busy', '_mark_t', '_mark_done', 'rate')
+
+    def __init__(self, name):
+        self.name = name
+        self.tiers = ()
+        self.workers = 0
+        self.queue_max = 0
+        self.reset()
+
+    def reset(self):
+        self.in_flight = 0
+        self.queue = 0
+        self.queue_peak = 0
+        self.done = 0
+        self.passed = 0
+        self.busy = 0.0
+        self._mark_t = time.monotonic()
+        self._mark_done = 0
+        self.rate = 0.0
+
+    def snapshot(self, wall):
+        now = time.monotonic()
+        if now - self._mark_t >= _RATE_WINDOW_SEC:
+            self.rate = (self.done - self._mark_done) / (now - self._mark_t)
+            self._mark_t, self._mark_done = now, self.done
+        return {
+            'stage': self.name,
+            'tiers': list(self.tiers),
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'queue': self.queue,
+            'queue_max': self.queue_max,
+            'queue_peak': self.queue_peak,
+            'done': self.done,
+            'passed': self.passed,
+            'throughput': round(self.rate, 1),             # recent, per second
+            'avg_throughput': round(self.done / wall, 1),  # since the scan started
+            'avg_ms': round(self.busy / self.done * 1000, 1) if self.done else None,
+        }
+
+
+class SHScanPipeline:
+    """
+    Stage plan and live metrics for one scan session. Thread-safe.
+    configure() sets the user's choice; plan() fits it to the strategy and pool sizes
+    before each batch. active is False when the strategy has no tier before 'trace'
+    (nothing to pre-filter) or the pipeline is switched off — check() then runs whole.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = True
+        self.verify_workers = None
+        self.queue_size = None
+        self.active = False
+        self.stages = {name: SHStageStats(name) for name in PIPELINE_STAGES}
+        self._started = time.monotonic()
+
+    def configure(self, enabled=True, verify_workers=None, queue_size=None):
+        with self._lock:
+            self.enabled = bool(enabled)
+            self.verify_workers = max(1, int(verify_workers)) if verify_workers else None
+            self.queue_size = max(1, int(queue_size)) if queue_size else None
+            self.active = False
+            for stage in self.stages.values():
+                stage.reset()
+            self._started = time.monotonic()
+
+    def plan(self, tiers, prefilter_workers):
+        """Split `tiers` into stages sized for a prefilter pool of `prefilter_workers`. Returns active."""
+        prefilter, verify = split_tiers(tiers)
+        with self._lock:
+            self.active = self.enabled and bool(prefilter) and bool(verify)
+            workers = self.verify_workers or max(VERIFY_MIN_WORKERS, prefilter_workers // VERIFY_POOL_SHARE)
+            pre, ver = self.stages['prefilter'], self.stages['verify']
+            pre.tiers, pre.workers = prefilter, prefilter_workers
+            ver.tiers, ver.workers = verify, min(workers, prefilter_workers)
+            ver.queue_max = self.queue_size or ver.workers * VERIFY_QUEUE_FACTOR
+        return self.active
+
+    def set_workers(self, prefilter_workers, verify_workers):
+        """Record the concurrency an engine actually gave each stage (shown in snapshot())."""
+        with self._lock:
+            self.stages['prefilter'].workers = prefilter_workers
+            self.stages['verify'].workers = verify_workers
+
+    @property
+    def prefilter_tiers(self):
+        return self.stages['prefilter'].tiers
+
+    @property
+    def verify_tiers(self):
+        return self.stages['verify'].tiers
+
+    @property
+    def verify_pool(self):
+        return self.stages['verify'].workers
+
+    @property
+    def queue_max(self):
+        return self.stages['verify'].queue_max
+
+    def started(self, name):
+        with self._lock:
+            self.stages[name].in_flight += 1
+
+    def finished(self, name, passed, elapsed_sec):
+        with self._lock:
+            stage = self.stages[name]
+            stage.in_flight -= 1
+            stage.done += 1
+            if passed:
+                stage.passed += 1
+            stage.busy += elapsed_sec
+
+    def queued(self, depth):
+        """Current depth of the prefilter → verify queue."""
+        with self._lock:
+            stage = self.stages['verify']
+            stage.queue = depth
+            stage.queue_peak = max(stage.queue_peak, depth)
+
+    def snapshot(self):
+        """[{stage, workers, in_flight, queue, done, passed, throughput, ...}] or [] when inactive."""
+        with self._lock:
+            if not self.active:
+                return []
+            wall = max(1e-6, time.monotonic() - self._started)
+            return [self.stages[name].snapshot(wall) for name in PIPELINE_STAGES]
@@ -0,0 +1,158 @@
+"""
+CDN IP Scanner V2.0 - Verification Policies
+Author: shahinst
+
+Decide when the multi-attempt /cdn-cgi/trace check has seen enough:
+  - full:  legacy — always run every attempt, decide at the end
+  - early: stop as soon as min_success is reached, or can no longer be reached
+  - sprt:  Wald sequential probability ratio test (good edge vs flaky edge)
+All policies also reject as soon as the latency can no longer come in under
+max_latency_ms. Latency is the one the final check uses (latency()): the steady-state
+request RTT from the probe timings (median warm TTFB), or the average wall time per
+attempt when nothing was timed. The final rule never changes: >= min_success
+successes and latency <= max_latency_ms.
+"""
+
+import math
+import threading
+
+
+class SHVerifyPolicy:
+    """
+    Base policy (= 'full'): never stops early.
+
+    Probers call decide() after every attempt: True = accept now, False = reject now,
+    None = keep probing. timings is the IP's SHProbeTimings so far. A failed attempt
+    ends the check in every prober, so when projecting the best case the remaining
+    attempts are assumed to succeed (and to be fast, warm requests).
+    Per-session counters (attempts per IP, probe time saved) live on the policy.
+    """
+
+    name = 'full'
+
+    def __init__(self, attempts, min_success):
+        self.attempts = attempts
+        self.min_success = min_success
+        self._lock = threading.Lock()
+        self.ips = 0
+        self.attempts_total = 0
+        self.early_accepts = 0
+        self.early_rejects = 0
+        self.saved_ms = 0.0
+
+    def decide(self, successes, attempts_done, elapsed_ms, max_latency_ms, timings=None):
+        return None
+
+    @staticmethod
+    def latency(timings, elapsed_ms, attempts_done):
+        """Latency judged against max_latency_ms: RTT from timings, else wall time per attempt."""
+        rtt = timings.rtt_ms() if timings is not None else None
+        if rtt is None:
+            return elapsed_ms / max(1, attempts_done)
+        return rtt
+
+    def _latency_hopeless(self, successes, attempts_done, elapsed_ms, max_latency_ms, timings=None):
+        if timings is None or not timings.ttfb_ms:
+            # Wall-time average: accept happens at the earliest after `needed` more
+            # attempts; even if they took no time at all it would be elapsed / (done + needed)
+            needed = max(0, self.min_success - successes)
+            return elapsed_ms / max(1, attempts_done + needed) > max_latency_ms
+        # RTT = median of warm TTFBs (all TTFBs while none is warm). Best case: every
+        # remaining attempt is a 0 ms warm request.
+        remaining = self.attempts - attempts_done
+        warm = [t for t, w in zip(timings.ttfb_ms, timings.warm) if w]
+        if not warm and remaining:
+            return False  # later requests are warm and replace the cold samples
+        samples = warm or timings.ttfb_ms
+        total = len(samples) + remaining
+        fast = remaining + sum(1 for t in samples if t <= max_latency_ms)
+        return fast <= total // 2
+
+    def is_valid(self, successes, latency_ms, max_latency_ms):
+        return successes >= self.min_success and latency_ms <= max_latency_ms
+
+    def record(self, attempts_done, elapsed_ms, verdict):
+        """Book one verified IP. verdict is what decide() stopped on (None = ran to the end)."""
+        with self._lock:
+            self.ips += 1
+            self.attempts_total += attempts_done
+            if verdict is None or attempts_done >= self.attempts:
+                return
+            if verdict:
+                self.early_accepts += 1
+            else:
+                self.early_rejects += 1
+            per_attempt = elapsed_ms / max(1, attempts_done)
+            self.saved_ms += per_attempt * (self.attempts - attempts_done)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'policy': self.name,
+                'ips': self.ips,
+                'attempts_per_ip': round(self.attempts_total / self.ips, 2) if self.ips else 0.0,
+                'early_accepts': self.early_accepts,
+                'early_rejects': self.early_rejects,
+                'probe_time_saved_sec': round(self.saved_ms / 1000.0, 1),
+            }
+
+
+class SHEarlyStopPolicy(SHVerifyPolicy):
+    """Accept at min_success successes; reject once that count or the latency budget is out of reach."""
+
+    name = 'early'
+
+    def decide(self, successes, attempts_done, elapsed_ms, max_latency_ms, timings=None):
+        if self._latency_hopeless(successes, attempts_done, elapsed_ms, max_latency_ms, timings):
+            return False
+        if successes >= self.min_success:
+            return self.latency(timings, elapsed_ms, attempts_done) <= max_latency_ms
+        if successes + (self.attempts - attempts_done) < self.min_success:
+            return False
+        return None
+
+
+class SHSPRTPolicy(SHVerifyPolicy):
+    """
+    Sequential probability ratio test on the per-attempt success rate.
+
+    H1: good edge, success probability p_good; H0: flaky edge, p_bad.
+    Each success adds ln(p_good/p_bad) to the log-likelihood ratio, each failure
+    ln((1-p_good)/(1-p_bad)); cross ln((1-beta)/alpha) → accept, ln(beta/(1-alpha)) → reject.
+    The defaults accept after 3 clean successes. Acceptance still requires
+    min_success successes, and the attempt cap bounds the test.
+    """
+
+    name = 'sprt'
+
+    def __init__(self, attempts, min_success, p_good=0.95, p_bad=0.3, alpha=0.05, beta=0.05):
+        super().__init__(attempts, min_success)
+        self.llr_success = math.log(p_good / p_bad)
+        self.llr_failure = math.log((1 - p_good) / (1 - p_bad))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    def decide(self, successes, attempts_done, elapsed_ms, max_latency_ms, timings=None):
+        if self._latency_hopeless(successes, attempts_done, elapsed_ms, max_latency_ms, timings):
+            return False
+        if successes + (self.attempts - attempts_done) < self.min_success:
+            return False
+        failures = attempts_done - successes
+        llr = successes * self.llr_success + failures * self.llr_failure
+        if llr <= self.lower:
+            return False
+        if llr >= self.upper and successes >= self.min_success:
+            return self.latency(timings, elapsed_ms, attempts_done) <= max_latency_ms
+        return None
+
+
+VERIFY_POLICIES = {
+    'sprt': SHSPRTPolicy,
+    'early': SHEarlyStopPolicy,
+    'full': SHVerifyPolicy,
+}
+
+
+def make_verify_policy(name, attempts, min_success):
+    """Fresh policy (with zeroed counters) by name; unknown names fall back to 'sprt'."""
+    return VERIFY_POLICIES.get(name, SHSPRTPolicy)(attempts, min_success)
@@ -0,0 +1,102 @@
+"""
+CDN IP Scanner V2.0 - Per-/24 Port Profiles
+Author: shahinst
+
+Edges in one /24 almost always expose the same alternate-port set, so the
+extra-port scan after verification is mostly rediscovering the same answer:
+  - The first `learn` verified IPs of a /24 are fully probed
+  - If they agree, later hits in that /24 reuse the profile instead of probing
+  - Every `spot_every`-th hit is probed anyway; a mismatch sends the block back
+    to learning, blocks that never agree are always probed
+"""
+
+import threading
+
+_LEARNING = 0
+_PROFILED = 1
+_MIXED = 2
+
+
+class SHPortProfiles:
+    """Thread-safe per-/24 open-port profiles for one scan session (keyed by ip_int >> 8)."""
+
+    def __init__(self, learn=3, spot_every=10, max_mismatches=2):
+        self.learn = learn
+        self.spot_every = spot_every
+        self.max_mismatches = max_mismatches
+        self._lock = threading.Lock()
+        self._blocks = {}  # block → [state, profile frozenset | None, agreeing observations, hits, mismatches]
+        self.enabled = True
+        self.probed = 0
+        self.inferred = 0
+        self.spot_checks = 0
+        self.mismatches = 0
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.probed = self.inferred = self.spot_checks = self.mismatches = 0
+
+    def plan(self, ip_int, extra_ports):
+        """
+        Returns the inferred open ports (list) for a verified IP, or None when its
+        extra ports have to be probed (still learning, mixed block or spot check).
+        """
+        if not self.enabled or not extra_ports:
+            return None
+        with self._lock:
+            entry = self._blocks.get(ip_int >> 8)
+            if entry is None or entry[0] != _PROFILED:
+                self.probed += 1
+                return None
+            entry[3] += 1
+            if entry[3] % self.spot_every == 0:
+                self.spot_checks += 1
+                self.probed += 1
+                return None
+            self.inferred += 1
+            profile = entry[1]
+        return [p for p in extra_ports if p in profile]
+
+    def observe(self, ip_int, extra_ports, open_ports):
+        """Learn from a probed IP: extra_ports were tried, open_ports answered."""
+        if not self.enabled or not extra_ports:
+            return
+        seen = frozenset(open_ports) & frozenset(extra_ports)
+        block = ip_int >> 8
+        with self._lock:
+            entry = self._blocks.get(block)
+            if entry is None:
+                self._blocks[block] = [_LEARNING, seen, 1, 0, 0]
+                if self.learn <= 1:
+                    self._blocks[block][0] = _PROFILED
+                return
+            state, profile = entry[0], entry[1]
+            if state == _MIXED or seen == profile:
+                if state == _LEARNING:
+                    entry[2] += 1
+                    if entry[2] >= self.learn:
+                        entry[0] = _PROFILED
+                return
+            # Disagreement: during learning or on a spot check
+            entry[4] += 1
+            if state == _PROFILED:
+                self.mismatches += 1
+            if entry[4] > self.max_mismatches:
+                entry[0] = _MIXED
+            else:
+                entry[0], entry[1], entry[2] = _LEARNING, seen, 1
+
+    def stats(self):
+        with self._lock:
+            profiled = sum(1 for e in self._blocks.values() if e[0] == _PROFILED)
+            mixed = sum(1 for e in self._blocks.values() if e[0] == _MIXED)
+            return {
+                'blocks': len(self._blocks),
+                'profiled': profiled,
+                'mixed': mixed,
+                'probed': self.probed,
+                'inferred': self.inferred,
+                'spot_checks': self.spot_checks,
+                'mismatches': self.mismatches,
+            }
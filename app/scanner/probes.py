@@ -0,0 +1,407 @@
+"""
+CDN IP Scanner V2.0 - Raw Probes
+Author: shahinst
+
+Lean socket-level probes used by SHScanner:
+  - SHTraceProber: N sequential GETs over ONE keep-alive TCP(+TLS) socket,
+    pre-encoded request bytes, only the status line and body framing are parsed
+    (no requests.Session / urllib3 pool per IP)
+  - SHTLSSessionCache: TLS sessions/tickets shared across IPs per SNI, so edges
+    presenting the same certificate resume instead of doing a full handshake
+  - SHProbeTimings: per-phase latency of one run (TCP connect, TLS handshake,
+    time to first byte of every request) on the monotonic clock
+"""
+
+import ssl
+import time
+import socket
+import threading
+from collections import OrderedDict, deque
+
+from app.scanner.colo import parse_trace
+
+_MAX_LINE = 8192
+_MAX_HEADERS = 100
+_MAX_BODY_KEEP = 4096
+# A kept-alive socket the server closed between attempts fails with one of these
+_KEEPALIVE_DROPPED = (ConnectionError, ssl.SSLEOFError, ssl.SSLZeroReturnError)
+
+
+def build_trace_request(host, path, user_agent):
+    """Pre-encoded HTTP/1.1 keep-alive GET — built once, reused for every IP."""
+    return (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"User-Agent: {user_agent}\r\n"
+        "Accept: */*\r\n"
+        "Connection: keep-alive\r\n"
+        "\r\n"
+    ).encode('ascii')
+
+
+def insecure_tls_context():
+    """CDN edge certificates are not verified (same as verify=False with requests)."""
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """SSLContext that offers a cached session for server_hostname on every new connection."""
+
+    session_cache = None
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and server_hostname and self.session_cache is not None:
+            session = self.session_cache.get(server_hostname)
+        return super().wrap_socket(
+            sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session,
+        )
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        # Used by asyncio's SSL transport
+        if session is None and server_hostname and self.session_cache is not None:
+            session = self.session_cache.get(server_hostname)
+        return super().wrap_bio(
+            incoming, outgoing, server_side=server_side, server_hostname=server_hostname, session=session,
+        )
+
+
+class SHTLSSessionCache:
+    """
+    Bounded TLS session cache keyed by SNI, shared by every probe in the process.
+
+    All CDN edges answering for one SNI present the same certificate, so a session
+    (TLS 1.2 ID / TLS 1.3 ticket) obtained from one IP can be offered to the next and
+    the handshake becomes an abbreviated resumption. Sessions only work with the
+    context that created them, so probes must connect through `self.context`.
+
+    Counters: hits/misses (session offered or not), resumed/full handshakes as
+    reported by the server, and handshake CPU time for each kind. Only blocking
+    handshakes can be timed (thread engine, V2Ray); the async engine's run on the
+    event loop between other tasks, so they are counted but not timed, and the CPU
+    figures are None when no handshake of a kind was timed.
+    """
+
+    def __init__(self, per_sni=16, max_sni=64):
+        self.per_sni = per_sni
+        self.max_sni = max_sni
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        ctx = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        ctx.session_cache = self
+        self.context = ctx
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            self.resumed = self.full = 0
+            self._cpu_full = self._cpu_resumed = 0.0
+            self._cpu_full_n = self._cpu_resumed_n = 0
+
+    def get(self, sni):
+        """Most recent session for sni (rotated so concurrent probes spread over tickets)."""
+        with self._lock:
+            bucket = self._sessions.get(sni)
+            if bucket:
+                self._sessions.move_to_end(sni)
+                self.hits += 1
+                session = bucket[-1]
+                bucket.rotate(1)
+                return session
+            self.misses += 1
+            return None
+
+    def put(self, sni, session):
+        if session is None or not sni:
+            return
+        with self._lock:
+            bucket = self._sessions.get(sni)
+            if bucket is None:
+                bucket = self._sessions[sni] = deque(maxlen=self.per_sni)
+                while len(self._sessions) > self.max_sni:
+                    self._sessions.popitem(last=False)
+            if session not in bucket:
+                bucket.append(session)
+
+    def record_handshake(self, resumed, cpu_sec=None):
+        with self._lock:
+            if resumed:
+                self.resumed += 1
+                if cpu_sec is not None:
+                    self._cpu_resumed += cpu_sec
+                    self._cpu_resumed_n += 1
+            else:
+                self.full += 1
+                if cpu_sec is not None:
+                    self._cpu_full += cpu_sec
+                    self._cpu_full_n += 1
+
+    def stats(self):
+        with self._lock:
+            avg_full = self._cpu_full / self._cpu_full_n if self._cpu_full_n else None
+            avg_resumed = self._cpu_resumed / self._cpu_resumed_n if self._cpu_resumed_n else None
+            saved_ms = None
+            if avg_full is not None and avg_resumed is not None:
+                saved_ms = max(0.0, avg_full - avg_resumed) * self._cpu_resumed_n * 1000
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'resumed': self.resumed,
+                'full': self.full,
+                'avg_full_cpu_ms': round(avg_full * 1000, 2) if avg_full is not None else None,
+                'avg_resumed_cpu_ms': round(avg_resumed * 1000, 2) if avg_resumed is not None else None,
+                'cpu_saved_ms': round(saved_ms, 1) if saved_ms is not None else None,  # None: not measured
+            }
+
+
+# One cache for the whole process: trace prober, async engine and V2Ray tests share it
+TLS_SESSION_CACHE = SHTLSSessionCache()
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class SHProbeTimings:
+    """
+    Phase timings (ms) collected while verifying one IP. connect_ms / tls_ms get one
+    entry per (re)connection, ttfb_ms one per request: request sent → first response
+    byte. warm[i] is True when request i reused an open connection.
+    """
+
+    __slots__ = ('connect_ms', 'tls_ms', 'ttfb_ms', 'warm')
+
+    def __init__(self):
+        self.connect_ms = []
+        self.tls_ms = []
+        self.ttfb_ms = []
+        self.warm = []
+
+    def add_request(self, ttfb_ms, warm):
+        self.ttfb_ms.append(ttfb_ms)
+        self.warm.append(warm)
+
+    def rtt_ms(self):
+        """Steady-state request RTT: median TTFB of requests on a warm connection (any request if none)."""
+        warm = sorted(t for t, w in zip(self.ttfb_ms, self.warm) if w)
+        values = warm or sorted(self.ttfb_ms)
+        if not values:
+            return None
+        return values[len(values) // 2]
+
+    def summary(self):
+        """{connect_ms, tls_ms, ttfb_min_ms, ttfb_median_ms, ttfb_p95_ms, jitter_ms, rtt_ms, requests}."""
+        ttfb = sorted(self.ttfb_ms)
+        # Jitter: mean absolute difference between consecutive requests (RFC 3550 style)
+        diffs = [abs(b - a) for a, b in zip(self.ttfb_ms, self.ttfb_ms[1:])]
+        rnd = lambda v: round(v, 1) if v is not None else None
+        return {
+            'connect_ms': rnd(min(self.connect_ms)) if self.connect_ms else None,
+            'tls_ms': rnd(min(self.tls_ms)) if self.tls_ms else None,
+            'ttfb_min_ms': rnd(ttfb[0]) if ttfb else None,
+            'ttfb_median_ms': rnd(ttfb[len(ttfb) // 2]) if ttfb else None,
+            'ttfb_p95_ms': rnd(_percentile(ttfb, 95)) if ttfb else None,
+            'jitter_ms': rnd(sum(diffs) / len(diffs)) if diffs else None,
+            'rtt_ms': rnd(self.rtt_ms()),
+            'requests': len(ttfb),
+        }
+
+
+def read_http_response(rfile):
+    """
+    Read one HTTP/1.1 response from a buffered socket file.
+    Returns (status_code, body, keep_alive). body is kept only up to _MAX_BODY_KEEP
+    bytes (a trace body is ~250) — longer bodies are read and discarded (b'').
+    Raises ConnectionError if the peer closed the socket, ValueError on garbage.
+    """
+    status_line = rfile.readline(_MAX_LINE)
+    if not status_line:
+        raise ConnectionError('connection closed by peer')
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise ValueError('bad status line')
+    status = int(parts[1])
+
+    content_length = None
+    chunked = False
+    keep_alive = True
+    for _ in range(_MAX_HEADERS):
+        line = rfile.readline(_MAX_LINE)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            content_length = int(value)
+        elif name == b'transfer-encoding':
+            chunked = b'chunked' in value.lower()
+        elif name == b'connection':
+            keep_alive = value.strip().lower() != b'close'
+    else:
+        raise ValueError('too many headers')
+
+    body = b''
+    if chunked:
+        chunks = []
+        kept = 0
+        while True:
+            size = int(rfile.readline(_MAX_LINE).split(b';', 1)[0].strip() or b'0', 16)
+            if size:
+                chunk = rfile.read(size)
+                kept += len(chunk)
+                if kept <= _MAX_BODY_KEEP:
+                    chunks.append(chunk)
+            rfile.readline(_MAX_LINE)  # CRLF after chunk
+            if size == 0:
+                break
+        if kept <= _MAX_BODY_KEEP:
+            body = b''.join(chunks)
+    elif content_length is not None:
+        body = rfile.read(content_length)
+        if len(body) < content_length:
+            raise ConnectionError('truncated body')
+    elif status >= 200 and status not in (204, 304):
+        body = rfile.read()  # no framing → body ends at close
+        keep_alive = False
+    if len(body) > _MAX_BODY_KEEP:
+        body = b''
+    return status, body, keep_alive
+
+
+class SHTraceProber:
+    """
+    Raw keep-alive HTTP/1.1 prober for the multi-attempt trace check.
+
+    One TCP connect (+ TLS handshake on HTTPS ports) per IP, then the same
+    pre-encoded GET is sent `attempts` times. A keep-alive the server dropped between
+    attempts is reopened once for that attempt; any other timeout or socket error ends
+    the run (no point retrying that IP); a parsed response of any status counts as a
+    success — the same rules as the requests-based check — unless `statuses`
+    restricts which ones do.
+    """
+
+    def __init__(self, host, path, user_agent, https_ports, attempts, tls_cache=TLS_SESSION_CACHE,
+                 statuses=None):
+        self.host = host
+        self.statuses = statuses
+        self.https_ports = frozenset(https_ports)
+        self.attempts = attempts
+        self.request = build_trace_request(host, path, user_agent)
+        self.tls_cache = tls_cache
+
+    def _connect(self, ip_str, port, timeout_sec, timings=None):
+        t0 = time.perf_counter()
+        sock = socket.create_connection((ip_str, port), timeout=timeout_sec)
+        t1 = time.perf_counter()
+        if timings is not None:
+            timings.connect_ms.append((t1 - t0) * 1000)
+        if port in self.https_ports:
+            try:
+                # Cached session for this SNI is offered by the context → resumption
+                sock = self.tls_cache.context.wrap_socket(
+                    sock, server_hostname=self.host, do_handshake_on_connect=False,
+                )
+                cpu_start = time.thread_time()
+                sock.do_handshake()
+                self.tls_cache.record_handshake(sock.session_reused, time.thread_time() - cpu_start)
+            except Exception:
+                sock.close()
+                raise
+            if timings is not None:
+                timings.tls_ms.append((time.perf_counter() - t1) * 1000)
+        return sock, sock.makefile('rb')
+
+    def _request(self, sock, rfile, warm, timings=None):
+        """Send the GET and read one response → (status, body, keep_alive)."""
+        t_send = time.perf_counter()
+        sock.sendall(self.request)
+        if not rfile.peek(1):  # blocks until the first response byte
+            raise ConnectionError('connection closed by peer')
+        if timings is not None:
+            timings.add_request((time.perf_counter() - t_send) * 1000, warm)
+        return read_http_response(rfile)
+
+    @staticmethod
+    def _close(sock, rfile):
+        for obj in (rfile, sock):
+            if obj is not None:
+                try:
+                    obj.close()
+                except Exception:
+                    pass
+
+    def run(self, ip_str, port, timeouts, max_total_sec, should_stop=None, decide=None, timings=None,
+            trace=None):
+        """
+        Send up to `attempts` GETs to ip_str:port over one kept-alive socket.
+        timeouts[i] is the socket timeout for attempt i; the run also stops once
+        max_total_sec has elapsed. decide(successes, attempts_done, elapsed_ms) is
+        asked after every successful attempt; a non-None answer ends the run.
+        timings (SHProbeTimings) receives connect / TLS / TTFB of every step; trace (dict)
+        gets the fields of the first trace body (colo, loc, ...; see colo.parse_trace).
+        Returns (successes, attempts_done, verdict) — verdict is decide's answer or None.
+        """
+        start = time.time()
+        successes = 0
+        attempts_done = 0
+        verdict = None
+        sock = rfile = None
+        try:
+            for i in range(self.attempts):
+                if should_stop and should_stop():
+                    break
+                if time.time() - start > max_total_sec:
+                    break
+                attempts_done += 1
+                try:
+                    response = None
+                    if sock is not None:
+                        sock.settimeout(timeouts[i])
+                        try:
+                            response = self._request(sock, rfile, True, timings)
+                        except _KEEPALIVE_DROPPED:
+                            # The server closed the idle keep-alive between attempts:
+                            # reconnect once and retry this attempt on a fresh socket
+                            self._close(sock, rfile)
+                            sock = rfile = None
+                    if response is None:
+                        sock, rfile = self._connect(ip_str, port, timeouts[i], timings)
+                        response = self._request(sock, rfile, False, timings)
+                    status, body, keep_alive = response
+                    if self.statuses is None or status in self.statuses:
+                        successes += 1
+                    if trace is not None and not trace:
+                        trace.update(parse_trace(body))
+                    if successes == 1 and isinstance(sock, ssl.SSLSocket):
+                        # After the first response TLS 1.3 tickets have arrived too
+                        self.tls_cache.put(self.host, sock.session)
+                    if not keep_alive:
+                        self._close(sock, rfile)
+                        sock = rfile = None
+                except OSError:
+                    break  # cold connect: timeout / refused / reset / TLS failure → stop probing this IP
+                except ValueError:
+                    # Answered with something that is not clean HTTP — still a live edge,
+                    # but the stream position is unknown, so start a fresh connection
+                    if self.statuses is None:
+                        successes += 1
+                    self._close(sock, rfile)
+                    sock = rfile = None
+                if decide is not None:
+                    verdict = decide(successes, attempts_done, (time.time() - start) * 1000)
+                    if verdict is not None:
+                        break
+        finally:
+            self._close(sock, rfile)
+        return successes, attempts_done, verdict
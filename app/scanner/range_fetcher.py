@@ -15,6 +15,8 @@ import logging
 import requests
 import urllib3
 
+from app.scanner.ranges import SHRangeIndex
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
@@ -297,7 +299,7 @@ class BuiltinCDNRanges:
         ترکیبی از CIDR های اصلی و رنج‌های /24 دقیق.
         """
         all_ranges = list(cls._CLOUDFLARE_CORE) + list(cls._CLOUDFLARE_24)
-        return list(set(all_ranges))
+        return [cidr for cidr, _ in SHRangeIndex.build({'builtin': all_ranges}).to_cidrs()]
 
     @classmethod
     def get_core_ranges(cls):
@@ -369,23 +371,29 @@ class RangeFetcher:
         """
         return BuiltinCDNRanges.get_ranges()
 
+    ONLINE_SOURCES = ('sh_api', 'sh_asn', 'sh_github', 'fastly_api', 'fastly_asn')
+
+    @staticmethod
+    def fetch_sources(source='all'):
+        """{source name: [cidr, ...]} — the ranges of each source kept apart (provenance)."""
+        if source in ('all', 'all_vfarid'):
+            names = RangeFetcher.ONLINE_SOURCES + ('builtin',)
+        elif source == 'vfarid':
+            names = ('builtin',)
+        else:
+            names = (source,)
+        return {name: RangeFetcher.fetch_by_source(name) for name in names}
+
     @staticmethod
     def get_all_sources():
-        """Fetch from all online sources and deduplicate."""
-        all_ranges = []
-        all_ranges.extend(RangeFetcher.get_cloudflare_official())
-        all_ranges.extend(RangeFetcher.get_cloudflare_asn())
-        all_ranges.extend(RangeFetcher.get_cloudflare_github())
-        all_ranges.extend(RangeFetcher.get_fastly_official())
-        all_ranges.extend(RangeFetcher.get_fastly_asn())
-        return list(set(all_ranges))
+        """Fetch from all online sources, merged into disjoint CIDRs."""
+        sources = {name: RangeFetcher.fetch_by_source(name) for name in RangeFetcher.ONLINE_SOURCES}
+        return [cidr for cidr, _ in SHRangeIndex.build(sources).to_cidrs()]
 
     @staticmethod
     def get_all_with_builtin():
-        """Fetch from all online sources + built-in ranges, deduplicated."""
-        all_ranges = RangeFetcher.get_all_sources()
-        all_ranges.extend(RangeFetcher.get_builtin_ranges())
-        return list(set(all_ranges))
+        """Fetch from all online sources + built-in ranges, merged into disjoint CIDRs."""
+        return [cidr for cidr, _ in SHRangeIndex.build(RangeFetcher.fetch_sources('all')).to_cidrs()]
 
     @staticmethod
     def fetch_by_source(source):
@@ -0,0 +1,168 @@
+"""
+CDN IP Scanner V2.0 - Range Normalization
+Author: shahinst
+
+Turns overlapping range lists from several sources into one duplicate-free space:
+  - Sweep over /24 block intervals → sorted, disjoint intervals, each tagged with the
+    set of sources it came from (provenance); neighbours with equal provenance merge
+  - Single IPs already covered by an interval are dropped
+  - to_cidrs() re-emits the space as the fewest CIDRs; lookup() maps an IP to its sources
+  - weights_for() gives the IP generator a per-range share: equal per source (and per
+    entry inside it), proportional to size, or learned from scan history
+"""
+
+import bisect
+import ipaddress
+from collections import Counter
+
+from app.scanner.core import ip_to_int, int_to_ip
+
+RANGE_WEIGHTINGS = ('source', 'size', 'learned', 'entry')
+
+# CDN behind each RangeFetcher source name (provenance → CDN)
+SOURCE_CDN = {
+    'sh_api': 'cloudflare',
+    'sh_asn': 'cloudflare',
+    'sh_github': 'cloudflare',
+    'builtin': 'cloudflare',
+    'fastly_api': 'fastly',
+    'fastly_asn': 'fastly',
+}
+
+
+def _block_interval(cidr):
+    """(first_block, last_block) of a CIDR at /24 granularity (same rule as SHNetUtils._parse_ranges)."""
+    net = ipaddress.IPv4Network(cidr, strict=False)
+    return int(net.network_address) >> 8, int(net.broadcast_address) >> 8
+
+
+class SHRangeIndex:
+    """
+    Sorted, disjoint /24-block intervals with provenance.
+    Build with SHRangeIndex.build({source: [cidr, ...], ...}).
+    """
+
+    def __init__(self):
+        self.starts = []     # first block of each interval (sorted)
+        self.ends = []       # last block of each interval (inclusive)
+        self.sources = []    # frozenset of source names per interval
+        self.single_ips = {}  # uint32 → frozenset(sources), only IPs outside every interval
+        self.input_blocks = 0
+        self._source_blocks = Counter()
+
+    @classmethod
+    def build(cls, sources_map):
+        index = cls()
+        events = []
+        singles = {}
+        for source, cidrs in sources_map.items():
+            for cidr in cidrs or ():
+                cidr = str(cidr).strip()
+                if not cidr:
+                    continue
+                try:
+                    if '/' not in cidr:
+                        singles.setdefault(ip_to_int(cidr), set()).add(source)
+                        continue
+                    first, last = _block_interval(cidr)
+                except (ValueError, OSError):
+                    continue
+                events.append((first, 1, source))
+                events.append((last + 1, -1, source))
+                index.input_blocks += last - first + 1
+        events.sort(key=lambda e: (e[0], e[1]))
+
+        active = Counter()
+        prev = None
+        for pos, delta, source in events:
+            if prev is not None and pos > prev and active:
+                index._append(prev, pos - 1, frozenset(active))
+            if delta > 0:
+                active[source] += 1
+            else:
+                active[source] -= 1
+                if not active[source]:
+                    del active[source]
+            prev = pos
+
+        for ip, srcs in singles.items():
+            if index.lookup(ip) is None:
+                index.single_ips[ip] = frozenset(srcs)
+        for start, end, srcs in zip(index.starts, index.ends, index.sources):
+            for source in srcs:
+                index._source_blocks[source] += end - start + 1
+        return index
+
+    def _append(self, first, last, srcs):
+        # Merge with the previous interval when adjacent and from the same sources
+        if self.ends and self.ends[-1] + 1 == first and self.sources[-1] == srcs:
+            self.ends[-1] = last
+        else:
+            self.starts.append(first)
+            self.ends.append(last)
+            self.sources.append(srcs)
+
+    @property
+    def n_blocks(self):
+        return sum(e - s + 1 for s, e in zip(self.starts, self.ends))
+
+    def lookup(self, ip):
+        """Provenance (frozenset of sources) of an IP (int or str), or None if not covered."""
+        block = (ip_to_int(ip) if isinstance(ip, str) else int(ip)) >> 8
+        i = bisect.bisect_right(self.starts, block) - 1
+        if i >= 0 and block <= self.ends[i]:
+            return self.sources[i]
+        return self.single_ips.get(ip_to_int(ip) if isinstance(ip, str) else int(ip))
+
+    def cdn_of(self, ip):
+        """CDN names an IP belongs to, via SOURCE_CDN (unknown sources map to themselves)."""
+        return {SOURCE_CDN.get(s, s) for s in (self.lookup(ip) or ())}
+
+    def to_cidrs(self):
+        """[(cidr, sources)] covering the space exactly once — fewest CIDRs per interval."""
+        out = []
+        for start, end, srcs in zip(self.starts, self.ends, self.sources):
+            first = ipaddress.IPv4Address(start << 8)
+            last = ipaddress.IPv4Address((end << 8) | 0xFF)
+            out.extend((str(net), srcs) for net in ipaddress.summarize_address_range(first, last))
+        out.extend((int_to_ip(ip), srcs) for ip, srcs in sorted(self.single_ips.items()))
+        return out
+
+    def weights_for(self, cidrs, mode='source', score_fn=None):
+        """
+        Generator weight for each entry of cidrs (any CIDRs inside this space, e.g. to_cidrs()
+        output or census-filtered ranges):
+          source  — every source gets the same total share, split equally between its
+                    entries (round-robin inside a source: a /12 does not drown a /24)
+          size    — proportional to the number of /24s (uniform over address space)
+          learned — size × (floor + score_fn(cidr)), score_fn e.g. AIOptimizer.range_score
+          entry   — 1 per entry (plain round-robin, sources ignored)
+        """
+        sizes, provenance = [], []
+        for cidr in cidrs:
+            cidr = str(cidr)
+            if '/' in cidr:
+                first, last = _block_interval(cidr)
+                sizes.append(last - first + 1)
+                provenance.append(self.lookup(first << 8) or ())
+            else:
+                sizes.append(1)
+                provenance.append(self.lookup(cidr) or ())
+        if mode == 'entry':
+            return [1.0] * len(sizes)
+        if mode == 'size':
+            return [float(n) for n in sizes]
+        if mode == 'learned' and score_fn is not None:
+            return [n * (0.05 + score_fn(str(cidr))) for n, cidr in zip(sizes, cidrs)]
+        entries = Counter(s for srcs in provenance for s in srcs)
+        return [sum(1.0 / entries[s] for s in srcs) or 1.0 / max(1, len(sizes)) for srcs in provenance]
+
+    def stats(self):
+        blocks = self.n_blocks
+        return {
+            'intervals': len(self.starts),
+            'blocks': blocks,
+            'duplicate_blocks': max(0, self.input_blocks - blocks),
+            'single_ips': len(self.single_ips),
+            'sources': dict(self._source_blocks),
+        }
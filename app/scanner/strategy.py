@@ -0,0 +1,98 @@
+"""
+CDN IP Scanner V2.0 - Probe Strategies
+Author: shahinst
+
+A scan's per-IP pipeline is a funnel of probe tiers, cheapest first:
+  - tcp:   TCP connect to the primary port (one RTT)
+  - tls:   TLS handshake with the CDN's SNI (on an HTTP-only port: a TCP connect,
+           or nothing when the chain already has the tcp tier)
+  - trace: multi-attempt HTTP verification (SHScanner._sequential_trace_check)
+Every tier touches the network, so no chain can accept an IP it never contacted.
+An IP must pass every tier of the chain; the first rejection ends it. The engines
+implement each tier as a `_tier_<name>` method, so a new tier is one method plus an
+entry in PROBE_TIERS. Every tier counts what went in, what it rejected and the
+time it spent, which gives its throughput and rejection rate.
+"""
+
+import time
+import threading
+
+PROBE_TIERS = ('tcp', 'tls', 'trace')           # cost order
+DEFAULT_STRATEGY = ('tcp', 'trace')             # the classic check(): TCP pre-filter + trace
+STRATEGY_PRESETS = {
+    'check': DEFAULT_STRATEGY,
+    'funnel': ('tcp', 'tls', 'trace'),
+}
+
+
+def parse_strategy(spec):
+    """
+    'tcp,tls' / 'tcp>tls>trace' / ['tls'] / preset name → tuple of tiers in cost order.
+    Raises ValueError for unknown tier names or a chain without any tier.
+    """
+    if not spec:
+        return DEFAULT_STRATEGY
+    if isinstance(spec, str):
+        spec = spec.strip().lower()
+        if spec in STRATEGY_PRESETS:
+            return STRATEGY_PRESETS[spec]
+        spec = spec.replace('>', ',').replace('+', ',').split(',')
+    tiers = {str(t).strip().lower() for t in spec} - {''}
+    unknown = tiers - set(PROBE_TIERS)
+    if unknown:
+        raise ValueError(f'unknown probe tier(s): {", ".join(sorted(unknown))} '
+                         f'(use {", ".join(PROBE_TIERS)} or {", ".join(STRATEGY_PRESETS)})')
+    chain = tuple(t for t in PROBE_TIERS if t in tiers)
+    if not chain:
+        raise ValueError('probe strategy has no tier')
+    return chain
+
+
+class SHProbeStrategy:
+    """Tier chain for one scan plus per-tier counters. Thread-safe."""
+
+    def __init__(self, spec=None):
+        self._lock = threading.Lock()
+        self.configure(spec)
+
+    def configure(self, spec=None):
+        with self._lock:
+            self.tiers = parse_strategy(spec)
+            self._stats = {t: [0, 0, 0.0] for t in self.tiers}  # tier → [entered, rejected, busy_sec]
+            self._started = time.monotonic()
+
+    @property
+    def name(self):
+        return '>'.join(self.tiers)
+
+    @property
+    def verifies(self):
+        """True when the chain ends in full trace verification (colo, latency breakdown)."""
+        return 'trace' in self.tiers
+
+    def record(self, tier, passed, elapsed_sec):
+        with self._lock:
+            stats = self._stats.get(tier)
+            if stats is None:
+                return
+            stats[0] += 1
+            if not passed:
+                stats[1] += 1
+            stats[2] += elapsed_sec
+
+    def stats(self):
+        """Per tier: entered, passed, rejection rate, probes/s (wall clock), avg ms per probe."""
+        with self._lock:
+            wall = max(1e-6, time.monotonic() - self._started)
+            tiers = []
+            for tier in self.tiers:
+                entered, rejected, busy = self._stats[tier]
+                tiers.append({
+                    'tier': tier,
+                    'entered': entered,
+                    'passed': entered - rejected,
+                    'rejection_rate': round(rejected / entered, 3) if entered else None,
+                    'throughput': round(entered / wall, 1),
+                    'avg_ms': round(busy / entered * 1000, 1) if entered else None,
+                })
+            return {'strategy': self.name, 'tiers': tiers}
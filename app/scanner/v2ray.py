@@ -13,7 +13,10 @@ import socket
 import requests
 import urllib3
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.scanner.core import to_ip_str, ip_to_int
+from app.scanner.control import SHConcurrencyController, SHRateLimiter
+from app.scanner.probes import TLS_SESSION_CACHE
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -205,14 +208,17 @@ class V2RayConfigParser:
         try:
             # Try TLS connection with SNI
             if params.get('security') == 'tls' or port in (443, 8443, 2053, 2083, 2087, 2096):
-                import ssl
-                context = ssl.create_default_context()
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
+                # Shared context offers the cached session for this SNI → resumed handshake
+                server_name = sni or test_ip
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.settimeout(timeout)
-                wrapped = context.wrap_socket(sock, server_hostname=sni or test_ip)
+                wrapped = TLS_SESSION_CACHE.context.wrap_socket(
+                    sock, server_hostname=server_name, do_handshake_on_connect=False,
+                )
                 wrapped.connect((test_ip, port))
+                cpu_start = time.thread_time()
+                wrapped.do_handshake()
+                TLS_SESSION_CACHE.record_handshake(wrapped.session_reused, time.thread_time() - cpu_start)
                 latency = (time.time() - start) * 1000
 
                 # Try HTTP request through the connection
@@ -220,6 +226,8 @@ class V2RayConfigParser:
                 request = f"GET /cdn-cgi/trace HTTP/1.1\r\nHost: {host_header}\r\nConnection: close\r\n\r\n"
                 wrapped.sendall(request.encode())
                 response = wrapped.recv(4096).decode('utf-8', errors='ignore')
+                if sni:
+                    TLS_SESSION_CACHE.put(server_name, wrapped.session)
                 wrapped.close()
 
                 if '200' in response.split('\r\n')[0] or 'fl=' in response:
@@ -243,8 +251,27 @@ class V2RayScanner:
 
     def __init__(self):
         self.max_workers = 50
+        self._fixed_workers = self.max_workers  # in-flight tests without the adaptive controller
         self._stop_flag = False
         self.log_callback = None
+        self.controller = None
+        self.rate_limiter = None
+
+    def set_concurrency(self, start, cap, adaptive=True):
+        """Pool sized for cap; with adaptive=True an AIMD controller moves in-flight tests in [.., cap]."""
+        self.max_workers = max(1, int(cap))
+        self.controller = SHConcurrencyController(start, cap, floor=min(10, cap)) if adaptive else None
+        self._fixed_workers = max(1, min(int(start), self.max_workers))
+
+    def set_rate_limit(self, rate=None, per_block_rate=None):
+        """Limit new test connections per second, globally and per /24 (None/0 = off)."""
+        limiter = SHRateLimiter(rate, per_block_rate)
+        self.rate_limiter = limiter if limiter.enabled else None
+
+    def concurrency_target(self):
+        if self.controller is not None:
+            return self.controller.target
+        return self._fixed_workers
 
     def stop(self):
         self._stop_flag = True
@@ -259,68 +286,77 @@ class V2RayScanner:
             except Exception:
                 pass
 
-    def scan_ips(self, parsed_config, ip_list, timeout=5, progress_callback=None, result_callback=None):
+    def scan_ips(self, parsed_config, ip_list, timeout=5, progress_callback=None, result_callback=None,
+                 total=None):
         """
-        Scan a list of IPs using the V2Ray config template.
+        Scan IPs using the V2Ray config template.
+        ip_list may be any iterable; at most concurrency_target() tests are in flight.
         Calls result_callback(result) as soon as each IP is found.
         Returns list of {ip, latency, success} dicts.
         """
         results = []
-        total = len(ip_list)
+        if total is None:
+            total = len(ip_list) if hasattr(ip_list, '__len__') else 0
+        source = iter(ip_list)
+        exhausted = False
 
-        self._log('INFO', f'V2Ray scan started: {total} IPs, config={parsed_config["protocol"]}')
+        self._log('INFO', f'V2Ray scan started: {total or "?"} IPs, config={parsed_config["protocol"]}')
 
         with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
             futures = {}
-            for ip in ip_list:
-                if self._stop_flag:
-                    break
-                f = ex.submit(V2RayConfigParser.test_ip_with_config, parsed_config, str(ip), timeout)
-                futures[f] = str(ip)
-
             completed = 0
             wait_timeout = 2.0
-            it = as_completed(futures, timeout=wait_timeout)
             while True:
+                window = self.concurrency_target()
+                while not exhausted and len(futures) < window and not self._stop_flag:
+                    try:
+                        ip_str = to_ip_str(next(source))
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if self.rate_limiter is not None and not self.rate_limiter.acquire(
+                            ip_to_int(ip_str), lambda: self._stop_flag):
+                        break
+                    f = ex.submit(V2RayConfigParser.test_ip_with_config, parsed_config, ip_str, timeout)
+                    futures[f] = ip_str
+
                 if self._stop_flag:
                     for f in futures:
-                        try:
-                            f.cancel()
-                        except Exception:
-                            pass
+                        f.cancel()
                     break
-                try:
-                    future = next(it)
-                except StopIteration:
+                if not futures:
                     break
-                except FuturesTimeoutError:
-                    continue
-                completed += 1
-                ip_str = futures[future]
-                try:
-                    success, latency = future.result()
-                    if success and latency is not None:
-                        result = {
-                            'ip': ip_str,
-                            'ping': latency,
-                            'open_ports': [parsed_config['port']],
-                            'success': True,
-                        }
-                        results.append(result)
-                        if result_callback:
-                            try:
-                                result_callback(result)
-                            except Exception:
-                                pass
-                        self._log('DEBUG', f'V2Ray: {ip_str} OK latency={latency:.0f}ms')
-                except Exception as e:
-                    self._log('ERROR', f'V2Ray: {ip_str} error: {e}')
-
-                if progress_callback:
+
+                done, _ = wait(futures, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ip_str = futures.pop(future)
+                    completed += 1
                     try:
-                        progress_callback(completed, total)
-                    except Exception:
-                        pass
+                        success, latency = future.result()
+                        if self.controller is not None:
+                            self.controller.record(not success, latency)
+                        if success and latency is not None:
+                            result = {
+                                'ip': ip_str,
+                                'ping': latency,
+                                'open_ports': [parsed_config['port']],
+                                'success': True,
+                            }
+                            results.append(result)
+                            if result_callback:
+                                try:
+                                    result_callback(result)
+                                except Exception:
+                                    pass
+                            self._log('DEBUG', f'V2Ray: {ip_str} OK latency={latency:.0f}ms')
+                    except Exception as e:
+                        self._log('ERROR', f'V2Ray: {ip_str} error: {e}')
+
+                    if progress_callback:
+                        try:
+                            progress_callback(completed, total)
+                        except Exception:
+                            pass
 
-        self._log('INFO', f'V2Ray scan completed: {len(results)}/{total} successful')
+        self._log('INFO', f'V2Ray scan completed: {len(results)}/{completed} successful')
         return results
@@ -207,6 +207,11 @@ function initSocket() {
         if (bar) bar.style.width = data.percent + '%';
         if (status) {
             status.textContent = localNum(data.percent) + '% | ' + localNum(data.speed.toFixed(0)) + ' IP/s';
+            // Staged pipeline: per-stage load and the pre-filter → verify queue depth
+            status.title = (data.stages || []).map(st =>
+                st.stage + ': ' + st.in_flight + '/' + st.workers + ' busy, ' +
+                st.throughput + '/s' + (st.stage === 'verify' ? ', queue ' + st.queue + '/' + st.queue_max : '')
+            ).join('\n');
         }
         document.getElementById('statFound').textContent = localNum(resultCount);
     });
@@ -220,6 +225,15 @@ function initSocket() {
         }
     });
 
+    socket.on('scan_result_update', data => {
+        // Deferred extra-port probes finished for an IP already in the table
+        const row = document.querySelector('#resultsBody tr[data-ip="' + data.ip + '"]');
+        if (!row) return;
+        const ports = (data.open_ports || []).map(p => p + '\u2705').join(' ');
+        row.querySelector('.ports-cell').textContent = ports || '\u2014';
+        if (data.score) row.querySelector('.score-cell').textContent = localNum(data.score.toFixed(0)) + '/' + localNum('100');
+    });
+
     socket.on('scan_complete', data => {
         isScanning = false;
         clearInterval(timerInterval);
@@ -267,8 +281,14 @@ function addResultRow(data) {
     const tbody = document.getElementById('resultsBody');
     if (!tbody) return;
     const row = document.createElement('tr');
-    const ports = (data.open_ports || []).map(p => p + '\u2705').join(' ');
+    // Ports taken from the /24 profile (not probed for this IP) are marked with ≈
+    const inferred = data.inferred_ports || [];
+    const ports = (data.open_ports || []).map(p => p + (inferred.includes(p) ? '\u2248' : '\u2705')).join(' ');
     const ping = data.ping ? localNum(Math.round(data.ping)) + ' ms' : '\u2014';
+    // Phase breakdown (connect / TLS / TTFB percentiles) as the ping cell's tooltip
+    const lat = data.latency || null;
+    const pingTitle = lat ? ['connect ' + lat.connect_ms, 'tls ' + lat.tls_ms, 'ttfb p50 ' + lat.ttfb_median_ms,
+        'p95 ' + lat.ttfb_p95_ms, 'jitter ' + lat.jitter_ms].join(' \u00b7 ') + ' ms' : '';
     const score = data.score ? localNum(data.score.toFixed(0)) + '/' + localNum('100') : '\u2014';
     const isV2ray = data.is_v2ray === true;
     const showOperator = currentScanMethod !== 'cloud';
@@ -276,10 +296,10 @@ function addResultRow(data) {
 
     let cells =
         '<td>' + localNum('#' + resultCount) + '</td>' +
-        '<td class="ip-cell" data-ip="' + data.ip + '">' + data.ip + '</td>' +
-        '<td>' + ping + '</td>' +
-        '<td>' + (ports || '\u2014') + '</td>' +
-        '<td>' + score + '</td>';
+        '<td class="ip-cell" data-ip="' + data.ip + '"' + (data.colo ? ' title="colo ' + data.colo + (data.loc ? ' \u00b7 loc ' + data.loc : '') + '"' : '') + '>' + data.ip + '</td>' +
+        '<td title="' + pingTitle + '">' + ping + '</td>' +
+        '<td class="ports-cell">' + (ports || '\u2014') + '</td>' +
+        '<td class="score-cell">' + score + '</td>';
     if (showOperator) {
         cells += '<td>' + operatorText + '</td>';
     }
@@ -287,6 +307,7 @@ function addResultRow(data) {
         cells += '<td class="download-col"><button type="button" class="btn btn-sm btn-download" data-ip="' + data.ip + '">' + (lang === 'fa' ? '\u062F\u0627\u0646\u0644\u0648\u062F' : 'Download') + '</button></td>';
     }
     row.innerHTML = cells;
+    row.dataset.ip = data.ip;
     row.querySelector('.ip-cell').addEventListener('click', () => {
         navigator.clipboard?.writeText(data.ip);
         showToast(t('ip_copied') + ' ' + data.ip);
@@ -0,0 +1,26 @@
+"""Learned block scores: smoothed hit rate, latency and recency."""
+
+from app.scanner.ai_optimizer import AIOptimizer
+
+NOW = 1_700_000_000.0
+
+
+def test_unrecorded_probes_use_the_prior_not_a_perfect_rate():
+    opt = AIOptimizer()
+    measured = opt.block_score(hits=9, probes=10, ping_sum=9 * 100.0, last_seen_ts=NOW, now=NOW)
+    legacy = opt.block_score(hits=9, probes=0, ping_sum=9 * 100.0, last_seen_ts=NOW, now=NOW)
+    assert legacy < measured
+    assert abs(legacy / measured - 0.5 / (10 / 12)) < 1e-9
+
+
+def test_never_hit_block_scores_zero():
+    assert AIOptimizer().block_score(0, 50, 0.0, NOW, now=NOW) == 0.0
+
+
+def test_latency_and_age_lower_the_score():
+    opt = AIOptimizer(half_life_days=7.0, latency_ref_ms=500.0)
+    fast = opt.block_score(5, 10, 5 * 50.0, NOW, now=NOW)
+    slow = opt.block_score(5, 10, 5 * 1000.0, NOW, now=NOW)
+    week_old = opt.block_score(5, 10, 5 * 50.0, NOW - 7 * 86400, now=NOW)
+    assert slow < fast
+    assert abs(week_old - fast / 2) < 1e-9
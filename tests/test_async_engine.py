@@ -0,0 +1,56 @@
+"""Async engine: one event loop per session, in-flight probes carried across batches."""
+
+import socket
+
+import pytest
+
+from app.scanner.cdnprofile import SHProbeProfile
+from app.scanner.core import SHScanner
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(64)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+def _tcp_scanner(port):
+    scanner = SHScanner()
+    scanner.set_engine('async')
+    scanner.probe_profiles.profiles = {
+        'local': SHProbeProfile('local', 'example.com', '/', ports=[port], https_ports=[]),
+    }
+    scanner.probe_profiles.configure(force='local')
+    scanner.set_strategy('tcp')
+    return scanner
+
+
+def test_carry_over_keeps_tasks_and_loop_across_batches(listener):
+    scanner = _tcp_scanner(listener)
+    try:
+        first = scanner.batch_scan(['127.0.0.1'], [listener], carry_over=True)
+        engine = scanner._async_engine
+        assert first == [] and engine.pending == 1  # still on the loop, not drained
+
+        second = scanner.batch_scan(['127.0.0.2'], [listener], carry_over=True)
+        assert scanner._async_engine is engine
+        rest = scanner.finish_batches([listener])
+        found = {r['ip'] for r in first + second + rest}
+        assert found == {'127.0.0.1'}
+        assert engine.pending == 0
+    finally:
+        scanner.close_pool()
+    assert scanner._async_engine is None and engine._loop is None
+
+
+def test_without_carry_over_batch_completes(listener):
+    scanner = _tcp_scanner(listener)
+    try:
+        results = scanner.batch_scan(['127.0.0.1', '127.0.0.2'], [listener])
+        assert [r['ip'] for r in results] == ['127.0.0.1']
+        assert scanner._async_engine.pending == 0
+    finally:
+        scanner.close_pool()
@@ -0,0 +1,47 @@
+"""SHBlockBandit: exploitation stays inside the scan's CIDR input."""
+
+from app.scanner.bandit import SHBlockBandit
+from app.scanner.core import ip_to_int
+
+
+def _drain_with_hits(bandit, hit_ips):
+    issued = []
+    for ip in bandit:
+        issued.append(ip)
+        bandit.record(ip, ip in hit_ips, 50.0)
+    return issued
+
+
+def test_single_ip_hit_does_not_widen_to_its_24():
+    ranges = ['203.0.113.7', '198.51.100.0/30']
+    pasted = ip_to_int('203.0.113.7')
+    bandit = SHBlockBandit(iter([pasted]), per_block=30, budget=50, explore=0.0, seed=1, scope=ranges)
+    issued = _drain_with_hits(bandit, {pasted})
+    assert issued == [pasted]
+
+
+def test_exploitation_stays_inside_the_cidr():
+    ranges = ['198.51.100.0/29']
+    first = ip_to_int('198.51.100.1')
+    bandit = SHBlockBandit(iter([first]), per_block=30, budget=50, explore=0.0, seed=1, scope=ranges)
+    issued = _drain_with_hits(bandit, set(range(first, first + 8)))
+    assert set(issued) == {ip_to_int(f'198.51.100.{h}') for h in range(1, 8)}
+
+
+def test_productive_24_gets_extra_hosts():
+    block = ip_to_int('10.0.0.0')
+    stream = [block | 1]
+    bandit = SHBlockBandit(iter(stream), per_block=2, budget=8, explore=0.0, seed=1, scope=['10.0.0.0/24'])
+    issued = _drain_with_hits(bandit, set(range(block, block + 256)))
+    assert len(issued) == 8
+    assert all(ip >> 8 == block >> 8 for ip in issued)
+    assert len(set(issued)) == 8
+
+
+def test_dead_block_is_skipped():
+    block = ip_to_int('10.0.1.0')
+    stream = [block | h for h in range(1, 21)]
+    bandit = SHBlockBandit(iter(stream), per_block=30, dead_after=4, explore=1.0, seed=1)
+    issued = _drain_with_hits(bandit, set())
+    assert len(issued) == 4
+    assert bandit.stats()['skipped_dead'] == 16
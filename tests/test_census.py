@@ -0,0 +1,38 @@
+"""Liveness map: per-block sweep times and storage round trip."""
+
+import time
+
+from app.scanner.census import SHLivenessMap, census_targets, range_blocks
+
+
+def test_merge_only_refreshes_the_blocks_it_swept():
+    now = time.time()
+    lmap = SHLivenessMap({1: now - 7200, 2: now - 7200}, live={1}, updated_at=now - 7200)
+    lmap.merge([3], [3])
+    assert lmap.expire(ttl_sec=3600) == 2
+    assert lmap.unknown_blocks([1, 2, 3]) == [1, 2]
+    assert lmap.live == {3}
+
+
+def test_pack_round_trip_keeps_sweep_times():
+    lmap = SHLivenessMap()
+    lmap.merge([10, 5, 7], [5])
+    restored = SHLivenessMap.unpack(*lmap.pack(), lmap.updated_at)
+    assert restored.live == {5}
+    assert set(restored.probed) == {5, 7, 10}
+    assert all(abs(t - lmap.probed[b]) < 1 for b, t in restored.probed.items())
+
+
+def test_legacy_rows_without_sweep_times_use_updated_at():
+    probed_text, live_text, _ = SHLivenessMap({4: 0, 8: 0}, live={8}).pack()
+    stale = SHLivenessMap.unpack(probed_text, live_text, None, time.time() - 10 * 3600)
+    assert stale.expire(ttl_sec=6 * 3600) == 2 and not stale.live
+
+
+def test_range_blocks_and_targets():
+    blocks = range_blocks(['10.0.0.0/23', '10.0.1.0/24'])
+    assert blocks == [0x0A0000, 0x0A0001]
+    targets = census_targets(blocks, per_block=2)
+    assert not isinstance(targets, list)  # the sampled uint32 array, not Python ints
+    assert len(targets) == 4
+    assert sorted(int(ip) >> 8 for ip in targets) == [0x0A0000, 0x0A0000, 0x0A0001, 0x0A0001]
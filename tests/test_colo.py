@@ -0,0 +1,52 @@
+"""Trace body parsing and colo include/exclude filtering."""
+
+from app.scanner.colo import SHColoFilter, parse_colo_list, parse_trace
+from app.scanner.core import ip_to_int
+
+TRACE = (b'fl=29f1\nh=example.com\nip=198.51.100.7\nts=1700000000.1\n'
+         b'visit_scheme=https\nuag=curl\ncolo=FRA\nhttp=http/1.1\nloc=IR\ntls=TLSv1.3\n')
+
+
+def test_parse_trace_keeps_known_fields():
+    assert parse_trace(TRACE) == {
+        'fl': '29f1', 'ip': '198.51.100.7', 'colo': 'FRA', 'http': 'http/1.1', 'loc': 'IR', 'tls': 'TLSv1.3',
+    }
+
+
+def test_parse_trace_rejects_other_bodies():
+    assert parse_trace(b'') == {}
+    assert parse_trace(None) == {}
+    assert parse_trace(b'<html>hello</html>') == {}
+    assert parse_trace(b'colo=FRA\n' + b'x' * 5000) == {}
+
+
+def test_parse_colo_list_forms():
+    assert parse_colo_list('fra, ams;lhr') == frozenset({'FRA', 'AMS', 'LHR'})
+    assert parse_colo_list(['fra', ' ams ', '']) == frozenset({'FRA', 'AMS'})
+    assert parse_colo_list(None) == frozenset()
+
+
+def test_allowed_include_exclude_and_unknown():
+    only = SHColoFilter(include='fra,ams')
+    assert only.allowed('fra') and not only.allowed('LHR')
+    never = SHColoFilter(exclude='lhr')
+    assert never.allowed('FRA') and not never.allowed('lhr')
+    assert only.allowed(None) and never.allowed('')
+
+
+def test_block_written_off_after_unwanted_hits_only():
+    colo = SHColoFilter(include='FRA', decide_after=2)
+    bad, mixed = ip_to_int('10.0.0.1'), ip_to_int('10.0.1.1')
+    assert not colo.observe(bad, 'LHR')
+    assert not colo.skip_block(bad + 1)
+    assert not colo.observe(bad + 1, 'LHR')
+    assert colo.skip_block(bad + 2)
+
+    assert colo.observe(mixed, 'FRA')
+    assert not colo.observe(mixed + 1, 'LHR')
+    assert not colo.observe(mixed + 2, 'LHR')
+    assert not colo.skip_block(mixed + 3)
+
+    stats = colo.stats()
+    assert stats['rejected'] == 4 and stats['unwanted_blocks'] == 1 and stats['skipped'] == 1
+    assert stats['colos'] == {'LHR': 4, 'FRA': 1}
@@ -0,0 +1,28 @@
+"""Concurrent extra-port connects: one shared deadline, open ports in the given order."""
+
+import errno
+import socket
+
+from app.scanner.core import SHScanner, _CONNECT_PENDING, _CONNECT_REFUSED
+
+
+def test_connect_many_reports_open_ports_only():
+    listening = socket.socket()
+    listening.bind(('127.0.0.1', 0))
+    listening.listen(8)
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))  # bound, never listening → refused
+    try:
+        open_port, closed_port = listening.getsockname()[1], closed.getsockname()[1]
+        scanner = SHScanner()
+        assert scanner._tcp_connect_many('127.0.0.1', [closed_port, open_port], 2.0) == [open_port]
+    finally:
+        listening.close()
+        closed.close()
+
+
+def test_pending_codes_include_windows_ones():
+    assert {0, errno.EINPROGRESS, errno.EWOULDBLOCK} <= _CONNECT_PENDING
+    if hasattr(errno, 'WSAEWOULDBLOCK'):  # Windows: 10035, not errno.EWOULDBLOCK
+        assert errno.WSAEWOULDBLOCK in _CONNECT_PENDING
+        assert errno.WSAECONNREFUSED in _CONNECT_REFUSED
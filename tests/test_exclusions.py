@@ -0,0 +1,80 @@
+"""Exclusion index lookup and hot reload."""
+
+import os
+from array import array
+
+import pytest
+
+from app.scanner import exclusions as exclusions_mod
+from app.scanner.core import ip_to_int
+from app.scanner.exclusions import SHExclusionIndex, SHExclusions
+
+
+def test_index_parses_and_merges_entries():
+    index = SHExclusionIndex.from_entries([
+        '10.0.0.0/24', '10.0.1.0/24',       # adjacent → one interval
+        '192.0.2.5', '192.0.2.10-192.0.2.6',  # reversed range, adjacent to .5
+        '# comment', '', 'not-an-ip', ip_to_int('198.51.100.1'),
+    ])
+    assert len(index) == 3
+    assert index.invalid == 1
+    assert '10.0.1.255' in index
+    assert '10.0.2.0' not in index
+    assert ip_to_int('192.0.2.8') in index
+    assert '192.0.2.11' not in index
+    assert '198.51.100.1' in index
+    assert index.n_addresses == 512 + 6 + 1
+
+
+def test_union_of_sources():
+    exclusions = SHExclusions()
+    exclusions.set_source('closed', ['10.0.0.1'])
+    exclusions.set_source('known', [ip_to_int('10.0.0.2')])
+    assert ip_to_int('10.0.0.1') in exclusions and ip_to_int('10.0.0.2') in exclusions
+    exclusions.clear_source('closed')
+    assert ip_to_int('10.0.0.1') not in exclusions
+
+
+def test_filter_counts_skipped():
+    exclusions = SHExclusions()
+    exclusions.set_source('file', ['10.0.0.0/30'])
+    base = ip_to_int('10.0.0.0')
+    kept = list(exclusions.filter(range(base, base + 8)))
+    assert kept == list(range(base + 4, base + 8))
+    assert exclusions.skipped == 4
+
+
+def test_filter_picks_up_file_edits_mid_stream(tmp_path):
+    path = tmp_path / 'exclusions.txt'
+    path.write_text('10.0.0.1\n')
+    exclusions = SHExclusions(str(path), check_every=0)
+    exclusions.reload()
+    reloaded = []
+    exclusions.reload_callback = reloaded.append
+
+    base = ip_to_int('10.0.0.0')
+    stream = exclusions.filter(range(base, base + 1024))
+    first = [next(stream) for _ in range(300)]
+    assert base + 1 not in first
+
+    path.write_text('10.0.0.1\n10.0.3.0/24\n')
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 5))
+    rest = list(stream)
+    assert reloaded and reloaded[0]['intervals'] == 2
+    assert all(ip >> 8 != ip_to_int('10.0.3.0') >> 8 for ip in rest)
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_drop_from_uint32_array(monkeypatch, use_numpy):
+    np = pytest.importorskip('numpy') if use_numpy else None
+    if not use_numpy:
+        monkeypatch.setattr(exclusions_mod, 'np', None)
+    exclusions = SHExclusions()
+    exclusions.set_source('file', ['10.0.0.0/30', '10.0.0.9'])
+    ips = [ip_to_int(f'10.0.0.{h}') for h in (1, 4, 9, 10, 3)] + [ip_to_int('9.255.255.255')]
+    arr = np.array(ips, dtype=np.uint32) if use_numpy else array('I', ips)
+    kept = exclusions.drop(arr)
+    assert type(kept) is type(arr)
+    assert list(map(int, kept)) == [ip_to_int('10.0.0.4'), ip_to_int('10.0.0.10'), ip_to_int('9.255.255.255')]
+    assert exclusions.skipped == 3
@@ -0,0 +1,54 @@
+"""Candidate IP generation: per-/24 host sampling and the session stream."""
+
+import pytest
+
+from app.scanner.core import SHCyclicPermutation, SHNetUtils, int_to_ip, ip_to_int
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 3, 4, 10, 254, 1000, 4099])
+def test_cyclic_permutation_visits_every_element_once(n):
+    values = list(SHCyclicPermutation(n))
+    assert len(values) == n
+    assert sorted(values) == list(range(n))
+
+
+def test_cyclic_permutation_is_exhausted_and_randomised():
+    perm = SHCyclicPermutation(50)
+    list(perm)
+    assert perm.next() is None
+    orders = {tuple(SHCyclicPermutation(50)) for _ in range(10)}
+    assert len(orders) > 1
+
+
+def test_iter_scan_ips_never_repeats_and_respects_per_block():
+    ranges = ['10.0.0.0/22', '10.1.0.0/24', '192.0.2.9']
+    ips = [int_to_ip(ip) for ip in SHNetUtils.iter_scan_ips(ranges, per_block=20)]
+    assert len(ips) == len(set(ips)) == 4 * 20 + 20 + 1
+    per_block = {}
+    for ip in ips:
+        block = ip.rsplit('.', 1)[0]
+        per_block[block] = per_block.get(block, 0) + 1
+    assert max(per_block.values()) == 20
+
+
+def test_sample_blocks_draws_distinct_hosts_per_block():
+    bases = [ip_to_int('10.0.0.0'), ip_to_int('10.0.7.0'), ip_to_int('192.0.2.0')]
+    ips = [int(ip) for ip in SHNetUtils.sample_blocks(bases, per_block=30)]
+    assert len(ips) == 90
+    for i, base in enumerate(bases):
+        chunk = ips[i * 30:(i + 1) * 30]
+        assert len(set(chunk)) == 30
+        assert all(base < ip < base + 255 for ip in chunk)
+
+
+def test_sample_blocks_full_block_and_empty():
+    ips = sorted(int(ip) for ip in SHNetUtils.sample_blocks([ip_to_int('10.0.0.0')], per_block=300))
+    assert ips == list(range(ip_to_int('10.0.0.1'), ip_to_int('10.0.0.255')))
+    assert len(SHNetUtils.sample_blocks([], per_block=30)) == 0
+
+
+def test_generate_scan_ips_matches_stream():
+    ranges = ['10.0.0.0/23', '192.0.2.9']
+    ips = SHNetUtils.generate_scan_ips(ranges, per_block=5)
+    assert len(ips) == len(set(ips)) == SHNetUtils.count_scan_ips(ranges, per_block=5) == 11
+    assert '192.0.2.9' in ips
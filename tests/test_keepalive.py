@@ -0,0 +1,77 @@
+"""Trace check against an edge that drops the idle keep-alive after every response."""
+
+import socket
+import threading
+
+import pytest
+
+from app.scanner.cdnprofile import SHProbeProfile
+from app.scanner.core import SHScanner
+from app.scanner.probes import SHProbeTimings, SHTraceProber
+
+BODY = b'fl=1\ncolo=FRA\nloc=IR\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(BODY), BODY)
+
+
+@pytest.fixture
+def dropping_server():
+    """Answers one request per connection, then closes without Connection: close."""
+    srv = socket.socket()
+    srv.bind(('127.0.0.1', 0))
+    srv.listen(16)
+    accepted = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            accepted.append(conn)
+            try:
+                conn.recv(4096)
+                conn.sendall(RESPONSE)
+            except OSError:
+                pass
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield srv.getsockname()[1], accepted
+    srv.close()
+
+
+def test_prober_reconnects_once_per_dropped_keepalive(dropping_server):
+    port, accepted = dropping_server
+    prober = SHTraceProber('example.com', '/', 'test', https_ports=(), attempts=3)
+    timings = SHProbeTimings()
+    successes, attempts, _ = prober.run('127.0.0.1', port, [2.0] * 3, 10, timings=timings)
+    assert (successes, attempts) == (3, 3)
+    assert len(accepted) == 3
+
+
+def test_prober_stops_on_cold_connect_failure():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))  # never listening → refused
+    port = sock.getsockname()[1]
+    try:
+        prober = SHTraceProber('example.com', '/', 'test', https_ports=(), attempts=3)
+        assert prober.run('127.0.0.1', port, [1.0] * 3, 10)[:2] == (0, 1)
+    finally:
+        sock.close()
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_edge_that_drops_keepalive_still_verifies(dropping_server, engine):
+    port, _ = dropping_server
+    scanner = SHScanner()
+    scanner.set_engine(engine)
+    scanner.probe_profiles.profiles = {
+        'local': SHProbeProfile('local', 'example.com', '/', ports=[port], https_ports=[]),
+    }
+    scanner.probe_profiles.configure(force='local')
+    scanner.set_strategy('trace')
+    try:
+        results = scanner.batch_scan(['127.0.0.1'], [port])
+    finally:
+        scanner.close_pool()
+    assert [r['ip'] for r in results] == ['127.0.0.1']
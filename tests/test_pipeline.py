@@ -0,0 +1,37 @@
+"""Staged pipeline: tier split and stage plan."""
+
+from app.scanner.pipeline import SHScanPipeline, VERIFY_MIN_WORKERS, split_tiers
+
+
+def test_split_tiers_at_trace():
+    assert split_tiers(['tcp', 'tls', 'trace']) == (('tcp', 'tls'), ('trace',))
+    assert split_tiers(('tcp', 'trace')) == (('tcp',), ('trace',))
+    assert split_tiers(['trace']) == ((), ('trace',))
+    assert split_tiers(['tcp', 'tls']) == (('tcp', 'tls'), ())
+
+
+def test_plan_is_active_only_with_both_stages():
+    pipeline = SHScanPipeline()
+    assert pipeline.plan(['tcp', 'tls', 'trace'], 200)
+    assert not pipeline.plan(['trace'], 200)
+    assert not pipeline.plan(['tcp', 'tls'], 200)
+    pipeline.configure(enabled=False)
+    assert not pipeline.plan(['tcp', 'trace'], 200)
+    assert pipeline.snapshot() == []
+
+
+def test_plan_sizes_verify_pool_and_queue():
+    pipeline = SHScanPipeline()
+    pipeline.plan(['tcp', 'trace'], 400)
+    assert pipeline.prefilter_tiers == ('tcp',) and pipeline.verify_tiers == ('trace',)
+    assert pipeline.verify_pool == 100 and pipeline.queue_max == 200
+
+    pipeline.plan(['tcp', 'trace'], 20)
+    assert pipeline.verify_pool == VERIFY_MIN_WORKERS
+
+    pipeline.plan(['tcp', 'trace'], 8)
+    assert pipeline.verify_pool == 8  # never more than the prefilter pool
+
+    pipeline.configure(verify_workers=10, queue_size=5)
+    pipeline.plan(['tcp', 'trace'], 400)
+    assert pipeline.verify_pool == 10 and pipeline.queue_max == 5
@@ -0,0 +1,82 @@
+"""Staged pipeline: handoff slots survive a stop and follow a new queue size."""
+
+import socket
+import threading
+
+import pytest
+
+from app.scanner.cdnprofile import SHProbeProfile
+from app.scanner.core import SHScanner
+
+
+@pytest.fixture
+def silent_edge():
+    """Completes TCP handshakes (listen backlog) but never answers a request."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+def _pipelined_scanner(port, queue_size, engine='thread'):
+    scanner = SHScanner()
+    scanner.set_engine(engine)
+    scanner.probe_profiles.profiles = {
+        'local': SHProbeProfile('local', 'example.com', '/', ports=[port], https_ports=[]),
+    }
+    scanner.probe_profiles.configure(force='local')
+    scanner.set_strategy('tcp,trace')
+    scanner.set_pipeline(True, verify_workers=1, queue_size=queue_size)
+    return scanner
+
+
+def _free_slots(slots, most):
+    n = 0
+    while n < most + 1 and slots.acquire(blocking=False):
+        n += 1
+    return n
+
+
+def test_stop_returns_every_slot(silent_edge):
+    scanner = _pipelined_scanner(silent_edge, queue_size=3)
+    timer = threading.Timer(0.5, scanner.stop)
+    timer.start()
+    try:
+        scanner.batch_scan(['127.0.0.1'] * 40, [silent_edge])
+        slots = scanner._handoff_slots
+        scanner._pool.shutdown(wait=True)  # pre-filters that were still running at the stop
+        assert _free_slots(slots, 3) == 3
+    finally:
+        timer.cancel()
+        scanner.close_pool()
+
+
+def test_new_queue_size_gets_a_new_semaphore(silent_edge):
+    scanner = _pipelined_scanner(silent_edge, queue_size=2)
+    try:
+        scanner.stop()
+        scanner.batch_scan([], [silent_edge])
+        first = scanner._handoff_slots
+        scanner.set_pipeline(True, verify_workers=1, queue_size=5)
+        scanner.batch_scan([], [silent_edge])
+        assert scanner._handoff_slots is not first
+        assert _free_slots(scanner._handoff_slots, 5) == 5
+    finally:
+        scanner.close_pool()
+
+
+def test_async_stop_returns_every_slot(silent_edge):
+    scanner = _pipelined_scanner(silent_edge, queue_size=3, engine='async')
+    timer = threading.Timer(0.5, scanner.stop)
+    timer.start()
+    try:
+        scanner.batch_scan(['127.0.0.1'] * 40, [silent_edge])
+        engine = scanner._async_engine
+        assert engine._slots._value == 3  # asyncio.Semaphore: acquire() needs the loop
+        scanner.set_pipeline(True, verify_workers=1, queue_size=5)
+        scanner.batch_scan([], [silent_edge])
+        assert engine._slots._value == 5
+    finally:
+        timer.cancel()
+        scanner.close_pool()
@@ -0,0 +1,62 @@
+"""Verification policies: early stop / SPRT decisions agree with the final validity rule."""
+
+from app.scanner.policy import make_verify_policy, SHSPRTPolicy
+from app.scanner.probes import SHProbeTimings
+
+
+def _timings(*requests):
+    """requests: (ttfb_ms, warm) pairs."""
+    timings = SHProbeTimings()
+    for ttfb, warm in requests:
+        timings.add_request(ttfb, warm)
+    return timings
+
+
+def test_sprt_accepts_after_three_clean_successes():
+    policy = make_verify_policy('sprt', 5, 3)
+    timings = _timings((120, False), (40, True), (42, True))
+    assert policy.decide(1, 1, 200, 500, timings) is None
+    assert policy.decide(2, 2, 250, 500, timings) is None
+    assert policy.decide(3, 3, 300, 500, timings) is True
+
+
+def test_sprt_rejects_when_min_success_out_of_reach():
+    policy = make_verify_policy('sprt', 5, 3)
+    assert policy.decide(0, 3, 300, 500, _timings()) is False
+
+
+def test_slow_handshake_is_not_rejected_when_rtt_is_fast():
+    # attempt 1 took 1600 ms wall (connect + TLS) but the request itself 400 ms
+    policy = make_verify_policy('sprt', 5, 3)
+    timings = _timings((400, False))
+    assert policy.decide(1, 1, 1600, 500, timings) is None
+    assert policy.latency(timings, 1600, 1) == 400
+    assert policy.is_valid(3, policy.latency(timings, 1600, 1), 500)
+
+
+def test_rtt_hopeless_only_when_median_cannot_come_under():
+    policy = make_verify_policy('early', 5, 3)
+    slow = _timings((900, False), (900, True), (900, True), (900, True))
+    # 3 slow warm samples + 1 remaining: median of 4 stays slow
+    assert policy.decide(1, 4, 3600, 500, slow) is False
+    mixed = _timings((900, False), (900, True), (100, True))
+    assert policy.decide(1, 3, 1900, 500, mixed) is None
+
+
+def test_accept_uses_same_latency_as_final_check():
+    policy = make_verify_policy('early', 5, 3)
+    timings = _timings((300, False), (600, True), (650, True))
+    verdict = policy.decide(3, 3, 1550, 500, timings)
+    assert verdict is False
+    assert verdict == policy.is_valid(3, policy.latency(timings, 1550, 3), 500)
+
+
+def test_without_timings_falls_back_to_wall_time():
+    policy = SHSPRTPolicy(5, 3)
+    assert policy.decide(1, 1, 1600, 500) is False
+    assert policy.latency(None, 900, 3) == 300
+
+
+def test_full_policy_never_stops():
+    policy = make_verify_policy('full', 5, 3)
+    assert policy.decide(0, 4, 9000, 500, _timings()) is None
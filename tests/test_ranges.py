@@ -0,0 +1,63 @@
+"""Range normalization (SHRangeIndex) and generator weights."""
+
+from collections import Counter
+
+from app.scanner.core import SHNetUtils, ip_to_int
+from app.scanner.ranges import SHRangeIndex
+
+
+def test_build_merges_overlaps_with_provenance():
+    index = SHRangeIndex.build({
+        'a': ['10.0.0.0/23', '10.0.1.0/24'],
+        'b': ['10.0.1.0/24', '10.0.2.0/24'],
+    })
+    assert index.to_cidrs() == [
+        ('10.0.0.0/24', frozenset({'a'})),
+        ('10.0.1.0/24', frozenset({'a', 'b'})),
+        ('10.0.2.0/24', frozenset({'b'})),
+    ]
+    stats = index.stats()
+    assert stats['blocks'] == 3
+    assert stats['duplicate_blocks'] == 2
+
+
+def test_adjacent_same_source_merges_and_single_ips():
+    index = SHRangeIndex.build({'a': ['10.0.0.0/24', '10.0.1.0/24', '10.0.0.7', '192.0.2.1']})
+    assert index.to_cidrs() == [('10.0.0.0/23', frozenset({'a'})), ('192.0.2.1', frozenset({'a'}))]
+    assert index.lookup('10.0.1.200') == frozenset({'a'})
+    assert index.lookup(ip_to_int('192.0.2.1')) == frozenset({'a'})
+    assert index.lookup('192.0.2.2') is None
+
+
+def test_cdn_of_maps_sources():
+    index = SHRangeIndex.build({'sh_api': ['104.16.0.0/24'], 'fastly_api': ['151.101.0.0/24']})
+    assert index.cdn_of('104.16.0.1') == {'cloudflare'}
+    assert index.cdn_of('151.101.0.1') == {'fastly'}
+    assert index.cdn_of('8.8.8.8') == set()
+
+
+def test_source_weighting_is_round_robin_inside_a_source():
+    index = SHRangeIndex.build({'input': ['104.16.0.0/12', '1.1.1.0/24', '8.8.4.0/24']})
+    cidrs = [c for c, _ in index.to_cidrs()]
+    weights = index.weights_for(cidrs)
+    assert len(set(weights)) == 1
+
+    ips = list(SHNetUtils.iter_scan_ips(cidrs, per_block=30, max_total=300, weights=weights))
+    per_range = Counter(ip >> 8 for ip in ips)
+    assert per_range[ip_to_int('1.1.1.0') >> 8] == 30
+    assert per_range[ip_to_int('8.8.4.0') >> 8] == 30
+
+
+def test_source_weighting_splits_share_between_sources():
+    index = SHRangeIndex.build({'a': ['10.0.0.0/16', '10.1.0.0/24'], 'b': ['10.2.0.0/24']})
+    cidrs = [c for c, _ in index.to_cidrs()]
+    weights = dict(zip(cidrs, index.weights_for(cidrs)))
+    assert weights == {'10.0.0.0/16': 0.5, '10.1.0.0/24': 0.5, '10.2.0.0/24': 1.0}
+
+
+def test_size_and_entry_weighting():
+    index = SHRangeIndex.build({'input': ['10.0.0.0/22', '10.1.0.0/24']})
+    cidrs = [c for c, _ in index.to_cidrs()]
+    assert index.weights_for(cidrs, 'size') == [4.0, 1.0]
+    assert index.weights_for(cidrs, 'entry') == [1.0, 1.0]
+    assert index.weights_for(cidrs, 'learned', lambda cidr: 1.0) == [4 * 1.05, 1.05]
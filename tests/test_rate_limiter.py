@@ -0,0 +1,48 @@
+"""SHRateLimiter: GCRA spacing, burst allowance and per-/24 limits."""
+
+import pytest
+
+from app.scanner import control
+from app.scanner.control import SHRateLimiter
+from app.scanner.core import ip_to_int
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    """reserve() only books slots; a fixed clock keeps the expected delays exact."""
+    monkeypatch.setattr(control.time, 'monotonic', lambda: 1000.0)
+
+
+def _delays(limiter, n, ip='10.0.0.1'):
+    return [round(limiter.reserve(ip_to_int(ip)), 3) for _ in range(n)]
+
+
+def test_burst_goes_out_back_to_back_then_spaced():
+    limiter = SHRateLimiter(rate=100, burst=10)
+    delays = _delays(limiter, 13)
+    assert delays[:10] == [0.0] * 10
+    assert delays[10:] == [0.01, 0.02, 0.03]
+
+
+def test_burst_of_one_is_evenly_spaced():
+    limiter = SHRateLimiter(rate=100, burst=1)
+    assert _delays(limiter, 4) == [0.0, 0.01, 0.02, 0.03]
+
+
+def test_long_run_rate_is_kept():
+    limiter = SHRateLimiter(rate=50, burst=5)
+    delays = _delays(limiter, 105)
+    # 105 connects at 50/s with 5 free: the last waits (105 - 5) / 50 s
+    assert abs(delays[-1] - 2.0) < 0.01
+
+
+def test_per_block_rate_only_spaces_the_same_24():
+    limiter = SHRateLimiter(per_block_rate=10)
+    assert round(limiter.reserve(ip_to_int('10.0.0.1')), 3) == 0.0
+    assert round(limiter.reserve(ip_to_int('10.0.0.2')), 3) == 0.1
+    assert round(limiter.reserve(ip_to_int('10.0.1.1')), 3) == 0.0
+
+
+def test_disabled_without_rates():
+    assert not SHRateLimiter().enabled
+    assert SHRateLimiter(rate=5).enabled
@@ -0,0 +1,63 @@
+"""Probe strategy parsing and tier chains."""
+
+import socket
+
+import pytest
+
+from app.scanner.strategy import parse_strategy, SHProbeStrategy, DEFAULT_STRATEGY
+from app.scanner.cdnprofile import SHProbeProfile
+from app.scanner.core import SHScanner
+
+
+def test_parse_presets_and_lists():
+    assert parse_strategy(None) == DEFAULT_STRATEGY
+    assert parse_strategy('check') == ('tcp', 'trace')
+    assert parse_strategy('funnel') == ('tcp', 'tls', 'trace')
+    # any separator, any order → cost order
+    assert parse_strategy('trace>tcp') == ('tcp', 'trace')
+    assert parse_strategy('TLS + tcp') == ('tcp', 'tls')
+    assert parse_strategy(['tls']) == ('tls',)
+
+
+@pytest.mark.parametrize('spec', ['foo', 'tls,bogus', ',', ' > '])
+def test_parse_rejects_unknown_or_empty(spec):
+    with pytest.raises(ValueError):
+        parse_strategy(spec)
+
+
+def test_stats_count_rejections():
+    strategy = SHProbeStrategy('tcp,trace')
+    strategy.record('tcp', True, 0.01)
+    strategy.record('tcp', False, 0.01)
+    strategy.record('trace', True, 0.2)
+    strategy.record('tls', True, 0.1)  # not in the chain: ignored
+    tcp, trace = strategy.stats()['tiers']
+    assert (tcp['entered'], tcp['passed'], tcp['rejection_rate']) == (2, 1, 0.5)
+    assert (trace['entered'], trace['passed'], trace['rejection_rate']) == (1, 1, 0.0)
+
+
+def _scanner_for_port(port, strategy):
+    scanner = SHScanner()
+    scanner.probe_profiles.profiles = {
+        'local': SHProbeProfile('local', 'example.com', '/', ports=[port], https_ports=[]),
+    }
+    scanner.probe_profiles.configure(force='local')
+    scanner.set_strategy(strategy)
+    return scanner
+
+
+@pytest.mark.parametrize('strategy', ['tls', 'tcp,tls'])
+def test_tls_tier_on_plain_port_needs_a_connect(strategy):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    open_port = listener.getsockname()[1]
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]  # bound, not listening → refused
+    try:
+        assert _scanner_for_port(open_port, strategy).check('127.0.0.1', [open_port]) is not None
+        assert _scanner_for_port(closed_port, strategy).check('127.0.0.1', [closed_port]) is None
+    finally:
+        listener.close()
+        closed.close()
@@ -0,0 +1,34 @@
+"""TLS session cache counters and the handshake CPU estimate."""
+
+from app.scanner.probes import SHTLSSessionCache
+
+
+def test_cpu_saving_from_timed_handshakes():
+    cache = SHTLSSessionCache()
+    cache.record_handshake(False, 0.004)
+    cache.record_handshake(True, 0.001)
+    cache.record_handshake(True, 0.001)
+    stats = cache.stats()
+    assert (stats['resumed'], stats['full']) == (2, 1)
+    assert stats['avg_full_cpu_ms'] == 4.0 and stats['avg_resumed_cpu_ms'] == 1.0
+    assert stats['cpu_saved_ms'] == 6.0
+
+
+def test_untimed_handshakes_report_no_saving():
+    cache = SHTLSSessionCache()
+    cache.record_handshake(False)
+    cache.record_handshake(True)
+    stats = cache.stats()
+    assert (stats['resumed'], stats['full']) == (1, 1)
+    assert stats['cpu_saved_ms'] is None and stats['avg_full_cpu_ms'] is None
+
+
+def test_sessions_rotate_per_sni_and_count_lookups():
+    cache = SHTLSSessionCache(per_sni=2)
+    assert cache.get('a.example') is None
+    cache.put('a.example', 's1')
+    cache.put('a.example', 's2')
+    cache.put('a.example', 's3')  # oldest dropped
+    assert {cache.get('a.example'), cache.get('a.example')} == {'s2', 's3'}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)